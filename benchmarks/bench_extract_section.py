@@ -0,0 +1,83 @@
+"""Micro-benchmark of preprocess.extract_section on a synthetic 1,000-page text.
+
+Compares the single-pass heading scan with the previous nested-loop
+implementation, which rescanned the text once per marker combination.
+Both extract_section and extract_sections run one compiled regex over the
+text; it starts with a newline, so re only tries the line starts. The scan is
+faster than the old loop whether or not the section is present.
+
+    python benchmarks/bench_extract_section.py [--pages 1000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from preprocess import ACK_END_MARKERS, ACK_START_MARKERS, extract_section, extract_sections
+
+WORDS = ("graph knowledge model data paper result method analysis network learning "
+         "semantic entity topic embedding corpus evaluation baseline experiment").split()
+
+
+def legacy_extract_section(text, start_markers, end_markers):
+    """The nested-loop implementation extract_section replaced."""
+    lower_text = text.lower()
+    for start_marker in start_markers:
+        for end_marker in end_markers:
+            try:
+                start = lower_text.index(start_marker.lower())
+                end = lower_text.index(end_marker.lower(), start)
+                return text[start:end].strip()
+            except ValueError:
+                continue
+    return ""
+
+
+def synthetic_text(pages, chars_per_page=3000, with_sections=True):
+    rng = random.Random(0)
+    body = []
+    for _ in range(pages):
+        words, length = [], 0
+        while length < chars_per_page:
+            word = rng.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        body.append(" ".join(words))
+    if with_sections:
+        body.append("Acknowledgements\nWe thank the National Science Foundation.")
+        body.append("Funding\nThis work was supported by the ERC.")
+        body.append("References\n[1] A. Author. A paper.")
+    return "\n\f".join(body)
+
+
+def timed(fn, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=1000)
+    args = parser.parse_args()
+
+    for label, with_sections in (("section present", True), ("no markers", False)):
+        text = synthetic_text(args.pages, with_sections=with_sections)
+        legacy_time, legacy = timed(legacy_extract_section, text, ACK_START_MARKERS, ACK_END_MARKERS)
+        new_time, new = timed(extract_section, text, ACK_START_MARKERS, ACK_END_MARKERS)
+        sections_time, _ = timed(extract_sections, text)
+        assert new == legacy, "extract_section disagrees with the legacy implementation"
+        print(f"{label} ({len(text) / 1e6:.1f} MB): legacy {legacy_time * 1000:.1f} ms, "
+              f"extract_section {new_time * 1000:.1f} ms ({legacy_time / new_time:.1f}x), "
+              f"extract_sections {sections_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
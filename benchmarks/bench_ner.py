@@ -0,0 +1,75 @@
+"""Throughput of per-document vs batched NER over synthetic acknowledgements.
+
+Downloads dslim/bert-base-NER on first use.
+
+    python benchmarks/bench_ner.py [--docs 256] [--batch-size 16] [--workers 2]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import ner_ack
+
+PEOPLE = ["Maria Garcia", "John Smith", "Wei Zhang", "Ana Souza", "Peter Müller", "Aisha Khan"]
+ORGS = ["National Science Foundation", "European Research Council", "University of Oxford",
+        "Max Planck Society", "Spanish Ministry of Science", "Wellcome Trust"]
+TEMPLATES = [
+    "We thank {p} for helpful discussions.",
+    "This work was supported by the {o} under grant {n}.",
+    "{p} and {q} provided the data used in this study.",
+    "Computing resources were provided by the {o}.",
+]
+
+
+def synthetic_acknowledgements(n_docs, seed=0):
+    rng = random.Random(seed)
+    docs = []
+    for _ in range(n_docs):
+        # Lengths vary from one sentence to several hundred tokens, as in real papers
+        sentences = [
+            rng.choice(TEMPLATES).format(p=rng.choice(PEOPLE), q=rng.choice(PEOPLE),
+                                         o=rng.choice(ORGS), n=rng.randint(1000, 9999))
+            for _ in range(rng.choice([1, 2, 4, 8, 30]))
+        ]
+        docs.append("Acknowledgements " + " ".join(sentences))
+    return docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=ner_ack.NER_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=0, help="also time the process pool")
+    args = parser.parse_args()
+
+    docs = synthetic_acknowledgements(args.docs)
+    ner = ner_ack.load_ner_pipeline()
+    chunks = [chunk for doc in docs for chunk in ner_ack.chunk_text(doc, ner.tokenizer)]
+
+    start = time.perf_counter()
+    for doc in docs:
+        ner(doc)
+    per_doc = time.perf_counter() - start
+    print(f"per-document loop:       {len(docs) / per_doc:8.1f} docs/s")
+
+    start = time.perf_counter()
+    ner_ack.run_ner(ner, chunks, batch_size=args.batch_size)
+    batched = time.perf_counter() - start
+    print(f"batched (size {args.batch_size:>3}):      {len(docs) / batched:8.1f} docs/s "
+          f"({per_doc / batched:.1f}x, {len(chunks)} windows)")
+
+    if args.workers > 1:
+        start = time.perf_counter()
+        ner_ack.run_ner_parallel(chunks, workers=args.workers)
+        parallel = time.perf_counter() - start
+        print(f"process pool ({args.workers} workers): {len(docs) / parallel:8.1f} docs/s "
+              f"({per_doc / parallel:.1f}x, includes model loading)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""End-to-end benchmark of the pipeline on a synthetic corpus, checked against a stored baseline.
+
+Generates a corpus with synthetic_corpus.py in a temporary directory, starts
+the stub servers (stub_servers.py), and times each stage:
+
+* preprocess_papers (GROBID stub)
+* the embedding cache, filled by SyntheticEncoder instead of the real model
+* compute_similarity
+* enrich_entities / enrich_ror (Wikidata and ROR stubs, empty lookup cache)
+* create_kg
+* load_kg for every backend, PaperViews
+* every kg_utils.get_* query: the per-paper ones on a sample of papers, cold
+
+NER and topic modelling need model downloads and are not timed; their outputs
+come from the generator. Each time is compared with benchmarks/baseline.json
+for the same scale. Exceeding the baseline by more than --tolerance (and by
+more than --min-delta seconds, to ignore timer noise) counts as a regression
+and fails with exit code 1. Baselines depend on the machine, so refresh them
+with --update-baseline on the machine that runs the comparison.
+
+    python benchmarks/bench_pipeline.py [--scale 1k|10k|100k] [--latency 0.01] [--update-baseline]
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+import corpus
+import metrics
+from stub_servers import StubServers
+from synthetic_corpus import SCALES, SyntheticEncoder, generate_corpus
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+# Papers queried per kg_utils.get_* function that takes a paper URI
+QUERY_SAMPLE = 200
+
+
+def timed(name, function, *args):
+    """Run function(*args) as a measured stage; returns its wall time in seconds."""
+    with metrics.registry.stage(name, name):
+        function(*args)
+    return metrics.registry.stages[name]["wall_seconds"]
+
+
+def fill_embedding_cache(embedding_cache):
+    abstracts = corpus.load_corpus().column("abstract")
+    embedding_cache.shared_cache().encode(abstracts, model=SyntheticEncoder())
+
+
+def run_benchmarks(n_papers, latency):
+    """Time every stage in a fresh working directory; returns {name: seconds}."""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, StubServers(latency) as stubs:
+        os.chdir(directory)
+        start = time.perf_counter()
+        generate_corpus(directory, n_papers)
+        print(f"Synthetic corpus of {n_papers} papers generated in {time.perf_counter() - start:.1f}s")
+
+        # Stage modules read their settings at import time
+        os.environ.update(stubs.environment)
+        os.environ.update({"KG_SQLITE": "1", "WIKIDATA_RATE": "100000", "ROR_RATE": "100000"})
+        modules = {name: importlib.import_module(name) for name in (
+            "preprocess", "embedding_cache", "similarity", "wikidata_enrich", "ror_enrich", "build_kg", "kg_utils")}
+        kg_utils = modules["kg_utils"]
+
+        results["preprocess_papers"] = timed("preprocess_papers", modules["preprocess"].preprocess_papers)
+        results["embedding_cache"] = timed("embedding_cache", fill_embedding_cache, modules["embedding_cache"])
+        results["compute_similarity"] = timed("compute_similarity", modules["similarity"].compute_similarity)
+        results["enrich_entities"] = timed("enrich_entities", modules["wikidata_enrich"].enrich_entities)
+        results["enrich_ror"] = timed("enrich_ror", modules["ror_enrich"].enrich_ror)
+        results["create_kg"] = timed("create_kg", modules["build_kg"].create_kg)
+
+        graphs = {}
+        for backend in ("snapshot", "sqlite", "rdf"):
+            name = f"load_kg[{backend}]"
+            results[name] = timed(name, lambda backend=backend: graphs.setdefault(backend, kg_utils.load_kg(backend=backend)))
+        g = graphs["snapshot"]
+        results["PaperViews"] = timed("PaperViews", kg_utils.PaperViews, g)
+
+        papers = [paper["uri"] for paper in kg_utils.get_all_papers(g)]
+        sample = random.Random(0).sample(papers, min(QUERY_SAMPLE, len(papers)))
+        for function in (kg_utils.get_papers_by_topic, kg_utils.get_all_papers, kg_utils.get_organizations):
+            kg_utils.query_cache.clear()
+            results[function.__name__] = timed(function.__name__, function, g)
+        for function in (kg_utils.get_paper_details, kg_utils.get_similar_papers,
+                         kg_utils.get_people_by_paper, kg_utils.get_organizations_by_paper):
+            kg_utils.query_cache.clear()
+            name = f"{function.__name__} x{len(sample)}"
+            results[name] = timed(name, lambda function=function: [function(g, uri) for uri in sample])
+        os.chdir(BENCH_DIR)
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """Print results next to the baseline; returns the names that regressed."""
+    regressions = []
+    print(f"\n{'benchmark':<40}{'seconds':>10}{'baseline':>10}{'ratio':>8}")
+    for name, seconds in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            print(f"{name:<40}{seconds:>10.3f}{'-':>10}{'':>8}  new")
+            continue
+        ratio = seconds / expected if expected else float("inf")
+        regressed = seconds > expected * tolerance and seconds - expected > min_delta
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<40}{seconds:>10.3f}{expected:>10.3f}{ratio:>7.2f}x" + ("  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--papers", type=int, default=None, help="overrides --scale; not compared with a baseline")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the stub servers wait per request")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown factor")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="slowdowns below this many seconds are ignored")
+    parser.add_argument("--output", help="also write the results and stage metrics to this JSON file")
+    args = parser.parse_args()
+
+    n_papers = args.papers or SCALES[args.scale]
+    key = f"{args.scale}@{args.latency}s" if not args.papers else None
+    results = run_benchmarks(n_papers, args.latency)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"papers": n_papers, "results": results, "metrics": metrics.registry.report()}, f, indent=2)
+
+    try:
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+
+    if args.update_baseline:
+        if key is None:
+            raise SystemExit("--update-baseline needs --scale, not --papers")
+        baselines[key] = {"papers": n_papers, "python": platform.python_version(),
+                          "machine": platform.machine(), "results": results}
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        compare(results, {}, args.tolerance, args.min_delta)
+        print(f"\nBaseline for {key} written to {args.baseline}")
+        return
+
+    baseline = baselines.get(key, {}).get("results", {}) if key else {}
+    if not baseline:
+        print(f"\nNo baseline for {key or f'{n_papers} papers'} in {args.baseline}; run with --update-baseline")
+    regressions = compare(results, baseline, args.tolerance, args.min_delta)
+    if regressions:
+        print(f"\nPERFORMANCE REGRESSION in {len(regressions)} benchmark(s) "
+              f"(> {args.tolerance}x baseline): {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Cold vs warm latency of the kg_utils SPARQL queries on a synthetic graph.
+
+Compares, per query, the old style (URI formatted into the query text and
+parsed on every call), a prepared query on a cold result cache, and the same
+call again once its result is cached. About 20 triples per paper, so the
+default 50k papers give a graph of ~1M triples.
+
+    python benchmarks/bench_queries.py [--papers 50000] [--backend snapshot] [--queries 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import rdflib
+
+import kg_snapshot
+import kg_store
+import kg_utils
+
+EX = rdflib.Namespace("http://example.org/")
+DCTERMS = rdflib.Namespace("http://purl.org/dc/terms/")
+FOAF = rdflib.Namespace("http://xmlns.com/foaf/0.1/")
+WORDS = ["graph", "neural", "protein", "quantum", "climate", "network", "learning", "model",
+         "data", "analysis", "survey", "method", "energy", "language", "vision", "control"]
+
+# (name, function, old-style SPARQL with %s for the paper URI)
+QUERIES = [
+    ("get_paper_details", kg_utils.get_paper_details, """
+    PREFIX dcterms: <http://purl.org/dc/terms/>
+    SELECT ?title ?abstract WHERE {
+      BIND (<%s> AS ?paper)
+      ?paper dcterms:title ?title ;
+             dcterms:abstract ?abstract .
+    }"""),
+    ("get_similar_papers", kg_utils.get_similar_papers, """
+    PREFIX ex: <http://example.org/>
+    SELECT ?similar ?title WHERE {
+      BIND (<%s> AS ?paper)
+      ?paper ex:similar_to ?similar .
+      ?similar <http://purl.org/dc/terms/title> ?title .
+    }"""),
+    ("get_people_by_paper", kg_utils.get_people_by_paper, """
+    PREFIX ex: <http://example.org/>
+    PREFIX foaf: <http://xmlns.com/foaf/0.1/>
+    SELECT DISTINCT ?person ?name WHERE {
+      BIND (<%s> AS ?paper)
+      ?paper ex:acknowledges ?person .
+      ?person a foaf:Person ;
+              foaf:name ?name .
+    }"""),
+    ("get_organizations_by_paper", kg_utils.get_organizations_by_paper, """
+    PREFIX ex: <http://example.org/>
+    PREFIX foaf: <http://xmlns.com/foaf/0.1/>
+    SELECT DISTINCT ?org ?name WHERE {
+      BIND (<%s> AS ?paper)
+      ?paper ex:acknowledges ?org .
+      ?org a foaf:Organization ;
+           foaf:name ?name .
+    }"""),
+]
+
+
+def synthetic_triples(n_papers, seed=0):
+    """Triples shaped like build_kg.py output: papers, topics, authors, acknowledgements, similarity."""
+    rng = random.Random(seed)
+    n_people, n_orgs, n_topics = max(1, n_papers // 4), max(1, n_papers // 50), max(1, n_papers // 500)
+    for i in range(n_people):
+        person = EX[f"person_{i}"]
+        yield person, rdflib.RDF.type, FOAF.Person
+        yield person, FOAF.name, rdflib.Literal(f"Person {i}")
+    for i in range(n_orgs):
+        org = EX[f"org_{i}"]
+        yield org, rdflib.RDF.type, FOAF.Organization
+        yield org, FOAF.name, rdflib.Literal(f"Organization {i}")
+    for i in range(n_topics):
+        yield EX[f"topic_{i}"], rdflib.RDF.type, EX.Topic
+        yield EX[f"topic_{i}"], DCTERMS.identifier, rdflib.Literal(str(i))
+
+    for i in range(n_papers):
+        paper = EX[f"paper_{i}"]
+        yield paper, rdflib.RDF.type, EX.Paper
+        yield paper, DCTERMS.title, rdflib.Literal(" ".join(rng.choices(WORDS, k=6)).capitalize() + f" {i}")
+        yield paper, DCTERMS.abstract, rdflib.Literal(" ".join(rng.choices(WORDS, k=120)))
+        yield paper, EX.identifier, rdflib.Literal(str(i))
+        yield paper, EX.belongs_to_topic, EX[f"topic_{rng.randrange(n_topics)}"]
+        for _ in range(4):
+            yield paper, DCTERMS.creator, EX[f"person_{rng.randrange(n_people)}"]
+        for _ in range(3):
+            yield paper, EX.acknowledges, EX[f"person_{rng.randrange(n_people)}"]
+        for _ in range(2):
+            yield paper, EX.acknowledges, EX[f"org_{rng.randrange(n_orgs)}"]
+        for _ in range(3):
+            other = EX[f"paper_{rng.randrange(n_papers)}"]
+            yield paper, EX.similar_to, other
+            yield other, EX.similar_to, paper
+
+
+def build_graph(n_papers, backend, directory):
+    start = time.perf_counter()
+    if backend == "memory":
+        g = rdflib.Graph()
+        for triple in synthetic_triples(n_papers):
+            g.add(triple)
+    else:
+        builder = kg_snapshot.SnapshotBuilder() if backend == "snapshot" else \
+            kg_store.SqliteBuilder(os.path.join(directory, "kg.sqlite"))
+        for triple in synthetic_triples(n_papers):
+            builder.add(*(kg_store.encode_term(t) for t in triple))
+        if backend == "snapshot":
+            builder.save(os.path.join(directory, "kg_snapshot"))
+            g = kg_snapshot.load_snapshot(os.path.join(directory, "kg_snapshot"))
+        else:
+            builder.save()
+            g = kg_store.load_sqlite(os.path.join(directory, "kg.sqlite"))
+    print(f"{backend} graph with {len(g)} triples ready in {time.perf_counter() - start:.1f}s")
+    return g
+
+
+def percentiles(seconds):
+    seconds = sorted(seconds)
+    return (seconds[len(seconds) // 2] * 1000,
+            seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--papers", type=int, default=50000)
+    parser.add_argument("--backend", choices=["memory", "snapshot", "sqlite"], default="snapshot")
+    parser.add_argument("--queries", type=int, default=200, help="papers queried per function")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        g = build_graph(args.papers, args.backend, directory)
+        papers = [EX[f"paper_{i}"] for i in random.Random(1).sample(range(args.papers), args.queries)]
+
+        print(f"\n{'query':<28}{'formatted p50/p95':>20}{'cold p50/p95':>20}{'warm p50/p95':>20}  (ms)")
+        for name, function, formatted_query in QUERIES:
+            formatted, cold, warm = [], [], []
+            kg_utils.query_cache.clear()
+            for paper in papers:
+                start = time.perf_counter()
+                list(g.query(formatted_query % paper))
+                formatted.append(time.perf_counter() - start)
+                for timings in (cold, warm):
+                    start = time.perf_counter()
+                    function(g, str(paper))
+                    timings.append(time.perf_counter() - start)
+            print(f"{name:<28}" + "".join(f"{'%.2f / %.2f' % percentiles(t):>20}"
+                                          for t in (formatted, cold, warm)))
+
+        print("\nQuery cache stats:")
+        print(kg_utils.query_cache.report().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Local stand-ins for GROBID, the Wikidata search API and the ROR API.
+
+They answer in the shapes preprocess.py, wikidata_enrich.py and ror_enrich.py
+parse, so those stages can be benchmarked without network access:
+
+* GROBID: returns the TEI embedded in the placeholder PDFs of synthetic_corpus.py.
+* Wikidata / ROR: deterministic IDs per name, with some names never found.
+
+An optional fixed latency per request simulates the network round trip.
+
+    python benchmarks/stub_servers.py [--latency 0.05]
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from synthetic_corpus import ror_id, wikidata_id
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class GrobidHandler(StubHandler):
+    def do_POST(self):
+        self._delay()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        start, end = body.find(b"<TEI"), body.find(b"</TEI>")
+        if start < 0 or end < 0:
+            self._reply(500, "no TEI in upload", "text/plain")
+            return
+        self._reply(200, body[start:end + len(b"</TEI>")].decode("utf-8"), "application/xml")
+
+
+class WikidataHandler(StubHandler):
+    def do_GET(self):
+        self._delay()
+        name = parse_qs(urlparse(self.path).query).get("search", [""])[0]
+        qid = wikidata_id(name)
+        self._reply(200, json.dumps({"search": [{"id": qid, "label": name}] if qid else []}))
+
+
+class RorHandler(StubHandler):
+    def do_GET(self):
+        self._delay()
+        name = parse_qs(urlparse(self.path).query).get("query", [""])[0]
+        identifier = ror_id(name)
+        self._reply(200, json.dumps({"items": [{"id": identifier, "name": name}] if identifier else []}))
+
+
+class StubServers:
+    """Starts the three stubs on free local ports; use as a context manager.
+
+    The URLs go into GROBID_URL, WIKIDATA_API_URL and ROR_API_URL.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.servers = {}
+
+    def __enter__(self):
+        for name, handler in (("grobid", GrobidHandler), ("wikidata", WikidataHandler), ("ror", RorHandler)):
+            handler = type(handler.__name__, (handler,), {"latency": self.latency})
+            server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers[name] = server
+        return self
+
+    def __exit__(self, *exc_info):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def _base(self, name):
+        host, port = self.servers[name].server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def environment(self):
+        """Environment variables pointing the pipeline stages at the stubs."""
+        return {
+            "GROBID_URL": self._base("grobid") + "/api/processFulltextDocument",
+            "WIKIDATA_API_URL": self._base("wikidata") + "/w/api.php",
+            "ROR_API_URL": self._base("ror") + "/organizations",
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    args = parser.parse_args()
+
+    with StubServers(args.latency) as stubs:
+        for key, value in stubs.environment.items():
+            print(f"export {key}={value}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
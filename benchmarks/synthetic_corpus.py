@@ -0,0 +1,216 @@
+"""Synthetic corpus shaped like the pipeline's inputs and intermediate outputs.
+
+Writes, under a working directory:
+
+* data/papers/*.pdf: placeholder PDFs that carry their GROBID TEI, so the
+  stub GROBID server (stub_servers.py) can answer without parsing anything.
+* data/processed/*.json: what preprocess.py would extract from them.
+* data/output/entities.json, topic_assignments.json, enriched_wikidata.json
+  and enriched_ror.json: what NER, topic modelling and enrichment would write.
+
+Each topic has its own vocabulary, so bag-of-words embeddings (SyntheticEncoder)
+give each paper a handful of similar papers. The number of topics grows with
+the corpus, which keeps that density roughly constant. Everything is seeded
+and reproducible.
+
+    python benchmarks/synthetic_corpus.py --papers 10000 --out /tmp/kg-bench
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+SCALES = {"1k": 1000, "10k": 10000, "100k": 100000}
+
+COMMON_WORDS = ("we propose method results show model data analysis approach study paper "
+                "evaluate performance based novel framework using").split()
+TOPIC_WORDS = [
+    "graph knowledge entity link ontology triple sparql reasoning".split(),
+    "protein gene cell sequence expression molecular genome binding".split(),
+    "climate temperature ocean carbon emission atmosphere ice rainfall".split(),
+    "neural network training layer gradient transformer attention loss".split(),
+    "quantum qubit entanglement photon spin lattice superconducting gate".split(),
+    "market price economic policy trade inflation labour demand".split(),
+    "galaxy star telescope cosmic redshift dark halo survey".split(),
+    "patient clinical trial treatment disease cohort hospital therapy".split(),
+]
+# Paper-specific filler, so that papers of one topic are similar but not identical
+RARE_WORDS = [f"term{i}" for i in range(5000)]
+# Papers per topic beyond the named topics above
+PAPERS_PER_TOPIC = 125
+FIRST_NAMES = ["Maria", "John", "Wei", "Ana", "Peter", "Aisha", "Luis", "Sofia", "Kenji", "Fatima",
+               "David", "Elena", "Omar", "Chloe", "Ivan", "Priya"]
+LAST_NAMES = ["Garcia", "Smith", "Zhang", "Souza", "Muller", "Khan", "Rossi", "Novak", "Tanaka",
+              "Haddad", "Brown", "Ivanova", "Silva", "Martin", "Kowalski", "Patel"]
+ORG_KINDS = ["University of", "Institute of", "National Laboratory of", "Foundation for", "Council of"]
+ORG_PLACES = ["Oxford", "Madrid", "Kyoto", "Toronto", "Nairobi", "Lyon", "Porto", "Graz", "Leiden",
+              "Austin", "Bergen", "Pune", "Quito", "Tartu", "Cork", "Dundee"]
+ACK_TEMPLATES = [
+    "We thank {person} for helpful discussions.",
+    "This work was supported by the {org} under grant {grant}.",
+    "{person} and {other} provided the data used in this study.",
+    "Computing resources were provided by the {org}.",
+]
+
+
+def paper_id(i):
+    return f"paper_{i:06d}"
+
+
+def topic_words(topic):
+    if topic < len(TOPIC_WORDS):
+        return TOPIC_WORDS[topic]
+    return [f"topic{topic}word{j}" for j in range(8)]
+
+
+def synthetic_papers(n_papers, seed=0):
+    """Yield one dict per paper: the processed JSON fields plus its topic and entities."""
+    rng = random.Random(seed)
+    people = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+    orgs = [f"{kind} {place}" for kind in ORG_KINDS for place in ORG_PLACES]
+    n_topics = max(len(TOPIC_WORDS), n_papers // PAPERS_PER_TOPIC)
+    for i in range(n_papers):
+        topic = rng.randrange(n_topics)
+        words = topic_words(topic)
+        title = " ".join(rng.choices(words, k=4) + rng.choices(COMMON_WORDS, k=2)).capitalize()
+        abstract = " ".join(rng.choices(words, k=34) + rng.choices(COMMON_WORDS, k=20)
+                            + rng.choices(RARE_WORDS, k=60))
+        persons = sorted(set(rng.sample(people, rng.randint(0, 4))))
+        organizations = sorted(set(rng.sample(orgs, rng.randint(0, 3))))
+        sentences = [rng.choice(ACK_TEMPLATES).format(
+            person=rng.choice(persons or people), other=rng.choice(people),
+            org=rng.choice(organizations or orgs), grant=rng.randint(1000, 9999))
+            for _ in range(rng.choice([1, 2, 4, 8]))]
+        yield {
+            "id": paper_id(i),
+            "title": f"{title} {i}",
+            "authors": rng.sample(people, rng.randint(1, 5)),
+            "abstract": abstract,
+            "acknowledgements": "Acknowledgements " + " ".join(sentences),
+            "topic": topic,
+            "persons": persons,
+            "organizations": organizations,
+        }
+
+
+def synthetic_tei(paper):
+    """TEI in the shape GROBID returns, with the fields preprocess.py reads."""
+    authors = "".join(
+        f"<author><persName><forename>{escape(name.split()[0])}</forename>"
+        f"<surname>{escape(name.split()[-1])}</surname></persName></author>"
+        for name in paper["authors"]
+    )
+    return (
+        '<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader><fileDesc>'
+        f'<titleStmt><title>{escape(paper["title"])}</title></titleStmt>'
+        f'<sourceDesc><biblStruct><analytic>{authors}</analytic></biblStruct></sourceDesc>'
+        f'</fileDesc><profileDesc><abstract><div><p>{escape(paper["abstract"])}</p></div></abstract>'
+        '</profileDesc></teiHeader><text><back><div type="acknowledgement">'
+        f'<div><head>Acknowledgements</head><p>{escape(paper["acknowledgements"])}</p></div>'
+        '</div></back></text></TEI>'
+    )
+
+
+def synthetic_pdf(paper):
+    """Placeholder PDF bytes; the stub GROBID server returns the TEI embedded in them."""
+    return b"%PDF-1.4\n%" + synthetic_tei(paper).encode("utf-8") + b"\n%%EOF\n"
+
+
+def wikidata_id(name):
+    """Stable fake QID, or None for roughly one name in five (no match)."""
+    digest = int(hashlib.sha1(name.encode("utf-8")).hexdigest(), 16)
+    return None if digest % 5 == 0 else f"Q{digest % 10**8}"
+
+
+def ror_id(name):
+    """Stable fake ROR ID, or None for roughly one organization in four (no match)."""
+    digest = int(hashlib.sha1(name.encode("utf-8")).hexdigest(), 16)
+    return None if digest % 4 == 0 else f"https://ror.org/0{digest % 36**8:08x}"
+
+
+class SyntheticEncoder:
+    """Stands in for the SentenceTransformer: a normalised sum of fixed random word vectors.
+
+    Abstracts that share vocabulary (the same topic) get high cosine similarity.
+    """
+
+    def __init__(self, dim=384, seed=0):
+        self.dim = dim
+        self.seed = seed
+        self._vectors = {}
+
+    def _word(self, word):
+        vector = self._vectors.get(word)
+        if vector is None:
+            word_seed = int(hashlib.sha1(f"{self.seed}:{word}".encode()).hexdigest()[:8], 16)
+            vector = np.random.default_rng(word_seed).standard_normal(self.dim).astype(np.float32)
+            self._vectors[word] = vector
+        return vector
+
+    def encode(self, texts, batch_size=64, convert_to_numpy=True):
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.split():
+                embeddings[row] += self._word(word)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms)
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def generate_corpus(directory, n_papers, seed=0):
+    """Write the synthetic corpus under directory; returns the number of papers."""
+    papers_dir = os.path.join(directory, "data", "papers")
+    processed_dir = os.path.join(directory, "data", "processed")
+    output_dir = os.path.join(directory, "data", "output")
+    for path in (papers_dir, processed_dir, output_dir):
+        os.makedirs(path, exist_ok=True)
+
+    entities, topics, wikidata, ror = {}, {}, {}, {}
+    for paper in synthetic_papers(n_papers, seed):
+        paper_key = paper["id"]
+        with open(os.path.join(papers_dir, f"{paper_key}.pdf"), "wb") as f:
+            f.write(synthetic_pdf(paper))
+        _write_json(os.path.join(processed_dir, f"{paper_key}.json"), {
+            field: paper[field] for field in ("id", "title", "authors", "abstract", "acknowledgements")
+        })
+        entities[paper_key] = {"persons": paper["persons"], "organizations": paper["organizations"]}
+        topics[paper_key] = paper["topic"]
+        wikidata[paper_key] = {
+            "persons": [{"name": name, "wikidata_id": wikidata_id(name)} for name in paper["persons"]],
+            "organizations": [{"name": name, "wikidata_id": wikidata_id(name)} for name in paper["organizations"]],
+        }
+        ror[paper_key] = [{"name": name, "ror_id": ror_id(name), "ror_name": name}
+                          for name in paper["organizations"]]
+
+    _write_json(os.path.join(output_dir, "entities.json"), entities)
+    _write_json(os.path.join(output_dir, "topic_assignments.json"), topics)
+    _write_json(os.path.join(output_dir, "enriched_wikidata.json"), wikidata)
+    _write_json(os.path.join(output_dir, "enriched_ror.json"), ror)
+    return n_papers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--papers", type=int, default=None)
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True, help="working directory to create data/ in")
+    args = parser.parse_args()
+
+    n_papers = args.papers or SCALES[args.scale]
+    generate_corpus(args.out, n_papers, args.seed)
+    print(f"Synthetic corpus of {n_papers} papers written to {os.path.join(args.out, 'data')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""Approximate nearest-neighbour index over paper embeddings.
+
+Uses hnswlib (HNSW) when it is installed and falls back to a pure-NumPy
+inverted-file (IVF) index otherwise. The index is persisted under
+data/output/ann_index/ so the Streamlit app can answer ad-hoc queries.
+
+Run `python src/ann_index.py --benchmark` to compare recall and query time
+against exact search for several parameter settings.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+ANN_INDEX_DIR = os.environ.get("ANN_INDEX_DIR", "data/output/ann_index")
+# "auto" picks hnsw when hnswlib is available, otherwise ivf
+ANN_BACKEND = os.environ.get("ANN_BACKEND", "auto")
+
+HNSW_DEFAULTS = {"M": 16, "ef_construction": 200, "ef": 64}
+IVF_DEFAULTS = {"nlist": 0, "nprobe": 8, "iterations": 10}
+
+
+def _normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def _resolve_backend(backend):
+    if backend == "auto":
+        return "hnsw" if hnswlib is not None else "ivf"
+    if backend == "hnsw" and hnswlib is None:
+        raise ImportError("hnswlib is not installed; use ANN_BACKEND=ivf")
+    if backend not in ("hnsw", "ivf"):
+        raise ValueError(f"Unknown ANN backend: {backend}")
+    return backend
+
+
+def exact_top_k(vectors, queries, k, block_size=1024):
+    """Exact top-k by blocked inner product; returns (indices, similarities)."""
+    k = min(k, len(vectors))
+    all_idx, all_sims = [], []
+    for start in range(0, len(queries), block_size):
+        sims = queries[start:start + block_size] @ vectors.T
+        idx = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(sims, idx, axis=1)
+        order = np.argsort(-top, axis=1)
+        all_idx.append(np.take_along_axis(idx, order, axis=1))
+        all_sims.append(np.take_along_axis(top, order, axis=1))
+    return np.vstack(all_idx), np.vstack(all_sims)
+
+
+class _HnswBackend:
+    def __init__(self, index, params):
+        self.index = index
+        self.params = params
+
+    @classmethod
+    def build(cls, vectors, params):
+        index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        index.init_index(max_elements=len(vectors), M=params["M"],
+                         ef_construction=params["ef_construction"])
+        index.add_items(vectors, np.arange(len(vectors)))
+        index.set_ef(params["ef"])
+        return cls(index, params)
+
+    def save(self, path):
+        self.index.save_index(os.path.join(path, "hnsw.bin"))
+
+    @classmethod
+    def load(cls, path, vectors, params):
+        index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        index.load_index(os.path.join(path, "hnsw.bin"), max_elements=len(vectors))
+        index.set_ef(params["ef"])
+        return cls(index, params)
+
+    def query(self, queries, k):
+        # hnswlib needs ef >= k to return k results
+        self.index.set_ef(max(self.params["ef"], k))
+        labels, distances = self.index.knn_query(queries, k=k)
+        return labels.astype(np.int64), 1.0 - distances
+
+
+class _IvfBackend:
+    def __init__(self, vectors, centroids, order, offsets, params):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.params = params
+
+    @classmethod
+    def build(cls, vectors, params):
+        n = len(vectors)
+        nlist = params["nlist"] or max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+        params = dict(params, nlist=nlist)
+
+        # Spherical k-means on a sample keeps training cost sub-quadratic
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(n, size=min(n, nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(params["iterations"]):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = _normalize(centroids)
+
+        assign = np.concatenate([
+            np.argmax(vectors[s:s + 4096] @ centroids.T, axis=1)
+            for s in range(0, n, 4096)
+        ])
+        order = np.argsort(assign, kind="stable")
+        offsets = np.searchsorted(assign[order], np.arange(nlist + 1))
+        return cls(vectors, centroids, order, offsets, params)
+
+    def save(self, path):
+        np.save(os.path.join(path, "ivf_centroids.npy"), self.centroids)
+        np.save(os.path.join(path, "ivf_order.npy"), self.order)
+        np.save(os.path.join(path, "ivf_offsets.npy"), self.offsets)
+
+    @classmethod
+    def load(cls, path, vectors, params):
+        centroids = np.load(os.path.join(path, "ivf_centroids.npy"))
+        order = np.load(os.path.join(path, "ivf_order.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(path, "ivf_offsets.npy"))
+        return cls(vectors, centroids, order, offsets, params)
+
+    def query(self, queries, k):
+        nprobe = min(self.params["nprobe"], len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for q, lists in enumerate(probes):
+            candidates = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+            if not len(candidates):
+                continue
+            scores = self.vectors[candidates] @ queries[q]
+            top = min(k, len(candidates))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            labels[q, :top] = candidates[best]
+            sims[q, :top] = scores[best]
+        return labels, sims
+
+
+_BACKENDS = {"hnsw": _HnswBackend, "ivf": _IvfBackend}
+
+
+class AnnIndex:
+    """Nearest-neighbour index mapping paper ids to normalised embeddings."""
+
+    def __init__(self, ids, vectors, backend, impl, params):
+        self.ids = list(ids)
+        self.vectors = vectors
+        self.backend = backend
+        self.impl = impl
+        self.params = params
+        self._positions = {paper_id: i for i, paper_id in enumerate(self.ids)}
+
+    @classmethod
+    def build(cls, ids, embeddings, backend=ANN_BACKEND, **params):
+        backend = _resolve_backend(backend)
+        defaults = HNSW_DEFAULTS if backend == "hnsw" else IVF_DEFAULTS
+        params = {**defaults, **params}
+        vectors = _normalize(embeddings)
+        impl = _BACKENDS[backend].build(vectors, params)
+        return cls(ids, vectors, backend, impl, impl.params)
+
+    def save(self, path=ANN_INDEX_DIR):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "embeddings.npy"), self.vectors)
+        self.impl.save(path)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"backend": self.backend, "params": self.params, "ids": self.ids}, f)
+
+    @classmethod
+    def load(cls, path=ANN_INDEX_DIR):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        vectors = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        backend = _resolve_backend(meta["backend"])
+        impl = _BACKENDS[backend].load(path, vectors, meta["params"])
+        return cls(meta["ids"], vectors, backend, impl, meta["params"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, paper_id):
+        return paper_id in self._positions
+
+    def query(self, queries, k):
+        """Return (indices, similarities) of the k nearest neighbours of each query."""
+        queries = _normalize(np.atleast_2d(queries))
+        return self.impl.query(queries, min(k, len(self.ids)))
+
+    def neighbours(self, paper_id, k=10, threshold=0.0):
+        """Return [(paper_id, similarity), ...] for the k nearest papers to paper_id."""
+        position = self._positions[paper_id]
+        labels, sims = self.query(self.vectors[position], k + 1)
+        return [
+            (self.ids[j], float(sim))
+            for j, sim in zip(labels[0], sims[0])
+            if j >= 0 and j != position and sim > threshold
+        ][:k]
+
+    def similar_pairs(self, threshold, k, batch_size=1024):
+        """Yield (i, j, similarity) with i < j for every paper's k neighbours above threshold."""
+        pairs = {}
+        for start in range(0, len(self.ids), batch_size):
+            labels, sims = self.query(self.vectors[start:start + batch_size], k + 1)
+            for i, (row_labels, row_sims) in enumerate(zip(labels, sims), start):
+                for j, sim in zip(row_labels, row_sims):
+                    if j >= 0 and j != i and sim > threshold:
+                        pairs[(min(i, j), max(i, j))] = float(sim)
+        for (i, j), sim in sorted(pairs.items()):
+            yield int(i), int(j), sim
+
+
+def benchmark(vectors, k=10, n_queries=1000, backend=ANN_BACKEND):
+    """Print recall@k and query throughput of several parameter settings vs exact search."""
+    backend = _resolve_backend(backend)
+    vectors = _normalize(vectors)
+    rng = np.random.default_rng(0)
+    query_ids = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[query_ids]
+
+    start = time.perf_counter()
+    exact, _ = exact_top_k(vectors, queries, k)
+    exact_time = time.perf_counter() - start
+    print(f"exact: {len(queries) / exact_time:,.0f} queries/s")
+
+    if backend == "hnsw":
+        grid = [{"M": m, "ef": ef} for m in (8, 16, 32) for ef in (16, 64, 256)]
+    else:
+        grid = [{"nprobe": p} for p in (1, 4, 8, 16, 32)]
+
+    print(f"{'params':<28} {'build s':>8} {'recall@' + str(k):>10} {'queries/s':>12}")
+    for params in grid:
+        start = time.perf_counter()
+        index = AnnIndex.build(range(len(vectors)), vectors, backend, **params)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        labels, _ = index.query(queries, k)
+        query_time = time.perf_counter() - start
+
+        hits = sum(len(set(a) & set(b)) for a, b in zip(labels.tolist(), exact.tolist()))
+        recall = hits / exact.size
+        print(f"{json.dumps(params):<28} {build_time:>8.2f} {recall:>10.3f} {len(queries) / query_time:>12,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ANN index against exact search.")
+    parser.add_argument("--benchmark", action="store_true", help="run the recall-vs-exact benchmark")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="benchmark on N random vectors instead of the saved index embeddings")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--backend", default=ANN_BACKEND)
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_help()
+        return
+
+    if args.synthetic:
+        vectors = np.random.default_rng(0).normal(size=(args.synthetic, 384)).astype(np.float32)
+    else:
+        vectors = np.load(os.path.join(ANN_INDEX_DIR, "embeddings.npy"))
+    benchmark(vectors, k=args.k, n_queries=args.queries, backend=args.backend)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,132 @@
+import argparse
+import gzip
 import rdflib
 import json
 from urllib.parse import quote
 import os
 
+import corpus
+import kg_snapshot
+import kg_store
+import metrics
+import versioned_dir
+from manifest import Manifest, file_digest
+
+# "nt" writes N-Triples, "nq" N-Quads with every triple in KG_GRAPH_URI
+KG_FORMAT = os.environ.get("KG_FORMAT", "nt")
+KG_GZIP = os.environ.get("KG_GZIP", "1") == "1"
+KG_GRAPH_URI = os.environ.get("KG_GRAPH_URI", "http://example.org/graph/kg")
+KG_PATH = f"./data/output/kg.{KG_FORMAT}" + (".gz" if KG_GZIP else "")
+# Turtle is produced from the streamed file on request; it needs the whole graph in memory
+KG_TURTLE = os.environ.get("KG_TURTLE", "0") == "1"
+KG_TURTLE_PATH = "./data/output/kg.ttl"
+# Also write the memory-mapped snapshot that the Streamlit app loads (see kg_snapshot.py).
+# Unlike the streamed RDF file it needs memory for every term and triple while building
+KG_SNAPSHOT = os.environ.get("KG_SNAPSHOT", "1") == "1"
+# Also write the indexed SQLite store (see kg_store.py)
+KG_SQLITE = os.environ.get("KG_SQLITE", "0") == "1"
+# Repeated entity triples (a person in many papers) are skipped while this many are remembered
+KG_DEDUP_SIZE = int(os.environ.get("KG_DEDUP_SIZE", "1000000"))
+KG_INPUTS = [
+    "data/output/topic_assignments.json",
+    "data/output/similar_pairs.json",
+    "data/output/enriched_wikidata.json",
+    "data/output/enriched_ror.json",
+]
+# Corpus columns the graph is built from
+KG_COLUMNS = ("id", "title", "abstract", "authors")
+
+RDF_FORMATS = {".nt": "nt", ".nq": "nquads", ".ttl": "turtle"}
+PREFIXES = {
+    "ex": "http://example.org/",
+    "dcterms": "http://purl.org/dc/terms/",
+    "foaf": "http://xmlns.com/foaf/0.1/",
+    "wd": "http://www.wikidata.org/entity/",
+    "ror": "https://ror.org/",
+}
+
+class TripleWriter:
+    """Append-only N-Triples/N-Quads writer with the Graph.add() interface.
+
+    Triples go straight to disk, so memory stays flat however large the graph.
+    The file is written under a temporary name and moved into place on close().
+    Each written triple is also passed, encoded, to sink.add(s, p, o) for every sink.
+    """
+
+    def __init__(self, path, graph_uri=None, dedup_size=KG_DEDUP_SIZE, sinks=()):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        if path.endswith(".gz"):
+            self._file = gzip.open(self.tmp_path, "wt", encoding="utf-8", compresslevel=6)
+        else:
+            self._file = open(self.tmp_path, "w", encoding="utf-8")
+        self._end = f" <{graph_uri}> .\n" if graph_uri else " .\n"
+        self._seen = set()
+        self._dedup_size = dedup_size
+        self.sinks = list(sinks)
+        # Lines written; triples added without dedup may repeat, so unique triples can be fewer
+        self.lines = 0
+
+    def add(self, triple, dedup=False):
+        terms = [kg_store.encode_term(t) for t in triple]
+        line = " ".join(terms)
+        if dedup:
+            key = hash(line)
+            if key in self._seen:
+                return
+            if len(self._seen) >= self._dedup_size:
+                self._seen.clear()
+            self._seen.add(key)
+        self._file.write(line + self._end)
+        for sink in self.sinks:
+            sink.add(*terms)
+        self.lines += 1
+
+    def close(self):
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.tmp_path)
+
+
+def rdf_format(path):
+    """rdflib parser name for a .nt/.nq/.ttl file, optionally .gz."""
+    return RDF_FORMATS[os.path.splitext(path[:-3] if path.endswith(".gz") else path)[1]]
+
+
+def parse_rdf(graph, path):
+    """Parse an RDF file written by create_kg() into graph."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        graph.parse(f, format=rdf_format(path))
+    return graph
+
+
+def convert_to_turtle(source=KG_PATH, destination=KG_TURTLE_PATH):
+    """Write the streamed graph as pretty-printed Turtle (loads it fully into memory)."""
+    g = rdflib.Dataset(default_union=True) if rdf_format(source) == "nquads" else rdflib.Graph()
+    parse_rdf(g, source)
+    if isinstance(g, rdflib.Dataset):
+        union = rdflib.Graph()
+        for s, p, o, _ in g.quads():
+            union.add((s, p, o))
+        g = union
+    for prefix, namespace in PREFIXES.items():
+        g.bind(prefix, namespace)
+    with metrics.timer("kg_turtle_serialize"):
+        g.serialize(destination=destination, format="turtle")
+    print(f"Turtle written to {destination} ({len(g)} triples)")
+
 def add_person(g, EX, FOAF, WD, person):
     if person.get("wikidata_id"):
         person_uri = WD[person["wikidata_id"]]
     else:
         safe_name = quote(person["name"].replace(" ", "_"))
         person_uri = EX[f"person_{safe_name}"]
-    g.add((person_uri, rdflib.RDF.type, FOAF.Person))
-    g.add((person_uri, FOAF.name, rdflib.Literal(person["name"])))
+    g.add((person_uri, rdflib.RDF.type, FOAF.Person), dedup=True)
+    g.add((person_uri, FOAF.name, rdflib.Literal(person["name"])), dedup=True)
     return person_uri
 
 def add_organization(g, EX, FOAF, WD, ROR, org):
@@ -21,41 +137,42 @@ def add_organization(g, EX, FOAF, WD, ROR, org):
     else:
         safe_name = quote(org["name"].replace(" ", "_"))
         org_uri = EX[f"org_{safe_name}"]
-    g.add((org_uri, rdflib.RDF.type, FOAF.Organization))
-    g.add((org_uri, FOAF.name, rdflib.Literal(org["name"])))
+    g.add((org_uri, rdflib.RDF.type, FOAF.Organization), dedup=True)
+    g.add((org_uri, FOAF.name, rdflib.Literal(org["name"])), dedup=True)
     return org_uri
 
 def create_kg():
-    """Create RDF Knowledge Graph from processed data."""
-    g = rdflib.Graph()
-    
+    """Create RDF Knowledge Graph from processed data, streaming it paper by paper."""
     # Define namespaces
-    EX = rdflib.Namespace("http://example.org/")
-    DCTERMS = rdflib.Namespace("http://purl.org/dc/terms/")
-    FOAF = rdflib.Namespace("http://xmlns.com/foaf/0.1/")
-    WD = rdflib.Namespace("http://www.wikidata.org/entity/")
-    ROR = rdflib.Namespace("https://ror.org/")
-    
-    # Bind prefixes
-    g.bind("ex", EX)
-    g.bind("dcterms", DCTERMS)
-    g.bind("foaf", FOAF)
-    g.bind("wd", WD)
-    g.bind("ror", ROR)
+    EX = rdflib.Namespace(PREFIXES["ex"])
+    DCTERMS = rdflib.Namespace(PREFIXES["dcterms"])
+    FOAF = rdflib.Namespace(PREFIXES["foaf"])
+    WD = rdflib.Namespace(PREFIXES["wd"])
+    ROR = rdflib.Namespace(PREFIXES["ror"])
     
-    # Load processed paper metadata
-    papers_metadata = {}
     processed_dir = "data/processed"
     
     if not os.path.exists(processed_dir):
         print("Error: processed data directory not found")
         return
     
-    for file in os.listdir(processed_dir):
-        if file.endswith(".json"):
-            with open(os.path.join(processed_dir, file)) as f:
-                data = json.load(f)
-                papers_metadata[data['id']] = data
+    # The graph is rebuilt only when a paper or an upstream output changed
+    outputs = [KG_PATH] + ([KG_TURTLE_PATH] if KG_TURTLE else [])
+    if KG_SNAPSHOT:
+        outputs.append(os.path.join(kg_snapshot.KG_SNAPSHOT_DIR, versioned_dir.POINTER))
+    if KG_SQLITE:
+        outputs.append(kg_store.KG_SQLITE_PATH)
+    manifest = Manifest("build_kg", outputs=outputs)
+    papers = corpus.load_corpus(processed_dir=processed_dir)
+    current = {
+        path: file_digest(path)
+        for path in [papers.path(column) for column in KG_COLUMNS] + KG_INPUTS
+        if os.path.exists(path)
+    }
+    current["__format__"] = KG_PATH
+    if manifest.up_to_date(current):
+        print("Knowledge graph is up to date; skipping.")
+        return
     
     # Load additional data with error handling
     try:
@@ -87,8 +204,40 @@ def create_kg():
         print("Warning: enriched_ror.json not found")
         ror_data = {}
     
-    # Create triples for each paper
-    for paper_id, metadata in papers_metadata.items():
+    # The snapshot holds integer IDs only, so it costs far less memory than an rdflib.Graph
+    snapshot = kg_snapshot.SnapshotBuilder() if KG_SNAPSHOT else None
+    sqlite_store = kg_store.SqliteBuilder() if KG_SQLITE else None
+    g = TripleWriter(KG_PATH, graph_uri=KG_GRAPH_URI if KG_FORMAT == "nq" else None,
+                     sinks=[sink for sink in (snapshot, sqlite_store) if sink is not None])
+    try:
+        with metrics.timer("kg_write_triples"):
+            write_triples(g, papers.iter_rows(KG_COLUMNS), topic_data, similar_pairs, wd_data, ror_data,
+                          EX, DCTERMS, FOAF, WD, ROR)
+    except BaseException:
+        g.abort()
+        raise
+    g.close()
+    metrics.add_items("build_kg", g.lines)
+    print(f"KG created in {KG_PATH} ({g.lines} lines written, repeated triples included)")
+    if snapshot is not None:
+        with metrics.timer("kg_snapshot_save"):
+            snapshot.save(kg_snapshot.KG_SNAPSHOT_DIR)
+    if sqlite_store is not None:
+        with metrics.timer("kg_sqlite_save"):
+            sqlite_store.save()
+    
+    if KG_TURTLE:
+        convert_to_turtle(KG_PATH, KG_TURTLE_PATH)
+        if snapshot is not None and not kg_snapshot.validate(KG_TURTLE_PATH):
+            raise SystemExit("KG snapshot does not match the Turtle output")
+    # Last, so the dashboard reloads once, after every output is in place
+    kg_store.write_build_stamp()
+    manifest.save(current, outputs=outputs)
+
+def write_triples(g, papers, topic_data, similar_pairs, wd_data, ror_data, EX, DCTERMS, FOAF, WD, ROR):
+    """Emit every paper's triples, streaming the corpus one paper at a time."""
+    for metadata in papers:
+        paper_id = metadata['id']
         paper_safe_id = quote(paper_id)
         paper_uri = EX[f"paper_{paper_safe_id}"]
         
@@ -99,7 +248,7 @@ def create_kg():
         g.add((paper_uri, EX.identifier, rdflib.Literal(paper_id)))
         
         # Authors with persistent URI
-        for author in metadata.get('authors', []):
+        for author in metadata['authors'] or []:
             person_uri = add_person(g, EX, FOAF, WD, {"name": author})
             g.add((paper_uri, DCTERMS.creator, person_uri))
         
@@ -107,8 +256,8 @@ def create_kg():
         if paper_id in topic_data:
             topic_uri = EX[f"topic_{topic_data[paper_id]}"]
             g.add((paper_uri, EX.belongs_to_topic, topic_uri))
-            g.add((topic_uri, rdflib.RDF.type, EX.Topic))
-            g.add((topic_uri, DCTERMS.identifier, rdflib.Literal(str(topic_data[paper_id]))))
+            g.add((topic_uri, rdflib.RDF.type, EX.Topic), dedup=True)
+            g.add((topic_uri, DCTERMS.identifier, rdflib.Literal(str(topic_data[paper_id]))), dedup=True)
         
         # Entities from Wikidata and ROR
         if paper_id in wd_data:
@@ -133,10 +282,18 @@ def create_kg():
         p2 = EX[f"paper_{p2_safe}"]
         g.add((p1, EX.similar_to, p2))
         g.add((p2, EX.similar_to, p1))  # Make bidirectional
-    
-    # Save the graph
-    g.serialize(destination="./data/output/kg.ttl", format="turtle")
-    print(f"KG created with {len(g)} triples")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the knowledge graph from the pipeline outputs.")
+    parser.add_argument("--turtle", action="store_true",
+                        help=f"only convert the existing {KG_PATH} to {KG_TURTLE_PATH}")
+    args = parser.parse_args()
+    if args.turtle:
+        convert_to_turtle(KG_PATH, KG_TURTLE_PATH)
+        if kg_snapshot.exists() and not kg_snapshot.validate(KG_TURTLE_PATH):
+            raise SystemExit("KG snapshot does not match the Turtle output")
+    else:
+        create_kg()
 
 if __name__ == "__main__":
-    create_kg()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""Column store of the processed papers, shared by every stage after preprocessing.
+
+preprocess.py still writes one JSON per paper (its incremental unit) and then
+compiles them once into CORPUS_DIR:
+
+* <column>.jsonl: one JSON value per line for each field (id, title,
+  authors, abstract, acknowledgements, funding, author_contributions,
+  references), rows in paper-id order.
+* <column>_offsets.npy: byte offset of every line, so any row is one seek.
+* meta.json: row count, columns and the digest of the inputs it was built from.
+
+Each compile is published as a new version of CORPUS_DIR (see
+versioned_dir.py), so stages reading the corpus never find it missing.
+
+Stages read only the columns they need (similarity reads id and abstract,
+never the acknowledgements), stream rows without holding the corpus in
+memory, or fetch single papers by id, instead of listing data/processed and
+parsing every paper file.
+"""
+
+import json
+import os
+
+import numpy as np
+
+import versioned_dir
+from manifest import data_digest, load_json
+
+PROCESSED_DIR = "data/processed"
+CORPUS_DIR = os.environ.get("CORPUS_DIR", "data/processed/corpus")
+
+CORPUS_VERSION = 2
+COLUMNS = ("id", "title", "authors", "abstract", "acknowledgements", "funding", "author_contributions",
+           "references")
+
+
+def processed_files(processed_dir=PROCESSED_DIR):
+    """Per-paper JSON files written by preprocess.py, in paper-id order."""
+    if not os.path.isdir(processed_dir):
+        return []
+    return [os.path.join(processed_dir, file) for file in sorted(os.listdir(processed_dir))
+            if file.endswith(".json")]
+
+
+def write_corpus(processed_dir=PROCESSED_DIR, directory=CORPUS_DIR, source=None):
+    """Compile the per-paper JSONs into the column store; returns the number of papers.
+
+    source identifies the inputs (e.g. the preprocess manifest) and is kept in
+    meta.json so is_current() can tell whether a rebuild is needed.
+    """
+    tmp_dir = versioned_dir.new_version(directory)
+    files = {column: open(os.path.join(tmp_dir, f"{column}.jsonl"), "wb") for column in COLUMNS}
+    offsets = {column: [0] for column in COLUMNS}
+    try:
+        for path in processed_files(processed_dir):
+            with open(path, encoding="utf-8") as f:
+                paper = json.load(f)
+            for column in COLUMNS:
+                line = json.dumps(paper.get(column), ensure_ascii=False).encode("utf-8") + b"\n"
+                files[column].write(line)
+                offsets[column].append(offsets[column][-1] + len(line))
+    finally:
+        for f in files.values():
+            f.close()
+    for column in COLUMNS:
+        np.save(os.path.join(tmp_dir, f"{column}_offsets.npy"), np.array(offsets[column], dtype=np.int64))
+    count = len(offsets["id"]) - 1
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"version": CORPUS_VERSION, "papers": count, "columns": list(COLUMNS),
+                   "source": data_digest(source)}, f)
+
+    versioned_dir.publish(tmp_dir)
+    return count
+
+
+def is_current(source, directory=CORPUS_DIR):
+    """True if the corpus exists and was built from the given source."""
+    try:
+        with open(os.path.join(versioned_dir.current(directory), "meta.json")) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return False
+    return meta.get("version") == CORPUS_VERSION and meta.get("source") == data_digest(source)
+
+
+class Corpus:
+    """Read-only view of the column store."""
+
+    def __init__(self, directory=CORPUS_DIR):
+        directory = versioned_dir.current(directory)
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != CORPUS_VERSION:
+            raise ValueError(f"Unsupported corpus version in {directory}: {meta.get('version')}")
+        self.directory = directory
+        self.papers = meta["papers"]
+        self._offsets = {}
+        self._rows = None
+
+    def __len__(self):
+        return self.papers
+
+    def path(self, column):
+        """The JSON Lines file holding a column."""
+        if column not in COLUMNS:
+            raise KeyError(f"Unknown corpus column: {column} (expected one of {COLUMNS})")
+        return os.path.join(self.directory, f"{column}.jsonl")
+
+    def _lines(self, column):
+        with open(self.path(column), "rb") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def column(self, column):
+        """Every value of one column, in row order."""
+        return list(self._lines(column))
+
+    def columns(self, *columns):
+        """Several columns at once, e.g. ids, abstracts = corpus.columns("id", "abstract")."""
+        return tuple(self.column(column) for column in columns)
+
+    def iter_rows(self, columns=COLUMNS):
+        """Stream one dict per paper holding only the given columns."""
+        for values in zip(*(self._lines(column) for column in columns)):
+            yield dict(zip(columns, values))
+
+    def get(self, paper_id, columns=COLUMNS):
+        """Fields of one paper by id, read with one seek per column; None if unknown."""
+        if self._rows is None:
+            self._rows = {value: row for row, value in enumerate(self._lines("id"))}
+        row = self._rows.get(paper_id)
+        if row is None:
+            return None
+        paper = {}
+        for column in columns:
+            if column not in self._offsets:
+                self._offsets[column] = np.load(os.path.join(self.directory, f"{column}_offsets.npy"))
+            start, end = self._offsets[column][row], self._offsets[column][row + 1]
+            with open(self.path(column), "rb") as f:
+                f.seek(start)
+                paper[column] = json.loads(f.read(end - start))
+        return paper
+
+
+def load_corpus(directory=CORPUS_DIR, processed_dir=PROCESSED_DIR):
+    """Open the corpus, compiling it from the processed papers first if it is missing or outdated."""
+    meta = load_json(os.path.join(versioned_dir.current(directory), "meta.json"), {})
+    if meta.get("version") != CORPUS_VERSION:
+        count = write_corpus(processed_dir, directory)
+        print(f"Corpus of {count} papers compiled to {directory}")
+    return Corpus(directory)
@@ -0,0 +1,151 @@
+"""Content-addressed on-disk cache of sentence embeddings.
+
+Embeddings are keyed by hash(model name, text) and stored as rows of a
+memory-mapped matrix, so topic modelling and similarity share one encoding
+pass and only new or changed abstracts are sent through the model.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+import corpus
+import inference_backend
+import metrics
+
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "data/cache/embeddings")
+# float16 halves the cache size at a small precision cost
+EMBEDDING_CACHE_DTYPE = os.environ.get("EMBEDDING_CACHE_DTYPE", "float32")
+
+_models = {}
+_caches = {}
+# Pipeline stages may run in parallel threads of one process (run_pipeline.py)
+_lock = threading.Lock()
+
+
+def load_model(model_name=EMBEDDING_MODEL, backend=inference_backend.INFERENCE_BACKEND):
+    """Load a SentenceTransformer once per process on the given inference backend."""
+    with _lock:
+        if (model_name, backend) not in _models:
+            with metrics.timer("embedding_model_load"):
+                _models[model_name, backend] = inference_backend.load_embedding_model(model_name, backend)
+        return _models[model_name, backend]
+
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class EmbeddingCache:
+    """Embedding store for one model: vectors.bin (rows x dim) plus a key -> row index."""
+
+    def __init__(self, model_name=EMBEDDING_MODEL, cache_dir=EMBEDDING_CACHE_DIR,
+                 dtype=EMBEDDING_CACHE_DTYPE, backend=inference_backend.INFERENCE_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        # Exported or quantised models give slightly different vectors, so they get their own store
+        cache_name = model_name if backend == "torch" else f"{model_name}@{backend}"
+        self.path = os.path.join(cache_dir, cache_name.replace("/", "__"))
+        self.vectors_path = os.path.join(self.path, "vectors.bin")
+        self.index_path = os.path.join(self.path, "index.json")
+        self.index = {}
+        self.dim = None
+        self.dtype = np.dtype(dtype)
+        # Serialises encode(): concurrent appends would interleave rows and index entries
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                data = json.load(f)
+            self.index = data["keys"]
+            self.dim = data["dim"]
+            self.dtype = np.dtype(data["dtype"])
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _matrix(self):
+        if not self.index:
+            return np.empty((0, self.dim or 0), dtype=self.dtype)
+        return np.memmap(self.vectors_path, dtype=self.dtype, mode="r",
+                         shape=(len(self.index), self.dim))
+
+    def _append(self, keys, embeddings):
+        embeddings = np.asarray(embeddings, dtype=self.dtype)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        os.makedirs(self.path, exist_ok=True)
+
+        # Drop rows left behind by an interrupted write before appending
+        row_bytes = self.dim * self.dtype.itemsize
+        mode = "r+b" if os.path.exists(self.vectors_path) else "wb"
+        with open(self.vectors_path, mode) as f:
+            f.seek(len(self.index) * row_bytes)
+            f.truncate()
+            f.write(embeddings.tobytes())
+
+        for key in keys:
+            self.index[key] = len(self.index)
+        _write_json(self.index_path, {
+            "model": self.model_name,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "keys": self.index,
+        })
+
+    def encode(self, texts, model=None, batch_size=64):
+        """Return float32 embeddings for texts, encoding only those not cached yet."""
+        keys = [self.key(text) for text in texts]
+
+        with self._lock:
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self.index and key not in missing:
+                    missing[key] = text
+
+            if missing:
+                model = model or load_model(self.model_name, self.backend)
+                with metrics.timer("embedding_encode"):
+                    new_embeddings = model.encode(list(missing.values()), batch_size=batch_size,
+                                                  convert_to_numpy=True)
+                self._append(list(missing.keys()), new_embeddings)
+
+            print(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} encoded")
+            matrix = self._matrix()
+            rows = np.fromiter((self.index[key] for key in keys), dtype=np.int64, count=len(keys))
+            return np.asarray(matrix[rows], dtype=np.float32)
+
+
+def shared_cache(model_name=EMBEDDING_MODEL, backend=inference_backend.INFERENCE_BACKEND):
+    """The process-wide EmbeddingCache for a model, so its index is read from disk once."""
+    with _lock:
+        if (model_name, backend) not in _caches:
+            _caches[model_name, backend] = EmbeddingCache(model_name, backend=backend)
+        return _caches[model_name, backend]
+
+
+def get_embeddings(texts, model_name=EMBEDDING_MODEL):
+    """Embed texts with model_name through the shared on-disk cache."""
+    return shared_cache(model_name).encode(texts)
+
+
+def embed_processed_papers():
+    """Encode every processed abstract not cached yet, so later stages only read the cache.
+
+    Runs as its own pipeline stage: topic modelling and similarity both depend
+    on it and then run in parallel without either one encoding.
+    """
+    abstracts = corpus.load_corpus().column("abstract")
+    get_embeddings(abstracts)
+    metrics.add_items("embedding_cache", len(abstracts))
+
+
+if __name__ == "__main__":
+    embed_processed_papers()
@@ -0,0 +1,199 @@
+"""Selectable inference backend for the NER and sentence embedding models.
+
+INFERENCE_BACKEND picks how models run:
+
+* "torch" (default): the fp32 PyTorch models, as before.
+* "onnx": models exported once to ONNX and run with ONNX Runtime.
+* "onnx-int8": the ONNX export with dynamic int8 quantisation.
+
+Exports are cached under data/cache/onnx/, so only the first run pays for them.
+The ONNX backends need `optimum[onnxruntime]`.
+
+Run `python src/inference_backend.py --check --backend onnx-int8` to compare a
+backend against PyTorch (entity F1 and embedding cosine drift) on the
+processed corpus before switching to it.
+"""
+
+import argparse
+import os
+import time
+from itertools import islice
+
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch")
+# ONNX Runtime intra-op threads (0 lets ONNX Runtime decide)
+ONNX_THREADS = int(os.environ.get("ONNX_THREADS", "0"))
+ONNX_CACHE_DIR = os.environ.get("ONNX_CACHE_DIR", "data/cache/onnx")
+# Instruction set targeted by int8 quantisation: avx2, avx512, avx512_vnni or arm64
+ONNX_QUANTIZATION = os.environ.get("ONNX_QUANTIZATION", "avx2")
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def _check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend} (expected one of {BACKENDS})")
+
+
+def _export_dir(model_name, kind):
+    return os.path.join(ONNX_CACHE_DIR, model_name.replace("/", "__"), kind)
+
+
+def _session_options(num_threads=ONNX_THREADS):
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    return options
+
+
+def export_ner_model(model_name, quantize):
+    """Export a token classification model to ONNX once; returns (directory, file name)."""
+    from optimum.onnxruntime import ORTModelForTokenClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    fp32_dir = _export_dir(model_name, "ner-fp32")
+    if not os.path.exists(os.path.join(fp32_dir, "model.onnx")):
+        print(f"Exporting {model_name} to ONNX...")
+        model = ORTModelForTokenClassification.from_pretrained(model_name, export=True)
+        model.save_pretrained(fp32_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(fp32_dir)
+    if not quantize:
+        return fp32_dir, "model.onnx"
+
+    int8_dir = _export_dir(model_name, f"ner-int8-{ONNX_QUANTIZATION}")
+    if not os.path.exists(os.path.join(int8_dir, "model_quantized.onnx")):
+        print(f"Quantising {model_name} to int8 ({ONNX_QUANTIZATION})...")
+        config = getattr(AutoQuantizationConfig, ONNX_QUANTIZATION)(is_static=False, per_channel=False)
+        ORTQuantizer.from_pretrained(fp32_dir).quantize(save_dir=int8_dir, quantization_config=config)
+        AutoTokenizer.from_pretrained(fp32_dir).save_pretrained(int8_dir)
+    return int8_dir, "model_quantized.onnx"
+
+
+def load_ner_pipeline(model_name, backend=INFERENCE_BACKEND, num_threads=ONNX_THREADS):
+    """Hugging Face NER pipeline (entities grouped) running on the selected backend."""
+    from transformers import AutoTokenizer, pipeline
+
+    _check_backend(backend)
+    if backend == "torch":
+        return pipeline("ner", model=model_name, aggregation_strategy="simple")
+
+    from optimum.onnxruntime import ORTModelForTokenClassification
+
+    path, file_name = export_ner_model(model_name, quantize=backend == "onnx-int8")
+    model = ORTModelForTokenClassification.from_pretrained(
+        path, file_name=file_name, session_options=_session_options(num_threads)
+    )
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    return pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy="simple")
+
+
+def load_embedding_model(model_name, backend=INFERENCE_BACKEND, num_threads=ONNX_THREADS):
+    """SentenceTransformer running on the selected backend."""
+    from sentence_transformers import SentenceTransformer
+
+    _check_backend(backend)
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+
+    path = _export_dir(model_name, "sentence-transformer")
+    file_name = os.path.join("onnx", "model.onnx")
+    if not os.path.exists(os.path.join(path, file_name)):
+        print(f"Exporting {model_name} to ONNX...")
+        SentenceTransformer(model_name, backend="onnx").save_pretrained(path)
+
+    if backend == "onnx-int8":
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        # The export names the file after the config's weight type (quint8 for avx2)
+        # unless given a suffix, so fix the suffix to find the file again next run
+        file_suffix = f"qint8_{ONNX_QUANTIZATION}"
+        file_name = os.path.join("onnx", f"model_{file_suffix}.onnx")
+        if not os.path.exists(os.path.join(path, file_name)):
+            print(f"Quantising {model_name} to int8 ({ONNX_QUANTIZATION})...")
+            model = SentenceTransformer(path, backend="onnx")
+            export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION, path, file_suffix=file_suffix)
+
+    return SentenceTransformer(path, backend="onnx", model_kwargs={
+        "file_name": file_name,
+        "provider": "CPUExecutionProvider",
+        "session_options": _session_options(num_threads),
+    })
+
+
+def _entity_set(results):
+    return {(ent["entity_group"], ent["word"]) for result in results for ent in result}
+
+
+def _entity_f1(reference, candidate):
+    true_positives = len(reference & candidate)
+    if not reference and not candidate:
+        return 1.0
+    precision = true_positives / len(candidate) if candidate else 0.0
+    recall = true_positives / len(reference) if reference else 0.0
+    return 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+
+def check_backend(backend, limit=200, processed_dir="data/processed"):
+    """Compare backend against PyTorch on the processed corpus and print accuracy and speed."""
+    import numpy as np
+
+    import corpus
+    import embedding_cache
+    import ner_ack
+
+    acks, abstracts = [], []
+    papers = corpus.load_corpus(processed_dir=processed_dir).iter_rows(("abstract", "acknowledgements"))
+    for data in islice(papers, limit):
+        if (data["acknowledgements"] or "").strip():
+            acks.append(data["acknowledgements"])
+        if (data["abstract"] or "").strip():
+            abstracts.append(data["abstract"])
+    if not acks and not abstracts:
+        print(f"No processed papers found in {processed_dir}")
+        return
+
+    timings = {}
+    if acks:
+        entities = {}
+        for name in ("torch", backend):
+            ner = load_ner_pipeline(ner_ack.NER_MODEL, name)
+            start = time.perf_counter()
+            entities[name] = [_entity_set([r]) for r in ner_ack.run_ner(ner, acks)]
+            timings[f"ner {name}"] = len(acks) / (time.perf_counter() - start)
+        f1 = [_entity_f1(ref, cand) for ref, cand in zip(entities["torch"], entities[backend])]
+        print(f"NER entity F1 vs torch over {len(acks)} acknowledgements: "
+              f"mean {np.mean(f1):.4f}, min {np.min(f1):.4f}")
+
+    if abstracts:
+        vectors = {}
+        for name in ("torch", backend):
+            model = load_embedding_model(embedding_cache.EMBEDDING_MODEL, name)
+            start = time.perf_counter()
+            vectors[name] = model.encode(abstracts, convert_to_numpy=True, normalize_embeddings=True)
+            timings[f"embeddings {name}"] = len(abstracts) / (time.perf_counter() - start)
+        cosine = np.sum(vectors["torch"] * vectors[backend], axis=1)
+        print(f"Embedding cosine vs torch over {len(abstracts)} abstracts: "
+              f"mean {cosine.mean():.5f}, min {cosine.min():.5f}")
+
+    for name, rate in timings.items():
+        print(f"{name:<24} {rate:10.1f} docs/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare an inference backend against PyTorch.")
+    parser.add_argument("--check", action="store_true", help="run the accuracy and speed check")
+    parser.add_argument("--backend", default="onnx-int8", choices=BACKENDS[1:])
+    parser.add_argument("--limit", type=int, default=200, help="papers to compare")
+    args = parser.parse_args()
+
+    if not args.check:
+        parser.print_help()
+        return
+    check_backend(args.backend, limit=args.limit)
+
+
+if __name__ == "__main__":
+    main()
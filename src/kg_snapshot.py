@@ -0,0 +1,273 @@
+"""Binary, memory-mapped snapshot of the knowledge graph.
+
+Parsing the RDF file on every Streamlit start is slow and turns each triple
+into several Python objects. build_kg.py therefore also writes a snapshot:
+
+* terms.bin / term_offsets.npy: every distinct term in N-Triples syntax,
+  sorted, so a term's ID is its rank and lookups are a binary search.
+* spo.npy, pos.npy, osp.npy: the triples as int32 ID rows, each sorted by
+  its own column order so any triple pattern is a range of one of them,
+  plus *_offsets.npy with the row range of each term in the leading column.
+
+Everything is opened with mmap, so loading takes milliseconds and the pages
+are shared by every process reading the same snapshot. Each build is
+published as a new version of KG_SNAPSHOT_DIR (see versioned_dir.py), so
+readers never find it missing while it is rewritten.
+
+Building is not constant-memory like the streamed RDF file: the builder
+holds every distinct term and every triple until save(), which then sorts
+one copy of the triples per index (see SnapshotBuilder). SnapshotStore plugs
+the snapshot into rdflib (read-only), so SPARQL works unchanged. See
+kg_store.py for the other storage backends.
+
+    python src/kg_snapshot.py --validate data/output/kg.ttl
+"""
+
+import argparse
+import array
+import json
+import os
+import time
+
+import numpy as np
+import rdflib
+from rdflib.store import VALID_STORE
+
+import versioned_dir
+from kg_store import KG_TERM_CACHE, ReadOnlyStore, decode_term, encode_term
+
+KG_SNAPSHOT_DIR = os.environ.get("KG_SNAPSHOT_DIR", "data/output/kg_snapshot")
+
+SNAPSHOT_VERSION = 1
+# Column order of each index file
+ORDERS = {"spo": (0, 1, 2), "pos": (1, 2, 0), "osp": (2, 0, 1)}
+
+class SnapshotBuilder:
+    """Collects encoded triples and writes them as a snapshot directory.
+
+    Memory grows with the graph: a dict entry per distinct term and 12 bytes
+    per triple while adding, then roughly 40 bytes more per triple during
+    save(). Graphs too large for that can be built with KG_SNAPSHOT=0.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.rows = array.array("i")
+
+    def add(self, subject, predicate, obj):
+        """Add one triple given as three encoded terms."""
+        ids = self.ids
+        for term in (subject, predicate, obj):
+            if term not in ids:
+                ids[term] = len(ids)
+        self.rows.extend((ids[subject], ids[predicate], ids[obj]))
+
+    def save(self, directory=KG_SNAPSHOT_DIR):
+        start = time.perf_counter()
+        terms = sorted(self.ids, key=lambda term: term.encode("utf-8"))
+        # Renumber terms by rank so that IDs follow the sorted term file
+        rank = np.empty(len(terms), dtype=np.int32)
+        for new_id, term in enumerate(terms):
+            rank[self.ids[term]] = new_id
+        triples = rank[np.frombuffer(self.rows, dtype=np.int32).reshape(-1, 3)]
+        # Only the renumbered copy is needed from here on
+        self.ids, self.rows, rank = {}, array.array("i"), None
+        triples = np.unique(triples, axis=0)
+
+        encoded = [term.encode("utf-8") for term in terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term in encoded], out=offsets[1:])
+
+        tmp_dir = versioned_dir.new_version(directory)
+        with open(os.path.join(tmp_dir, "terms.bin"), "wb") as f:
+            f.write(b"".join(encoded))
+        np.save(os.path.join(tmp_dir, "term_offsets.npy"), offsets)
+        for name, order in ORDERS.items():
+            rows = triples[:, order]
+            rows = rows[np.lexsort(rows.T[::-1])]
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(rows))
+            # Row range of every term in the leading column, so the first lookup is O(1)
+            starts = np.searchsorted(rows[:, 0], np.arange(len(terms) + 1))
+            np.save(os.path.join(tmp_dir, f"{name}_offsets.npy"), starts.astype(np.int64))
+            del rows, starts
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump({"version": SNAPSHOT_VERSION, "terms": len(terms), "triples": len(triples)}, f)
+
+        # Readers keep their mmaps of the previous version
+        versioned_dir.publish(tmp_dir)
+        print(f"KG snapshot with {len(triples)} triples and {len(terms)} terms written to "
+              f"{directory} in {time.perf_counter() - start:.1f}s")
+
+
+def meta_path(directory=KG_SNAPSHOT_DIR):
+    """meta.json of the published snapshot; written last, so it marks a complete one."""
+    return os.path.join(versioned_dir.current(directory), "meta.json")
+
+
+def exists(directory=KG_SNAPSHOT_DIR):
+    return os.path.exists(meta_path(directory))
+
+
+def _mmap(path):
+    # Plain ndarray views of the mapping avoid np.memmap's per-slice overhead
+    return np.load(path, mmap_mode="r").view(np.ndarray)
+
+
+class Snapshot:
+    """Read-only view of a snapshot directory; all arrays are memory-mapped."""
+
+    def __init__(self, directory=KG_SNAPSHOT_DIR):
+        directory = versioned_dir.current(directory)
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported KG snapshot version in {directory}: {meta.get('version')}")
+        self.directory = directory
+        self.term_count = meta["terms"]
+        self.offsets = _mmap(os.path.join(directory, "term_offsets.npy"))
+        self.terms = np.memmap(os.path.join(directory, "terms.bin"), dtype=np.uint8, mode="r").view(np.ndarray) \
+            if self.offsets[-1] else np.zeros(0, dtype=np.uint8)
+        self.indexes = {name: _mmap(os.path.join(directory, f"{name}.npy")) for name in ORDERS}
+        self.starts = {name: _mmap(os.path.join(directory, f"{name}_offsets.npy")) for name in ORDERS}
+        # Decoded terms, and the IDs of terms handed out (they come back as query bindings)
+        self._terms = {}
+        self._ids = {}
+
+    def __len__(self):
+        return len(self.indexes["spo"])
+
+    def _text(self, term_id):
+        return self.terms[self.offsets[term_id]:self.offsets[term_id + 1]].tobytes()
+
+    def term(self, term_id):
+        term = self._terms.get(term_id)
+        if term is None:
+            if len(self._terms) >= KG_TERM_CACHE:
+                self._terms.clear()
+                self._ids.clear()
+            term = decode_term(self._text(term_id).decode("utf-8"))
+            self._terms[term_id] = term
+            self._ids[term] = term_id
+        return term
+
+    def term_id(self, term):
+        """ID of an rdflib term, or None if the graph does not contain it."""
+        if term in self._ids:
+            return self._ids[term]
+        key = encode_term(term).encode("utf-8")
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._text(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self._text(low) == key:
+            return low
+        return None
+
+    def match(self, subject_id=None, predicate_id=None, object_id=None):
+        """(n, 3) array of S, P, O ID rows matching the bound positions."""
+        bound = (subject_id, predicate_id, object_id)
+        # Pick the index whose leading columns are the bound positions
+        if subject_id is not None:
+            name = "osp" if predicate_id is None and object_id is not None else "spo"
+        elif predicate_id is not None:
+            name = "pos"
+        elif object_id is not None:
+            name = "osp"
+        else:
+            name = "spo"
+        order = ORDERS[name]
+        rows = self.indexes[name]
+
+        if bound[order[0]] is not None:
+            starts = self.starts[name]
+            rows = rows[starts[bound[order[0]]]:starts[bound[order[0]] + 1]]
+            for column, position in enumerate(order[1:], start=1):
+                if bound[position] is None or not len(rows):
+                    break
+                values = np.asarray(rows[:, column])
+                rows = rows[np.searchsorted(values, bound[position], "left"):
+                            np.searchsorted(values, bound[position], "right")]
+
+        # Back to S, P, O column order
+        return np.asarray(rows)[:, np.argsort(order)]
+
+    def triples(self, pattern=(None, None, None)):
+        """Yield rdflib (s, p, o) triples matching a pattern of rdflib terms or None."""
+        ids = []
+        for term in pattern:
+            if term is None:
+                ids.append(None)
+                continue
+            term_id = self.term_id(term)
+            if term_id is None:
+                return
+            ids.append(term_id)
+        term = self.term
+        for s, p, o in self.match(*ids).tolist():
+            yield term(s), term(p), term(o)
+
+
+class SnapshotStore(ReadOnlyStore):
+    """Read-only rdflib store over a Snapshot, so Graph.query() and SPARQL work unchanged."""
+
+    def open(self, configuration, create=False):
+        self.snapshot = Snapshot(configuration)
+        directory = self.snapshot.directory
+        self.version = (os.path.abspath(directory), os.stat(os.path.join(directory, "meta.json")).st_mtime_ns)
+        return VALID_STORE
+
+    def close(self, commit_pending_transaction=False):
+        # The memory maps are released once no array view refers to them
+        self.snapshot = None
+
+    def triples(self, triple_pattern, context=None):
+        for triple in self.snapshot.triples(triple_pattern):
+            yield triple, iter(())
+
+    def __len__(self, context=None):
+        return len(self.snapshot)
+
+
+def load_snapshot(directory=KG_SNAPSHOT_DIR):
+    """rdflib.Graph backed by the memory-mapped snapshot."""
+    return rdflib.Graph(store=SnapshotStore(directory))
+
+
+def validate(rdf_path, directory=KG_SNAPSHOT_DIR):
+    """Check that the snapshot holds exactly the triples of an RDF file; returns True if so."""
+    import kg_utils
+
+    expected = kg_utils.load_kg(rdf_path)
+    snapshot = Snapshot(directory)
+    actual = set(snapshot.triples())
+    expected = set(expected.triples((None, None, None)))
+    missing, extra = expected - actual, actual - expected
+    print(f"Snapshot: {len(actual)} triples, {rdf_path}: {len(expected)} triples, "
+          f"{len(missing)} missing from snapshot, {len(extra)} not in {rdf_path}")
+    for triple in list(missing)[:5]:
+        print(f"  missing: {triple}")
+    for triple in list(extra)[:5]:
+        print(f"  extra: {triple}")
+    return not missing and not extra
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or validate the KG snapshot.")
+    parser.add_argument("--validate", metavar="RDF_FILE",
+                        help="compare the snapshot with an RDF file (e.g. data/output/kg.ttl)")
+    parser.add_argument("--dir", default=KG_SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    snapshot = Snapshot(args.dir)
+    print(f"Opened {args.dir} in {(time.perf_counter() - start) * 1000:.1f} ms: "
+          f"{len(snapshot)} triples, {snapshot.term_count} terms")
+    if args.validate and not validate(args.validate, args.dir):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
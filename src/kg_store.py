@@ -0,0 +1,253 @@
+"""Storage backends for the knowledge graph.
+
+build_kg.py streams triples to the RDF file and to any of these stores;
+kg_utils.load_kg() opens the one selected by KG_BACKEND:
+
+* "auto" (default): the snapshot if it is up to date with the RDF file, else
+  the SQLite store if that is up to date, else the RDF file itself.
+* "snapshot": memory-mapped arrays (kg_snapshot.py), fastest to open.
+* "sqlite": an SQLite file with SPO/POS/OSP indexes. It opens read-only in
+  milliseconds and answers each triple pattern from an index, so memory stays
+  flat however large the graph.
+* "rdf": parse kg.nt.gz / kg.nt / kg.nq / kg.ttl into rdflib's in-memory store.
+
+Both persistent stores plug into rdflib as read-only Store implementations,
+so every SPARQL helper in kg_utils works on any backend.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import time
+
+import rdflib
+from rdflib.store import VALID_STORE, Store
+
+KG_BACKEND = os.environ.get("KG_BACKEND", "auto")
+KG_SQLITE_PATH = os.environ.get("KG_SQLITE_PATH", "data/output/kg.sqlite")
+# Written by build_kg.py after every other output, so readers reload once per finished build
+KG_BUILD_STAMP = "data/output/kg_build.json"
+# Decoded terms kept in memory per process
+KG_TERM_CACHE = int(os.environ.get("KG_TERM_CACHE", "100000"))
+
+BACKENDS = ("auto", "snapshot", "sqlite", "rdf")
+# Triple rows buffered before each bulk insert while building
+SQLITE_BATCH_SIZE = 50000
+
+_LITERAL_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r"})
+_UNESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+_UNESCAPE_CHARS = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+
+def encode_term(term):
+    """N-Triples form of a URI or literal."""
+    if isinstance(term, rdflib.Literal):
+        encoded = '"' + str(term).translate(_LITERAL_ESCAPES) + '"'
+        if term.language:
+            return f"{encoded}@{term.language}"
+        if term.datatype:
+            return f"{encoded}^^<{term.datatype}>"
+        return encoded
+    if isinstance(term, rdflib.BNode):
+        return f"_:{term}"
+    return f"<{term}>"
+
+
+def _unescape(match):
+    if match.group(3) is not None:
+        return _UNESCAPE_CHARS.get(match.group(3), match.group(3))
+    return chr(int(match.group(1) or match.group(2), 16))
+
+
+def decode_term(text):
+    """rdflib term for an N-Triples term written by encode_term()."""
+    if text.startswith("<"):
+        return rdflib.URIRef(text[1:-1])
+    if text.startswith("_:"):
+        return rdflib.BNode(text[2:])
+    end = text.rindex('"')
+    value = _UNESCAPE.sub(_unescape, text[1:end])
+    suffix = text[end + 1:]
+    if suffix.startswith("@"):
+        return rdflib.Literal(value, lang=suffix[1:])
+    if suffix.startswith("^^"):
+        return rdflib.Literal(value, datatype=rdflib.URIRef(suffix[3:-1]))
+    return rdflib.Literal(value)
+
+
+def write_build_stamp(path=KG_BUILD_STAMP):
+    """Mark the graph files and stores as completely written."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"built_at": time.time()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def is_current(marker, rdf_paths):
+    """True if marker exists and is not older than any streamed graph file.
+
+    Turtle files are ignored: they are converted from the streamed file after the stores.
+    """
+    if not os.path.exists(marker):
+        return False
+    built = os.path.getmtime(marker)
+    return all(os.path.getmtime(path) <= built for path in rdf_paths if not path.endswith(".ttl"))
+
+
+class ReadOnlyStore(Store):
+    """Base for the persistent backends: rdflib calls triples(), writes are refused.
+
+    open() sets version to identify the file it opened (see kg_utils.graph_version).
+    """
+
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, configuration=None, identifier=None):
+        super().__init__(configuration=None, identifier=identifier)
+        self._namespaces = {}
+        self.version = None
+        if configuration:
+            self.open(configuration)
+
+    def add(self, triple, context, quoted=False):
+        raise TypeError(f"{type(self).__name__} is read-only; rebuild it with build_kg.py")
+
+    def remove(self, triple, context=None):
+        raise TypeError(f"{type(self).__name__} is read-only; rebuild it with build_kg.py")
+
+    def bind(self, prefix, namespace, override=True):
+        self._namespaces[prefix] = namespace
+
+    def namespace(self, prefix):
+        return self._namespaces.get(prefix)
+
+    def prefix(self, namespace):
+        return next((p for p, ns in self._namespaces.items() if ns == namespace), None)
+
+    def namespaces(self):
+        return iter(self._namespaces.items())
+
+
+class SqliteBuilder:
+    """Collects encoded triples into a new SQLite store, swapped in on save()."""
+
+    def __init__(self, path=KG_SQLITE_PATH):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.tmp_path)
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE terms (id INTEGER PRIMARY KEY, term TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE triples (s INTEGER NOT NULL, p INTEGER NOT NULL, o INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value)")
+        self.ids = {}
+        self._terms = []
+        self._rows = []
+
+    def add(self, subject, predicate, obj):
+        """Add one triple given as three encoded terms."""
+        ids = self.ids
+        for term in (subject, predicate, obj):
+            if term not in ids:
+                ids[term] = len(ids)
+                self._terms.append((ids[term], term))
+        self._rows.append((ids[subject], ids[predicate], ids[obj]))
+        if len(self._rows) >= SQLITE_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self._conn.executemany("INSERT INTO terms VALUES (?, ?)", self._terms)
+        self._conn.executemany("INSERT INTO triples VALUES (?, ?, ?)", self._rows)
+        self._terms, self._rows = [], []
+
+    def save(self):
+        start = time.perf_counter()
+        self._flush()
+        conn = self._conn
+        # Deduplicate once, then build the indexes over the bulk-loaded rows
+        conn.execute("CREATE TABLE spo (s INTEGER, p INTEGER, o INTEGER, PRIMARY KEY (s, p, o)) WITHOUT ROWID")
+        conn.execute("INSERT OR IGNORE INTO spo SELECT s, p, o FROM triples ORDER BY s, p, o")
+        conn.execute("DROP TABLE triples")
+        conn.execute("CREATE INDEX pos ON spo (p, o, s)")
+        conn.execute("CREATE INDEX osp ON spo (o, s, p)")
+        conn.execute("CREATE UNIQUE INDEX term_text ON terms (term)")
+        count = conn.execute("SELECT count(*) FROM spo").fetchone()[0]
+        conn.execute("INSERT INTO meta VALUES ('triples', ?)", (count,))
+        conn.commit()
+        conn.execute("ANALYZE")
+        conn.close()
+        os.replace(self.tmp_path, self.path)
+        print(f"KG SQLite store with {count} triples and {len(self.ids)} terms written to "
+              f"{self.path} in {time.perf_counter() - start:.1f}s")
+
+
+class SqliteStore(ReadOnlyStore):
+    """Read-only rdflib store over the SQLite file written by SqliteBuilder."""
+
+    def open(self, configuration, create=False):
+        # immutable: no locking or change checks; a rebuild replaces the file instead
+        self._conn = sqlite3.connect(f"file:{os.path.abspath(configuration)}?mode=ro&immutable=1",
+                                     uri=True, check_same_thread=False)
+        self._length = self._conn.execute("SELECT value FROM meta WHERE key = 'triples'").fetchone()[0]
+        self.version = (os.path.abspath(configuration), os.stat(configuration).st_mtime_ns)
+        self._terms = {}
+        self._ids = {}
+        return VALID_STORE
+
+    def close(self, commit_pending_transaction=False):
+        self._conn.close()
+
+    def _term(self, term_id, text):
+        term = self._terms.get(term_id)
+        if term is None:
+            if len(self._terms) >= KG_TERM_CACHE:
+                self._terms.clear()
+                self._ids.clear()
+            term = decode_term(text)
+            self._terms[term_id] = term
+            self._ids[term] = term_id
+        return term
+
+    def _term_id(self, term):
+        if term in self._ids:
+            return self._ids[term]
+        row = self._conn.execute("SELECT id FROM terms WHERE term = ?", (encode_term(term),)).fetchone()
+        return row[0] if row else None
+
+    def triples(self, triple_pattern, context=None):
+        conditions, params = [], []
+        for column, term in zip("spo", triple_pattern):
+            if term is None:
+                continue
+            term_id = self._term_id(term)
+            if term_id is None:
+                return
+            conditions.append(f"t.{column} = ?")
+            params.append(term_id)
+
+        query = ("SELECT t.s, t.p, t.o, ts.term, tp.term, tt.term FROM spo t "
+                 "JOIN terms ts ON ts.id = t.s JOIN terms tp ON tp.id = t.p JOIN terms tt ON tt.id = t.o")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        term = self._term
+        for s, p, o, s_text, p_text, o_text in self._conn.execute(query, params):
+            yield (term(s, s_text), term(p, p_text), term(o, o_text)), iter(())
+
+    def __len__(self, context=None):
+        return self._length
+
+
+def sqlite_exists(path=KG_SQLITE_PATH):
+    return os.path.exists(path)
+
+
+def load_sqlite(path=KG_SQLITE_PATH):
+    """rdflib.Graph backed by the SQLite store, opened read-only."""
+    return rdflib.Graph(store=SqliteStore(path))
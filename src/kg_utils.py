@@ -1,13 +1,261 @@
+import gzip
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
 import rdflib
 import pandas as pd
+from rdflib.plugins.sparql import prepareQuery
 from urllib.parse import unquote
 
+import kg_snapshot
+import kg_store
+
+KG_DIR = "./data/output"
+KG_EXTENSIONS = (".nt.gz", ".nt", ".nq.gz", ".nq", ".ttl")
+
 # Loads the RDF graph from disk
-def load_kg(path="./data/output/kg.ttl"):
-    g = rdflib.Graph()
-    g.parse(path, format="turtle")
+def load_kg(path=None, backend=kg_store.KG_BACKEND):
+    """Load the knowledge graph from the storage backend selected by KG_BACKEND (see kg_store.py).
+
+    path overrides the backend: an RDF file, the snapshot directory or the SQLite store.
+    """
+    if backend not in kg_store.BACKENDS:
+        raise ValueError(f"Unknown KG backend: {backend} (expected one of {kg_store.BACKENDS})")
+    if path is None:
+        candidates = [os.path.join(KG_DIR, f"kg{ext}") for ext in KG_EXTENSIONS]
+        candidates = [p for p in candidates if os.path.exists(p)]
+        if backend == "snapshot" or backend == "auto" and kg_store.is_current(kg_snapshot.meta_path(), candidates):
+            return kg_snapshot.load_snapshot()
+        if backend == "sqlite" or backend == "auto" and kg_store.is_current(kg_store.KG_SQLITE_PATH, candidates):
+            return kg_store.load_sqlite()
+        if not candidates:
+            raise FileNotFoundError(f"No knowledge graph found in {KG_DIR}; run src/build_kg.py")
+        path = max(candidates, key=os.path.getmtime)
+    if os.path.isdir(path):
+        return kg_snapshot.load_snapshot(path)
+    if path.endswith(".sqlite"):
+        return kg_store.load_sqlite(path)
+    quads = ".nq" in os.path.basename(path)
+    # N-Quads keep triples in a named graph; queries run over the union of all graphs
+    g = rdflib.Dataset(default_union=True) if quads else rdflib.Graph()
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        g.parse(f, format="nquads" if quads else "nt" if ".nt" in os.path.basename(path) else "turtle")
+    # Identifies the parsed file for graph_version(), like the persistent stores do
+    g.store.version = (os.path.abspath(path), os.stat(path).st_mtime_ns)
     return g
 
+
+def kg_fingerprint():
+    """(path, mtime, size) of the build stamp; changes once per finished build_kg.py run.
+
+    The stamp is written after the RDF file and every store, so a build in
+    progress, with a new RDF file but the old snapshot, is never seen as a new
+    graph. Without a stamp (graph files put in place by hand) every file
+    load_kg() may read is used instead.
+    """
+    paths = [kg_store.KG_BUILD_STAMP]
+    if not os.path.exists(kg_store.KG_BUILD_STAMP):
+        paths = [os.path.join(KG_DIR, f"kg{ext}") for ext in KG_EXTENSIONS]
+        paths += [kg_snapshot.meta_path(), kg_store.KG_SQLITE_PATH]
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+# Query results kept per process (0 disables result caching)
+KG_QUERY_CACHE_SIZE = int(os.environ.get("KG_QUERY_CACHE_SIZE", "4096"))
+# Latencies kept per query for the percentiles in QueryCache.report() (the most recent ones)
+KG_QUERY_STATS_WINDOW = 1000
+# Seconds a replaced graph stays open for sessions that started querying it before the reload
+KG_RETIRE_SECONDS = float(os.environ.get("KG_RETIRE_SECONDS", "300"))
+
+
+def graph_version(g):
+    """Changes whenever g's contents may have changed.
+
+    Graphs from load_kg() report the file they were read from and its mtime;
+    any other in-memory graph is identified by its store and size.
+    """
+    version = getattr(g.store, "version", None)
+    return version if version is not None else (id(g.store), len(g))
+
+
+def _order_patterns(node, known):
+    """Order each basic graph pattern so that bound parameters are joined on first.
+
+    rdflib orders triple patterns when the query is prepared, before it knows
+    which variables initBindings will fill, and so would start
+    `?paper ex:acknowledges ?person . ?person a foaf:Person` by scanning every
+    person. Patterns touching an already bound variable go first here.
+    """
+    if isinstance(node, list):
+        for item in node:
+            _order_patterns(item, known)
+        return
+    if not isinstance(node, dict):
+        return
+    if getattr(node, "name", None) == "BGP":
+        remaining, ordered, bound = list(node["triples"]), [], set(known)
+        while remaining:
+            best = max(remaining, key=lambda t: (
+                sum(1 for term in t if isinstance(term, rdflib.Variable) and term in bound),
+                sum(1 for term in t if not isinstance(term, (rdflib.Variable, rdflib.BNode))),
+            ))
+            remaining.remove(best)
+            ordered.append(best)
+            bound.update(term for term in best if isinstance(term, (rdflib.Variable, rdflib.BNode)))
+        node["triples"] = ordered
+        return
+    for value in node.values():
+        _order_patterns(value, known)
+
+
+class QueryCache:
+    """SPARQL queries prepared once, with an LRU cache of their results and per-query stats.
+
+    Parameters are passed as initBindings rather than formatted into the query
+    text, so a URI can never change the query. Results are cached under
+    (query, bindings, graph version).
+    """
+
+    def __init__(self, maxsize=KG_QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.prepared = {}
+        self.results = OrderedDict()
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def _prepare(self, query, parameters):
+        key = (query, parameters)
+        prepared = self.prepared.get(key)
+        if prepared is None:
+            prepared = prepareQuery(query)
+            _order_patterns(prepared.algebra, set(map(rdflib.Variable, parameters)))
+            self.prepared[key] = prepared
+        return prepared
+
+    def run(self, g, name, query, **bindings):
+        """Rows of query over g with the given variable bindings (rdflib terms)."""
+        start = time.perf_counter()
+        key = (query, tuple(sorted(bindings.items())), graph_version(g))
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = {
+                    "hits": 0, "misses": 0,
+                    "hit_seconds": deque(maxlen=KG_QUERY_STATS_WINDOW),
+                    "miss_seconds": deque(maxlen=KG_QUERY_STATS_WINDOW),
+                }
+            rows = self.results.get(key)
+            if rows is not None:
+                self.results.move_to_end(key)
+                stats["hits"] += 1
+                stats["hit_seconds"].append(time.perf_counter() - start)
+                return rows
+
+        prepared = self._prepare(query, tuple(sorted(bindings)))
+        rows = list(g.query(prepared, initBindings=bindings))
+        with self._lock:
+            stats["misses"] += 1
+            stats["miss_seconds"].append(time.perf_counter() - start)
+            if self.maxsize > 0:
+                self.results[key] = rows
+                while len(self.results) > self.maxsize:
+                    self.results.popitem(last=False)
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self.results.clear()
+
+    def report(self):
+        """Per-query calls, hit rate and latency percentiles (ms) of recent calls, as a DataFrame."""
+        def percentile(values, q):
+            return round(sorted(values)[min(len(values) - 1, int(len(values) * q))] * 1000, 3) if values else None
+
+        with self._lock:
+            rows = [{
+                "query": name,
+                "calls": s["hits"] + s["misses"],
+                "hit_rate": round(s["hits"] / (s["hits"] + s["misses"]), 3),
+                "miss_p50_ms": percentile(s["miss_seconds"], 0.5),
+                "miss_p95_ms": percentile(s["miss_seconds"], 0.95),
+                "hit_p50_ms": percentile(s["hit_seconds"], 0.5),
+            } for name, s in self.stats.items()]
+        return pd.DataFrame(rows, columns=["query", "calls", "hit_rate", "miss_p50_ms", "miss_p95_ms", "hit_p50_ms"])
+
+
+query_cache = QueryCache()
+
+
+def run_query(g, name, query, **bindings):
+    """Run a registered SPARQL query through the shared prepared-query cache."""
+    return query_cache.run(g, name, query, **bindings)
+
+
+class SharedKG:
+    """The loaded graph and results derived from it, shared by every caller in the process.
+
+    Dashboard sessions run in one process, so the first session to need a result
+    computes it and the others reuse it. Everything is keyed by kg_fingerprint():
+    once build_kg.py writes a new graph, the next call reloads it and drops the
+    old results. Sessions that started before the rebuild may still be querying
+    the replaced graph, so it stays open for KG_RETIRE_SECONDS, however many
+    reloads happen meanwhile, and is closed by the first call after that,
+    releasing its SQLite connection or memory maps.
+    """
+
+    def __init__(self, backend=kg_store.KG_BACKEND):
+        self.backend = backend
+        self.fingerprint = None
+        self._graph = None
+        # (graph, monotonic time it was replaced), oldest first
+        self._retired = deque()
+        self.results = {}
+        # Reentrant so a compute function may ask for other shared results
+        self._lock = threading.RLock()
+
+    def graph(self):
+        """The current graph, reloaded if the files on disk changed since it was loaded."""
+        fingerprint = kg_fingerprint()
+        with self._lock:
+            if self._graph is None or fingerprint != self.fingerprint:
+                start = time.perf_counter()
+                if self._graph is not None:
+                    self._retired.append((self._graph, time.monotonic()))
+                self._graph = load_kg(backend=self.backend)
+                self.fingerprint = fingerprint
+                self.results = {}
+                query_cache.clear()
+                print(f"Knowledge graph with {len(self._graph)} triples loaded in "
+                      f"{time.perf_counter() - start:.1f}s")
+            while self._retired and time.monotonic() - self._retired[0][1] >= KG_RETIRE_SECONDS:
+                self._retired.popleft()[0].close()
+            return self._graph
+
+    def result(self, name, compute):
+        """compute(graph), evaluated once per graph version; callers must not modify it."""
+        with self._lock:
+            g = self.graph()
+            if name not in self.results:
+                self.results[name] = compute(g)
+            return self.results[name]
+
+    def views(self):
+        """PaperViews of the current graph."""
+        return self.result("paper_views", PaperViews)
+
+
+shared_kg = SharedKG()
+
+
 # Gets all papers with their assigned topics (for DataFrame)
 def get_papers_by_topic(g):
     query = """
@@ -23,7 +271,7 @@ def get_papers_by_topic(g):
       }
     }
     """
-    qres = g.query(query)
+    qres = run_query(g, "get_papers_by_topic", query)
 
     rows = []
     for row in qres:
@@ -57,7 +305,7 @@ def get_all_papers(g):
              dcterms:title ?title .
     }
     """
-    qres = g.query(query)
+    qres = run_query(g, "get_all_papers", query)
 
     papers = []
     for row in qres:
@@ -74,13 +322,12 @@ def get_paper_details(g, paper_uri):
     PREFIX dcterms: <http://purl.org/dc/terms/>
     
     SELECT ?title ?abstract WHERE {
-      BIND (<%s> AS ?paper)
       ?paper dcterms:title ?title ;
              dcterms:abstract ?abstract .
     }
-    """ % paper_uri
+    """
 
-    qres = g.query(query)
+    qres = run_query(g, "get_paper_details", query, paper=rdflib.URIRef(paper_uri))
     for row in qres:
         return {
             "title": str(row.title),
@@ -94,13 +341,12 @@ def get_similar_papers(g, paper_uri):
     PREFIX ex: <http://example.org/>
     
     SELECT ?similar ?title WHERE {
-      BIND (<%s> AS ?paper)
       ?paper ex:similar_to ?similar .
       ?similar <http://purl.org/dc/terms/title> ?title .
     }
-    """ % paper_uri
+    """
 
-    qres = g.query(query)
+    qres = run_query(g, "get_similar_papers", query, paper=rdflib.URIRef(paper_uri))
     similars = []
     for row in qres:
         similars.append({
@@ -121,7 +367,7 @@ def get_organizations(g):
            foaf:name ?name .
     }
     """
-    qres = g.query(query)
+    qres = run_query(g, "get_organizations", query)
     orgs = []
     for row in qres:
         orgs.append({
@@ -137,14 +383,13 @@ def get_people_by_paper(g, paper_uri):
     PREFIX foaf: <http://xmlns.com/foaf/0.1/>
     
     SELECT DISTINCT ?person ?name WHERE {
-      BIND (<%s> AS ?paper)
       ?paper ex:acknowledges ?person .
       ?person a foaf:Person ;
               foaf:name ?name .
     }
-    """ % paper_uri
+    """
 
-    qres = g.query(query)
+    qres = run_query(g, "get_people_by_paper", query, paper=rdflib.URIRef(paper_uri))
     people = []
     for row in qres:
         people.append({
@@ -160,18 +405,114 @@ def get_organizations_by_paper(g, paper_uri):
     PREFIX foaf: <http://xmlns.com/foaf/0.1/>
     
     SELECT DISTINCT ?org ?name WHERE {
-      BIND (<%s> AS ?paper)
       ?paper ex:acknowledges ?org .
       ?org a foaf:Organization ;
            foaf:name ?name .
     }
-    """ % paper_uri
+    """
 
-    qres = g.query(query)
+    qres = run_query(g, "get_organizations_by_paper", query, paper=rdflib.URIRef(paper_uri))
     orgs = []
     for row in qres:
         orgs.append({
             "uri": str(row.org),
             "name": str(row.name)
         })
-    return orgs
\ No newline at end of file
+    return orgs
+
+EX = rdflib.Namespace("http://example.org/")
+DCTERMS = rdflib.Namespace("http://purl.org/dc/terms/")
+FOAF = rdflib.Namespace("http://xmlns.com/foaf/0.1/")
+
+
+class PaperViews:
+    """Per-paper indexes materialised from one pass over the graph.
+
+    The dashboard pages need the same few facts for many papers; answering
+    them from dictionaries avoids one SPARQL query per paper. The batch
+    accessors take a list of paper URIs and return {uri: value}, with the
+    same value shapes as the matching get_* function.
+    """
+
+    def __init__(self, g):
+        papers = {str(s) for s in g.subjects(rdflib.RDF.type, EX.Paper)}
+        persons = {str(s) for s in g.subjects(rdflib.RDF.type, FOAF.Person)}
+        organizations = {str(s) for s in g.subjects(rdflib.RDF.type, FOAF.Organization)}
+
+        def values(predicate, subjects=None):
+            index = {}
+            for s, o in g.subject_objects(predicate):
+                if subjects is None or str(s) in subjects:
+                    index.setdefault(str(s), []).append(str(o))
+            return index
+
+        self.titles = values(DCTERMS.title, papers)
+        self.abstracts = values(DCTERMS.abstract, papers)
+        self.topics = values(EX.belongs_to_topic, papers)
+        self.topic_ids = values(DCTERMS.identifier)
+        self.similar_to = values(EX.similar_to, papers)
+        names = values(FOAF.name)
+        self.people_by_paper, self.organizations_by_paper = {}, {}
+        for paper, acknowledged in values(EX.acknowledges, papers).items():
+            for uri in dict.fromkeys(acknowledged):
+                for name in dict.fromkeys(names.get(uri, [])):
+                    entry = {"uri": uri, "name": name}
+                    if uri in persons:
+                        self.people_by_paper.setdefault(paper, []).append(entry)
+                    if uri in organizations:
+                        self.organizations_by_paper.setdefault(paper, []).append(entry)
+        self._all_papers = None
+        self._papers_by_topic = None
+
+    def all_papers(self):
+        """Same as get_all_papers(); built once, so treat it as read-only."""
+        if self._all_papers is None:
+            self._all_papers = [{"uri": uri, "title": title}
+                                for uri, titles in self.titles.items() for title in titles]
+        return self._all_papers
+
+    def papers_by_topic(self):
+        """Same as get_papers_by_topic(); built once, so treat it as read-only."""
+        if self._papers_by_topic is None:
+            self._papers_by_topic = self._build_papers_by_topic()
+        return self._papers_by_topic
+
+    def _build_papers_by_topic(self):
+        rows = []
+        for paper, titles in self.titles.items():
+            topics = [(topic, topic_id) for topic in self.topics.get(paper, [])
+                      for topic_id in self.topic_ids.get(topic, [])] or [(None, None)]
+            for title in titles:
+                for topic_uri, topic_id in topics:
+                    rows.append({
+                        "paper": paper,
+                        "title": title,
+                        "topic_uri": topic_uri,
+                        "topic": topic_uri.split("topic_")[-1] if topic_uri else None,
+                        "topic_id": topic_id,
+                    })
+        return pd.DataFrame(rows, columns=["paper", "title", "topic_uri", "topic", "topic_id"])
+
+    def details(self, paper_uris):
+        """{uri: {"title", "abstract"}} like get_paper_details(); papers without both are left out."""
+        details = {}
+        for uri in paper_uris:
+            if self.titles.get(uri) and self.abstracts.get(uri):
+                details[uri] = {"title": self.titles[uri][0], "abstract": self.abstracts[uri][0]}
+        return details
+
+    def similar(self, paper_uris):
+        """{uri: [{"uri", "title"}, ...]} like get_similar_papers()."""
+        return {
+            uri: [{"uri": other, "title": title}
+                  for other in self.similar_to.get(uri, []) for title in self.titles.get(other, [])]
+            for uri in paper_uris
+        }
+
+    def people(self, paper_uris):
+        """{uri: [{"uri", "name"}, ...]} like get_people_by_paper()."""
+        return {uri: list(self.people_by_paper.get(uri, [])) for uri in paper_uris}
+
+    def organizations(self, paper_uris):
+        """{uri: [{"uri", "name"}, ...]} like get_organizations_by_paper()."""
+        return {uri: list(self.organizations_by_paper.get(uri, [])) for uri in paper_uris}
@@ -0,0 +1,236 @@
+"""Shared building blocks for the enrichment clients (Wikidata, ROR).
+
+* LookupCache: persistent SQLite cache of lookup results with a TTL.
+* TokenBucket: thread-safe rate limiter.
+* pooled_session: requests.Session with a sized connection pool.
+* resolve_all: look up each unique name once, cache first, with bounded
+  concurrency, retrying rate-limited and failed requests through the limiter.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+LOOKUP_CACHE_PATH = os.environ.get("LOOKUP_CACHE_PATH", "data/cache/lookups.sqlite")
+# Cached results older than this many days are looked up again
+LOOKUP_CACHE_TTL_DAYS = float(os.environ.get("LOOKUP_CACHE_TTL_DAYS", "30"))
+USER_AGENT = "Research-KG-Project/1.0 (research-project)"
+
+# Responses worth retrying: rate limited, or a transient server error
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+LOOKUP_RETRIES = 3
+LOOKUP_BACKOFF = 0.5
+# Longest wait honoured from a Retry-After or rate-limit reset header, in seconds
+LOOKUP_MAX_RETRY_AFTER = float(os.environ.get("LOOKUP_MAX_RETRY_AFTER", "60"))
+
+_MISSING = object()
+
+
+def normalize_name(name):
+    """Key under which differently spaced or cased mentions of a name share one lookup."""
+    return re.sub(r"\s+", " ", name).strip().casefold()
+
+
+class LookupCache:
+    """Persistent key/value cache of JSON results, one namespace per service."""
+
+    def __init__(self, path=LOOKUP_CACHE_PATH, ttl_days=LOOKUP_CACHE_TTL_DAYS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.ttl = ttl_days * 86400
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lookups ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "fetched_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self._conn.commit()
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, fetched_at FROM lookups WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return default
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO lookups (namespace, key, value, fetched_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), time.time()),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second on average, with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Drain the bucket so no request goes out for `seconds` (server asked us to back off)."""
+        with self._lock:
+            self.tokens = -seconds * self.rate
+            self.updated = time.monotonic()
+
+
+def pooled_session(pool_size, retries=LOOKUP_RETRIES):
+    """Session reusing up to pool_size connections.
+
+    Only failed connection attempts are retried here: they never reach the
+    server. Error responses are retried by resolve_all(), so that every
+    request that does reach the server takes a rate-limiter token.
+    """
+    retry = Retry(total=retries, connect=retries, read=0, status=0, other=0,
+                  backoff_factor=LOOKUP_BACKOFF, allowed_methods=("GET",),
+                  respect_retry_after_header=False, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class LookupStats:
+    """Cache hit/miss counts and per-request latencies of one resolver run."""
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.capped_waits = 0
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        metrics.observe(f"{self.name.lower()}_request", seconds)
+        with self._lock:
+            self.latencies.append(seconds)
+            if error:
+                self.errors += 1
+
+    def record_capped_wait(self):
+        with self._lock:
+            self.capped_waits += 1
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        line = (f"{self.name}: {self.hits + self.misses} unique names, {self.hits} cache hits, "
+                f"{self.misses} looked up, {self.errors} errors")
+        if self.capped_waits:
+            line += f", {self.capped_waits} server waits capped at {LOOKUP_MAX_RETRY_AFTER:g}s"
+        if latencies:
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            line += f", latency p50 {p50:.3f}s p95 {p95:.3f}s max {latencies[-1]:.3f}s"
+        print(line)
+
+
+def cap_wait(seconds, stats=None):
+    """seconds, but at most LOOKUP_MAX_RETRY_AFTER; capped waits are counted in stats."""
+    if seconds <= LOOKUP_MAX_RETRY_AFTER:
+        return seconds
+    if stats is not None:
+        stats.record_capped_wait()
+    return LOOKUP_MAX_RETRY_AFTER
+
+
+def retry_delay(error, attempt, backoff=LOOKUP_BACKOFF):
+    """Seconds to wait before retrying after error, or None if it is not worth retrying."""
+    if isinstance(error, requests.exceptions.Timeout):
+        return backoff * 2 ** attempt
+    response = getattr(error, "response", None)
+    if response is None or response.status_code not in RETRY_STATUSES:
+        return None
+    retry_after = response.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return float(retry_after)
+    return backoff * 2 ** attempt
+
+
+def resolve_all(names, fetch, namespace, cache, stats, limiter=None, concurrency=4, retries=LOOKUP_RETRIES):
+    """Return {name: result} for each unique name.
+
+    Names are collapsed with normalize_name(), the cache is checked first, and
+    only misses are passed to fetch(name) on a pool of `concurrency` threads.
+    fetch raises on transient failures; 429/5xx responses and timeouts are
+    retried up to `retries` times with backoff (or the server's Retry-After,
+    capped by cap_wait()), each attempt taking a limiter token. Failed results
+    are not cached.
+    """
+    keys = {}
+    for name in names:
+        keys.setdefault(normalize_name(name), name)
+
+    results, pending = {}, []
+    for key, name in keys.items():
+        cached = cache.get(namespace, key, _MISSING)
+        if cached is _MISSING:
+            pending.append(key)
+        else:
+            results[key] = cached
+    stats.hits += len(results)
+    stats.misses += len(pending)
+
+    def lookup(key):
+        for attempt in range(retries + 1):
+            if limiter is not None:
+                limiter.acquire()
+            start = time.perf_counter()
+            try:
+                value = fetch(keys[key])
+            except (requests.exceptions.RequestException, ValueError) as e:
+                delay = retry_delay(e, attempt) if attempt < retries else None
+                stats.record(time.perf_counter() - start, error=delay is None)
+                if delay is None:
+                    print(f"  Lookup failed for '{keys[key]}': {e}")
+                    return key, None
+                time.sleep(cap_wait(delay, stats))
+                continue
+            stats.record(time.perf_counter() - start)
+            cache.set(namespace, key, value)
+            return key, value
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for key, value in executor.map(lookup, pending):
+                results[key] = value
+
+    return {name: results[normalize_name(name)] for name in names}
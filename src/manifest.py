@@ -0,0 +1,93 @@
+"""Per-stage manifests of content hashes for incremental pipeline runs.
+
+Each stage records a digest for every input it processed (a PDF, an abstract,
+an acknowledgement, ...) and for the output files it wrote. On the next run
+only inputs whose digest changed are reprocessed and merged into the existing
+outputs. Setting KG_FULL_REBUILD=1 (`run_pipeline.py --full`) ignores every
+manifest and rebuilds from scratch.
+"""
+
+import hashlib
+import json
+import os
+
+MANIFEST_DIR = "data/output/manifest"
+
+
+def full_rebuild():
+    """True when KG_FULL_REBUILD=1; read on every call, so run_pipeline.py --full can set it late."""
+    return os.environ.get("KG_FULL_REBUILD") == "1"
+
+
+def file_digest(path):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def data_digest(data):
+    """SHA-256 of a JSON-serialisable value."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_json(path, default):
+    """Load a previous stage output, or default if it does not exist."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+class Manifest:
+    """Input and output digests recorded by one stage at its last successful run."""
+
+    def __init__(self, stage, outputs=(), full=None):
+        self.path = os.path.join(MANIFEST_DIR, f"{stage}.json")
+        if full is None:
+            full = full_rebuild()
+        data = {} if full else load_json(self.path, {})
+        self.previous = data.get("inputs", {})
+        # Anything else the stage saved alongside its inputs (see save())
+        self.state = data.get("state", {})
+
+        # Outputs deleted or edited since the last run invalidate everything
+        previous_outputs = data.get("outputs", {})
+        for path in outputs:
+            if not os.path.exists(path) or previous_outputs.get(path) != file_digest(path):
+                self.previous = {}
+                self.state = {}
+                break
+
+    @property
+    def is_fresh(self):
+        """True when there is no previous state to merge into."""
+        return not self.previous
+
+    def changed(self, current):
+        """Keys of current ({key: digest}) that are new or whose digest changed."""
+        return [key for key, digest in current.items() if self.previous.get(key) != digest]
+
+    def removed(self, current):
+        """Keys recorded at the last run that are no longer present."""
+        return [key for key in self.previous if key not in current]
+
+    def up_to_date(self, current):
+        """True when current matches the last run exactly."""
+        return bool(self.previous) and self.previous == current
+
+    def save(self, current, outputs=(), state=None):
+        """Record current and the outputs' digests; state is any JSON the stage wants back next run."""
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        data = {
+            "inputs": current,
+            "outputs": {path: file_digest(path) for path in outputs},
+            "state": state or {},
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,309 @@
+"""Per-stage metrics and profiles of a pipeline run.
+
+run_pipeline.py measures each stage: wall time, CPU time, peak RSS, and the
+items it processed. Stages time their external calls (GROBID requests,
+pdfminer, model loading, inference, Wikidata/ROR lookups, graph
+serialisation) with observe() or timer(), and each call name gets a latency
+histogram. At the end of a run the results are written as JSON
+(PIPELINE_REPORT_PATH) and in Prometheus text format (PIPELINE_METRICS_PATH).
+Each run is also appended to PIPELINE_HISTORY_PATH, so stage times can be
+compared with the previous run.
+
+With PIPELINE_PROFILE=cprofile (or pyinstrument, if installed) each stage
+is profiled into PIPELINE_PROFILE_DIR. Only the stage's own thread is
+profiled; worker pools and child processes are not.
+
+Modules run on their own (python src/similarity.py) still record metrics,
+but nothing is written.
+"""
+
+import bisect
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+PIPELINE_REPORT_PATH = os.environ.get("PIPELINE_REPORT_PATH", "data/output/pipeline_report.json")
+PIPELINE_METRICS_PATH = os.environ.get("PIPELINE_METRICS_PATH", "data/output/pipeline_metrics.prom")
+PIPELINE_HISTORY_PATH = os.environ.get("PIPELINE_HISTORY_PATH", "data/output/pipeline_runs.jsonl")
+# "cprofile" or "pyinstrument" writes one profile per stage; empty disables profiling
+PIPELINE_PROFILE = os.environ.get("PIPELINE_PROFILE", "")
+PIPELINE_PROFILE_DIR = os.environ.get("PIPELINE_PROFILE_DIR", "data/output/profiles")
+
+PROFILERS = ("cprofile", "pyinstrument")
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Latencies kept per call for the percentiles (the most recent ones); count, sum,
+# max and the buckets cover every call
+HISTOGRAM_WINDOW = 1000
+# How often the RSS of running stages is sampled
+RSS_SAMPLE_INTERVAL = 0.1
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _max_rss():
+    """Peak RSS of this process so far in bytes, used where current_rss() is unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux reports kilobytes, macOS bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _cpu_seconds():
+    """CPU time of this process and its finished children."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class Histogram:
+    """Latency histogram of one kind of call, with Prometheus-style cumulative buckets."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.values = deque(maxlen=HISTOGRAM_WINDOW)
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.values.append(seconds)
+
+    def summary(self):
+        values = sorted(self.values)
+
+        def percentile(q):
+            return round(values[min(len(values) - 1, int(len(values) * q))], 4)
+
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(self.max, 4),
+            "buckets": {str(bound): count for bound, count in zip(BUCKETS + ("+Inf",), self._cumulative())},
+        }
+
+    def _cumulative(self):
+        total, cumulative = 0, []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+class Registry:
+    """Stage records, item counts and call histograms of one process, safe to use from any thread."""
+
+    def __init__(self):
+        self.stages = {}
+        self.items = {}
+        self.histograms = {}
+        self._running = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def observe(self, call, seconds):
+        """Record the latency of one external call."""
+        with self._lock:
+            self.histograms.setdefault(call, Histogram()).observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, call):
+        """Time the enclosed block as one call."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(call, time.perf_counter() - start)
+
+    def add_items(self, module, count):
+        """Count items (papers, names, triples...) processed by a stage module."""
+        with self._lock:
+            self.items[module] = self.items.get(module, 0) + count
+
+    def _sample_rss(self):
+        while True:
+            with self._lock:
+                if not self._running:
+                    self._sampler = None
+                    return
+                rss = current_rss()
+                for record in self._running.values():
+                    record["peak_rss_bytes"] = max(record["peak_rss_bytes"] or 0, rss)
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+    @contextlib.contextmanager
+    def stage(self, name, module, profile=PIPELINE_PROFILE):
+        """Measure the enclosed stage; the record is kept under name even if the stage fails.
+
+        CPU time covers the whole process, so it includes stages running at
+        the same time; RSS excludes child processes.
+        """
+        profiler = _start_profiler(profile)
+        record = {"module": module, "status": "running", "peak_rss_bytes": current_rss() or _max_rss()}
+        with self._lock:
+            self.stages[name] = record
+            self._running[name] = record
+            if self._sampler is None and current_rss() is not None:
+                self._sampler = threading.Thread(target=self._sample_rss, daemon=True)
+                self._sampler.start()
+        items_before = self.items.get(module, 0)
+        start, cpu_start = time.perf_counter(), _cpu_seconds()
+        try:
+            yield record
+            record["status"] = "ok"
+        except BaseException:
+            record["status"] = "failed"
+            raise
+        finally:
+            wall = time.perf_counter() - start
+            if profiler is not None:
+                record["profile"] = _save_profile(profiler, profile, name)
+            items = self.items.get(module, 0) - items_before
+            with self._lock:
+                del self._running[name]
+                record.update({
+                    "wall_seconds": round(wall, 3),
+                    "cpu_seconds": round(_cpu_seconds() - cpu_start, 3),
+                    "peak_rss_bytes": max(record["peak_rss_bytes"] or 0, current_rss() or _max_rss() or 0) or None,
+                    "items": items,
+                    "items_per_second": round(items / wall, 2) if wall > 0 else None,
+                })
+
+    def report(self, total_seconds=None):
+        """The run as a JSON-serialisable dict."""
+        with self._lock:
+            return {
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "total_seconds": round(total_seconds, 3) if total_seconds is not None else None,
+                "stages": {name: dict(record) for name, record in self.stages.items()},
+                "calls": {call: histogram.summary() for call, histogram in sorted(self.histograms.items())},
+            }
+
+    def prometheus(self, report):
+        """The report in Prometheus text exposition format."""
+        def label(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+        lines = []
+        for metric, field, help_text in (
+            ("kg_pipeline_stage_wall_seconds", "wall_seconds", "Wall-clock time of the stage"),
+            ("kg_pipeline_stage_cpu_seconds", "cpu_seconds", "Process CPU time while the stage ran"),
+            ("kg_pipeline_stage_peak_rss_bytes", "peak_rss_bytes", "Peak resident memory while the stage ran"),
+            ("kg_pipeline_stage_items", "items", "Items processed by the stage"),
+            ("kg_pipeline_stage_items_per_second", "items_per_second", "Stage throughput"),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            for name, record in report["stages"].items():
+                if record.get(field) is not None:
+                    lines.append(f'{metric}{{stage="{label(name)}",status="{record["status"]}"}} {record[field]}')
+
+        metric = "kg_pipeline_call_seconds"
+        lines += [f"# HELP {metric} Latency of external calls made by the stages", f"# TYPE {metric} histogram"]
+        for call, summary in report["calls"].items():
+            for bound, count in summary["buckets"].items():
+                lines.append(f'{metric}_bucket{{call="{label(call)}",le="{bound}"}} {count}')
+            lines.append(f'{metric}_sum{{call="{label(call)}"}} {summary["sum"]}')
+            lines.append(f'{metric}_count{{call="{label(call)}"}} {summary["count"]}')
+        if report["total_seconds"] is not None:
+            lines += ["# TYPE kg_pipeline_total_seconds gauge", f"kg_pipeline_total_seconds {report['total_seconds']}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, total_seconds, report_path=PIPELINE_REPORT_PATH, metrics_path=PIPELINE_METRICS_PATH,
+              history_path=PIPELINE_HISTORY_PATH):
+        """Write the JSON report, the Prometheus file and a history line; returns the previous run's line."""
+        report = self.report(total_seconds)
+        previous = last_run(history_path)
+        for path, text in ((report_path, json.dumps(report, indent=2)), (metrics_path, self.prometheus(report))):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+        os.makedirs(os.path.dirname(history_path) or ".", exist_ok=True)
+        with open(history_path, "a") as f:
+            f.write(json.dumps({
+                "finished_at": report["finished_at"],
+                "total_seconds": report["total_seconds"],
+                "stages": {name: record.get("wall_seconds") for name, record in report["stages"].items()},
+            }) + "\n")
+        return previous
+
+
+def last_run(history_path=PIPELINE_HISTORY_PATH):
+    """Most recent line of the run history, or None."""
+    try:
+        with open(history_path) as f:
+            lines = [line for line in f if line.strip()]
+    except FileNotFoundError:
+        return None
+    return json.loads(lines[-1]) if lines else None
+
+
+def _start_profiler(profile):
+    if not profile:
+        return None
+    if profile not in PROFILERS:
+        raise ValueError(f"Unknown profiler: {profile} (expected one of {PROFILERS})")
+    if profile == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _save_profile(profiler, profile, name):
+    """Stop the profiler and write it to PIPELINE_PROFILE_DIR; returns the file path."""
+    os.makedirs(PIPELINE_PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PIPELINE_PROFILE_DIR, name.lower().replace(" ", "_"))
+    if profile == "pyinstrument":
+        profiler.stop()
+        path = base + ".html"
+        with open(path, "w") as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        # Inspect with: python -m pstats <file>, or snakeviz
+        path = base + ".prof"
+        profiler.dump_stats(path)
+    return path
+
+
+registry = Registry()
+
+
+def observe(call, seconds):
+    """Record the latency of one external call in the process-wide registry."""
+    registry.observe(call, seconds)
+
+
+def timer(call):
+    """Context manager timing one external call into the process-wide registry."""
+    return registry.timer(call)
+
+
+def add_items(module, count):
+    """Count items processed by a stage module in the process-wide registry."""
+    registry.add_items(module, count)
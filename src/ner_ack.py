@@ -1,14 +1,25 @@
 import json
+import multiprocessing
 import os
-from transformers import pipeline
+from concurrent.futures import ProcessPoolExecutor
+
+import corpus
+import inference_backend
+import metrics
+from manifest import Manifest, data_digest, load_json
+
+ENTITIES_PATH = "./data/output/entities.json"
+NER_MODEL = "dslim/bert-base-NER"
+# Texts per forward pass
+NER_BATCH_SIZE = int(os.environ.get("NER_BATCH_SIZE", "16"))
+# Worker processes for CPU inference (1 runs in this process)
+NER_WORKERS = int(os.environ.get("NER_WORKERS", "1"))
+# Long acknowledgements are split into windows of NER_MAX_TOKENS tokens overlapping by NER_STRIDE
+NER_MAX_TOKENS = int(os.environ.get("NER_MAX_TOKENS", "384"))
+NER_STRIDE = int(os.environ.get("NER_STRIDE", "64"))
 
 def load_acknowledgements():
-    acks, ids = [], []
-    for file in os.listdir("./data/processed"):
-        with open(f"data/processed/{file}") as f:
-            data = json.load(f)
-            acks.append(data['acknowledgements'])
-            ids.append(data['id'])
+    ids, acks = corpus.load_corpus().columns("id", "acknowledgements")
     return ids, acks
 
 def detokenize(text):
@@ -24,37 +35,128 @@ def detokenize(text):
                 new_text += token
     return new_text
 
-def extract_entities():
-    # We use a NER model from Hugging Face
-    ner = pipeline("ner", model="dslim/bert-base-NER", grouped_entities=True)
+def load_ner_pipeline(num_threads=inference_backend.ONNX_THREADS):
+    # We use a NER model from Hugging Face, on the backend chosen by INFERENCE_BACKEND
+    return inference_backend.load_ner_pipeline(NER_MODEL, num_threads=num_threads)
+
+def chunk_text(text, tokenizer, max_tokens=NER_MAX_TOKENS, stride=NER_STRIDE):
+    """Split text into windows of at most max_tokens tokens, overlapping by stride tokens.
+
+    The model silently truncates anything past its maximum length, so entities
+    near the end of long acknowledgements would otherwise be lost.
+    """
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    if len(offsets) <= max_tokens:
+        return [text]
+    chunks = []
+    step = max_tokens - stride
+    for start in range(0, len(offsets), step):
+        window = offsets[start:start + max_tokens]
+        chunks.append(text[window[0][0]:window[-1][1]])
+        if start + max_tokens >= len(offsets):
+            break
+    return chunks
+
+def run_ner(ner, texts, batch_size=NER_BATCH_SIZE):
+    """Run the pipeline over texts in length-sorted batches; returns results in input order.
+
+    Sorting by length keeps texts of similar size in the same batch, so little
+    of each forward pass is spent on padding.
+    """
+    if not texts:
+        return []
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    results = [None] * len(texts)
+    outputs = ner([texts[i] for i in order], batch_size=batch_size)
+    for i, output in zip(order, outputs):
+        results[i] = output
+    return results
+
+_worker_ner = None
 
+def _init_worker(num_threads):
+    """Load the pipeline once per worker, pinned to its share of the CPU threads."""
+    global _worker_ner
+    import torch
+    torch.set_num_threads(num_threads)
+    _worker_ner = load_ner_pipeline(num_threads)
+
+def _run_worker(texts):
+    return run_ner(_worker_ner, texts)
+
+def run_ner_parallel(texts, workers=NER_WORKERS):
+    """Split texts into contiguous length-sorted shards and run each in its own process."""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    shard_size = -(-len(texts) // workers)
+    shards = [order[i:i + shard_size] for i in range(0, len(order), shard_size)]
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    results = [None] * len(texts)
+    # spawn, not fork: run_pipeline.py may be running other stages in threads of this process
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,),
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        shard_outputs = executor.map(_run_worker, [[texts[i] for i in shard] for shard in shards])
+        for shard, outputs in zip(shards, shard_outputs):
+            for i, output in zip(shard, outputs):
+                results[i] = output
+    return results
+
+def extract_entities():
     ids, acks = load_acknowledgements()
-    all_entities = {}
 
-    for paper_id, ack in zip(ids, acks):
-        results = ner(ack)
+    # Only acknowledgements that changed since the last run go through the model
+    manifest = Manifest("ner", outputs=[ENTITIES_PATH])
+    current = {paper_id: data_digest(ack) for paper_id, ack in zip(ids, acks)}
+    changed = set(manifest.changed(current))
+    all_entities = {} if manifest.is_fresh else load_json(ENTITIES_PATH, {})
+    for paper_id in manifest.removed(current):
+        all_entities.pop(paper_id, None)
+    print(f"NER on {len(changed)} new or changed acknowledgements, {len(ids) - len(changed)} unchanged")
+
+    chunks, chunk_papers = [], []
+    if changed:
+        with metrics.timer("ner_model_load"):
+            ner = load_ner_pipeline()
+        for paper_id, ack in zip(ids, acks):
+            if paper_id not in changed:
+                continue
+            all_entities[paper_id] = {"persons": set(), "organizations": set()}
+            if not ack.strip():
+                continue
+            for chunk in chunk_text(ack, ner.tokenizer):
+                chunks.append(chunk)
+                chunk_papers.append(paper_id)
 
-        persons = set()
-        organizations = set()
+        with metrics.timer("ner_inference"):
+            if NER_WORKERS > 1 and len(chunks) > NER_BATCH_SIZE:
+                del ner
+                results = run_ner_parallel(chunks)
+            else:
+                results = run_ner(ner, chunks)
 
-        for ent in results:
-            label = ent["entity_group"]
-            text = detokenize(ent["word"])
-            if label == "PER":
-                persons.add(text)
-            elif label == "ORG":
-                organizations.add(text)
+        # Overlapping windows may report the same entity twice; the sets dedupe them
+        for paper_id, result in zip(chunk_papers, results):
+            for ent in result:
+                label = ent["entity_group"]
+                text = detokenize(ent["word"])
+                if label == "PER":
+                    all_entities[paper_id]["persons"].add(text)
+                elif label == "ORG":
+                    all_entities[paper_id]["organizations"].add(text)
 
-        all_entities[paper_id] = {
-            "persons": sorted(persons),
-            "organizations": sorted(organizations)
-        }
+        for paper_id in changed:
+            all_entities[paper_id] = {
+                "persons": sorted(all_entities[paper_id]["persons"]),
+                "organizations": sorted(all_entities[paper_id]["organizations"])
+            }
 
     os.makedirs("./data/output", exist_ok=True)
-    with open("./data/output/entities.json", "w") as f:
+    with open(ENTITIES_PATH, "w") as f:
         json.dump(all_entities, f, indent=2)
+    manifest.save(current, outputs=[ENTITIES_PATH])
+    metrics.add_items("ner_ack", len(changed))
 
-    print("Entity extraction (via Hugging Face) completed and saved.")
+    print(f"Entity extraction (via Hugging Face) completed and saved ({len(chunks)} text windows).")
 
 if __name__ == "__main__":
     extract_entities()
\ No newline at end of file
@@ -1,23 +1,195 @@
 import os
 import json
+import random
+import re
+import time
 import requests
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
 from lxml import etree
 from pdfminer.high_level import extract_text
+from pdfminer.pdfpage import PDFPage
+
+import corpus
+import metrics
+from manifest import Manifest, file_digest
 
 GROBID_URL = os.environ.get("GROBID_URL", "http://localhost:8070/api/processFulltextDocument")
+# Requests in flight at once; size it to GROBID's worker pool
+GROBID_CONCURRENCY = int(os.environ.get("GROBID_CONCURRENCY", "4"))
+GROBID_MAX_RETRIES = int(os.environ.get("GROBID_MAX_RETRIES", "5"))
+GROBID_BACKOFF = float(os.environ.get("GROBID_BACKOFF", "1.0"))
+GROBID_TIMEOUT = float(os.environ.get("GROBID_TIMEOUT", "300"))
+GROBID_TIMINGS_PATH = "data/output/grobid_timings.json"
+# Worker processes for pdfminer text extraction
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(os.cpu_count() or 1)))
+# Scan only the last N pages for acknowledgements first (0 always scans the whole PDF)
+ACK_TAIL_PAGES = int(os.environ.get("ACK_TAIL_PAGES", "0"))
+
+# "tei" takes acknowledgements from GROBID's TEI and falls back to pdfminer; "pdf" always uses pdfminer
+ACK_SOURCE = os.environ.get("ACK_SOURCE", "tei")
+# Also store the reference list parsed from the TEI in each processed JSON
+TEI_REFERENCES = os.environ.get("TEI_REFERENCES", "0") == "1"
+TEI_CACHE_DIR = os.environ.get("TEI_CACHE_DIR", "data/cache/tei")
+TEI_NS = {'tei': 'http://www.tei-c.org/ns/1.0'}
 
-def extract_text_from_pdf(pdf_path):
+ACK_START_MARKERS = ["acknowledgements", "acknowledgment", "acknowledgments", "acknowledgement"]
+ACK_END_MARKERS = ["references", "bibliography", "appendix", "citations"]
+# Headings located by extract_sections(); each section ends at the next heading of any kind
+SECTION_MARKERS = {
+    "acknowledgements": ACK_START_MARKERS,
+    "funding": ["funding", "financial support", "financial disclosure"],
+    "author_contributions": [
+        "author contributions", "authors' contributions", "authors contributions",
+        "credit authorship contribution statement", "contributorship"
+    ],
+}
+# Sections stored in each processed JSON besides the acknowledgements
+EXTRA_SECTIONS = tuple(name for name in SECTION_MARKERS if name != "acknowledgements")
+
+def extract_text_from_pdf(pdf_path, page_numbers=None):
     """Extract full text from PDF (used for acknowledgements)."""
-    return extract_text(pdf_path)
+    return extract_text(pdf_path, page_numbers=page_numbers)
 
-def grobid_parse_pdf(pdf_path):
-    """Send PDF to GROBID and get TEI XML."""
+def count_pdf_pages(pdf_path):
+    """Count pages without running layout analysis."""
     with open(pdf_path, 'rb') as f:
-        response = requests.post(GROBID_URL, files={'input': f})
-        if response.status_code != 200:
-            print(f"[!] Error con GROBID: {response.status_code}")
+        return sum(1 for _ in PDFPage.get_pages(f))
+
+def _sections_from_text(text):
+    """Acknowledgements plus the EXTRA_SECTIONS found in plain text ("" where missing)."""
+    sections = extract_sections(text)
+    return {name: sections.get(name, "") for name in SECTION_MARKERS}
+
+def extract_sections_from_pdf(pdf_path, tail_pages=ACK_TAIL_PAGES):
+    """Extract the acknowledgements, funding and author contribution sections with pdfminer.
+
+    With tail_pages > 0 only the last pages, where acknowledgements and
+    references usually are, are parsed first; the whole document is parsed
+    only if the acknowledgements are not found there.
+    """
+    if tail_pages > 0:
+        page_count = count_pdf_pages(pdf_path)
+        if page_count > tail_pages:
+            text = extract_text_from_pdf(pdf_path, range(page_count - tail_pages, page_count))
+            sections = _sections_from_text(text)
+            if sections["acknowledgements"]:
+                return sections
+
+    return _sections_from_text(extract_text_from_pdf(pdf_path))
+
+def timed_sections_from_pdf(pdf_path):
+    """extract_sections_from_pdf() in a worker process, returning (sections, seconds)."""
+    start = time.perf_counter()
+    sections = extract_sections_from_pdf(pdf_path)
+    return sections, time.perf_counter() - start
+
+def grobid_session(pool_size=GROBID_CONCURRENCY):
+    """HTTP session whose connection pool can serve pool_size concurrent requests."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def grobid_parse_pdf(pdf_path, session=None, timings=None):
+    """Send PDF to GROBID and get TEI XML.
+
+    Retries with exponential backoff while GROBID answers 503 (all workers busy)
+    or the connection fails. Each attempt is appended to timings if given.
+    """
+    session = session or requests
+    for attempt in range(GROBID_MAX_RETRIES + 1):
+        start = time.perf_counter()
+        try:
+            with open(pdf_path, 'rb') as f:
+                response = session.post(GROBID_URL, files={'input': f}, timeout=GROBID_TIMEOUT)
+            status = response.status_code
+        except requests.exceptions.RequestException as e:
+            print(f"[!] Error de conexión con GROBID ({os.path.basename(pdf_path)}): {e}")
+            response, status = None, None
+
+        metrics.observe("grobid_request", time.perf_counter() - start)
+        if timings is not None:
+            timings.append({
+                "file": os.path.basename(pdf_path),
+                "attempt": attempt,
+                "status": status,
+                "seconds": round(time.perf_counter() - start, 4)
+            })
+
+        if status == 200:
+            return response.text
+        if status is not None and status != 503:
+            print(f"[!] Error con GROBID: {status}")
             return None
-        return response.text
+        if attempt < GROBID_MAX_RETRIES:
+            # Jitter keeps concurrent workers from retrying in lockstep
+            time.sleep(GROBID_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    print(f"[!] GROBID sigue ocupado tras {GROBID_MAX_RETRIES} reintentos")
+    return None
+
+def grobid_parse_many(pdf_paths, concurrency=GROBID_CONCURRENCY):
+    """Yield (pdf_path, xml) as GROBID finishes, keeping at most concurrency requests in flight."""
+    timings = []
+    session = grobid_session(concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                executor.submit(grobid_parse_pdf, path, session, timings): path
+                for path in pdf_paths
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+    finally:
+        session.close()
+        save_grobid_timings(timings, concurrency)
+
+def tei_cache_path(pdf_digest):
+    """TEI cache entries are keyed by PDF content, so edited PDFs are parsed again."""
+    return os.path.join(TEI_CACHE_DIR, f"{pdf_digest}.tei.xml")
+
+def grobid_parse_cached(pdf_digests, concurrency=GROBID_CONCURRENCY):
+    """Yield (pdf_path, xml) for {pdf_path: digest}, only sending uncached PDFs to GROBID."""
+    to_parse = []
+    for pdf_path, digest in pdf_digests.items():
+        cache_path = tei_cache_path(digest)
+        if os.path.exists(cache_path):
+            with open(cache_path, encoding="utf-8") as f:
+                yield pdf_path, f.read()
+        else:
+            to_parse.append(pdf_path)
+
+    os.makedirs(TEI_CACHE_DIR, exist_ok=True)
+    for pdf_path, xml in grobid_parse_many(to_parse, concurrency):
+        if xml:
+            cache_path = tei_cache_path(pdf_digests[pdf_path])
+            with open(cache_path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(xml)
+            os.replace(cache_path + ".tmp", cache_path)
+        yield pdf_path, xml
+
+def save_grobid_timings(timings, concurrency):
+    """Write per-request GROBID timings and print a latency summary."""
+    if not timings:
+        return
+    seconds = sorted(t["seconds"] for t in timings)
+    summary = {
+        "concurrency": concurrency,
+        "requests": len(seconds),
+        "retries": sum(1 for t in timings if t["attempt"] > 0),
+        "mean": round(sum(seconds) / len(seconds), 4),
+        "p50": seconds[len(seconds) // 2],
+        "p95": seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))],
+        "max": seconds[-1]
+    }
+    os.makedirs(os.path.dirname(GROBID_TIMINGS_PATH), exist_ok=True)
+    with open(GROBID_TIMINGS_PATH, "w") as f:
+        json.dump({"summary": summary, "requests": timings}, f, indent=2)
+    print(f"GROBID: {summary['requests']} peticiones, {summary['retries']} reintentos, "
+          f"p50 {summary['p50']}s, p95 {summary['p95']}s (concurrencia {concurrency})")
 
 def extract_from_grobid_xml(xml_text):
     """Parse XML from GROBID to get title, authors, abstract."""
@@ -45,22 +217,124 @@ def extract_from_grobid_xml(xml_text):
 
     return title, authors, abstract
 
+def _div_text(div):
+    """Headings, then paragraphs, of a TEI div with whitespace collapsed."""
+    parts = []
+    for el in div.iterfind('.//tei:head', namespaces=TEI_NS):
+        parts.append(" ".join("".join(el.itertext()).split()))
+    for el in div.iterfind('.//tei:p', namespaces=TEI_NS):
+        parts.append(" ".join("".join(el.itertext()).split()))
+    return [part for part in parts if part]
+
+def extract_acknowledgements_from_tei(xml_text):
+    """Get the acknowledgement section GROBID tags as <div type="acknowledgement">."""
+    root = etree.fromstring(xml_text.encode('utf-8'))
+    parts = []
+    for div in root.iterfind('.//tei:div[@type="acknowledgement"]', namespaces=TEI_NS):
+        parts.extend(_div_text(div))
+    return "\n".join(parts)
+
+def extract_sections_from_tei(xml_text):
+    """Get the EXTRA_SECTIONS from GROBID's TEI ("" where missing).
+
+    GROBID tags funding statements as <div type="funding">; other divs are
+    classified by their heading with the SECTION_MARKERS of extract_sections().
+    """
+    root = etree.fromstring(xml_text.encode('utf-8'))
+    groups = tuple((name, tuple(SECTION_MARKERS[name])) for name in EXTRA_SECTIONS)
+    parts = {name: [] for name in EXTRA_SECTIONS}
+    taken = set()
+    for div in root.iterfind('.//tei:div', namespaces=TEI_NS):
+        # A div inside one already taken is part of its text
+        if any(parent in taken for parent in div.iterancestors()):
+            continue
+        if div.get("type") == "funding":
+            name = "funding"
+        else:
+            head = div.find('tei:head', namespaces=TEI_NS)
+            heading = " ".join("".join(head.itertext()).split()) if head is not None else ""
+            name = next((name for name, _ in _headings(heading, groups)), None)
+            if name is None:
+                continue
+        taken.add(div)
+        parts[name].extend(_div_text(div))
+    return {name: "\n".join(section) for name, section in parts.items()}
+
+def extract_references_from_tei(xml_text):
+    """Get title and DOI of each entry in GROBID's parsed reference list."""
+    root = etree.fromstring(xml_text.encode('utf-8'))
+    references = []
+    for bibl in root.iterfind('.//tei:listBibl/tei:biblStruct', namespaces=TEI_NS):
+        title_el = bibl.find('.//tei:title', namespaces=TEI_NS)
+        doi_el = bibl.find('.//tei:idno[@type="DOI"]', namespaces=TEI_NS)
+        title = " ".join("".join(title_el.itertext()).split()) if title_el is not None else ""
+        doi = doi_el.text.strip() if doi_el is not None and doi_el.text else None
+        if title or doi:
+            references.append({"title": title, "doi": doi})
+    return references
+
+@lru_cache(maxsize=None)
+def _heading_pattern(groups):
+    """Compile one case-insensitive regex over every marker, with a named group per marker group.
+
+    Markers only match at the start of a line (or page), optionally after a
+    section number, so words like "funding" inside a paragraph are ignored.
+    Longer markers come first so "acknowledgements" wins over "acknowledgement".
+    Returns (pattern for the start of the text, pattern for the rest, group
+    names): the second one begins with a literal newline, which lets re jump
+    from line break to line break instead of trying every position.
+    """
+    parts = []
+    for i, (name, markers) in enumerate(groups):
+        alternation = "|".join(re.escape(m) for m in sorted(markers, key=len, reverse=True))
+        parts.append(f"(?P<g{i}>{alternation})")
+    heading = rf"[ \t\f]*(?:[0-9IVX]+\.?[ \t]*)?(?:{'|'.join(parts)})"
+    names = {f"g{i}": name for i, (name, _) in enumerate(groups)}
+    return re.compile(heading, re.IGNORECASE), re.compile("\n" + heading, re.IGNORECASE), names
+
+def _headings(text, groups):
+    """Yield (group name, start) for every heading in a single scan."""
+    first, rest, group_names = _heading_pattern(groups)
+    match = first.match(text)
+    if match:
+        yield group_names[match.lastgroup], match.start(match.lastgroup)
+    for match in rest.finditer(text):
+        yield group_names[match.lastgroup], match.start(match.lastgroup)
+
 def extract_section(text, start_markers, end_markers):
-    """Extract a section between start and end markers from full text."""
-    lower_text = text.lower()
-    
-    for start_marker in start_markers:
-        for end_marker in end_markers:
-            try:
-                start = lower_text.index(start_marker.lower())
-                end = lower_text.index(end_marker.lower(), start)
-                return text[start:end].strip()
-            except ValueError:
+    """Extract a section between start and end markers from full text.
+
+    The section starts at the first start heading and ends at the first end
+    heading after it; see extract_sections().
+    """
+    return extract_sections(text, {"section": start_markers}, end_markers).get("section", "")
+
+def extract_sections(text, section_markers=SECTION_MARKERS, end_markers=ACK_END_MARKERS):
+    """Extract several sections in one pass; returns {section name: text}.
+
+    Headings are markers at the start of a line. Each section starts at the first
+    heading of its kind and ends at the next heading of any kind (another section
+    or an end marker). Sections without a following heading are not returned.
+    """
+    groups = tuple((name, tuple(markers)) for name, markers in section_markers.items())
+    groups += (("__end__", tuple(end_markers)),)
+    sections = {}
+    current, current_start = None, None
+    for name, match_start in _headings(text, groups):
+        if current is not None:
+            # A repeated marker of the open section is just a mention inside it
+            if name == current:
                 continue
-    return ""
+            sections[current] = text[current_start:match_start].strip()
+            current = None
+        if name != "__end__" and name not in sections:
+            current, current_start = name, match_start
+        if len(sections) == len(section_markers):
+            break
+    return sections
 
-def save_metadata(paper_id, title, authors, abstract, acknowledgements):
-    """Save extracted metadata to JSON."""
+def save_metadata(paper_id, title, authors, abstract, acknowledgements, references=None, sections=None):
+    """Save extracted metadata to JSON; sections holds the EXTRA_SECTIONS texts."""
     metadata = {
         'id': paper_id,
         'title': title,
@@ -68,35 +342,95 @@ def save_metadata(paper_id, title, authors, abstract, acknowledgements):
         'abstract': abstract,
         'acknowledgements': acknowledgements
     }
+    for name in EXTRA_SECTIONS:
+        metadata[name] = (sections or {}).get(name, "")
+    if references is not None:
+        metadata['references'] = references
     os.makedirs("data/processed", exist_ok=True)
     with open(f"data/processed/{paper_id}.json", "w", encoding="utf-8") as f:
         json.dump(metadata, f, indent=2, ensure_ascii=False)
 
 def preprocess_papers():
-    """Process PDFs using Grobid (for metadata) and PDFMiner (for acknowledgements)."""
+    """Process PDFs using Grobid (for metadata and acknowledgements) and PDFMiner (as fallback).
+
+    Only PDFs that are new or changed since the last run are processed, and
+    GROBID's TEI is cached on disk so a PDF is never sent to GROBID twice.
+    """
     pdf_dir = "./data/papers"
-    for pdf_file in os.listdir(pdf_dir):
-        if pdf_file.endswith(".pdf"):
-            pdf_path = os.path.join(pdf_dir, pdf_file)
+    manifest = Manifest("preprocess")
+    current = {
+        pdf_file: file_digest(os.path.join(pdf_dir, pdf_file))
+        for pdf_file in sorted(os.listdir(pdf_dir))
+        if pdf_file.endswith(".pdf")
+    }
+
+    for pdf_file in manifest.removed(current):
+        processed_path = f"data/processed/{pdf_file.replace('.pdf', '')}.json"
+        if os.path.exists(processed_path):
+            os.remove(processed_path)
+            print(f"🗑️  Eliminado: {processed_path}")
+
+    changed = set(manifest.changed(current))
+    pending = [
+        pdf_file for pdf_file in current
+        if pdf_file in changed
+        or not os.path.exists(f"data/processed/{pdf_file.replace('.pdf', '')}.json")
+    ]
+    done = {pdf_file: digest for pdf_file, digest in current.items() if pdf_file not in pending}
+    print(f"{len(pending)} PDFs nuevos o modificados, {len(done)} sin cambios")
+
+    pdf_digests = {os.path.join(pdf_dir, pdf_file): current[pdf_file] for pdf_file in pending}
+    # pdfminer is CPU-bound, so it runs in worker processes while GROBID requests continue
+    with ProcessPoolExecutor(max_workers=PDF_WORKERS) as pdf_pool:
+        extractions = {}
+        for pdf_path, xml in grobid_parse_cached(pdf_digests):
+            pdf_file = os.path.basename(pdf_path)
+            paper_id = pdf_file.replace(".pdf", "")
             print(f"📄 Procesando: {pdf_file}")
 
-            xml = grobid_parse_pdf(pdf_path)
             if not xml:
                 print(f"[!] Falló GROBID para: {pdf_file}")
                 continue
 
             title, authors, abstract = extract_from_grobid_xml(xml)
+            references = extract_references_from_tei(xml) if TEI_REFERENCES else None
+            sections = extract_sections_from_tei(xml)
+
+            acknowledgements = extract_acknowledgements_from_tei(xml) if ACK_SOURCE == "tei" else ""
+            if acknowledgements:
+                save_metadata(paper_id, title, authors, abstract, acknowledgements, references, sections)
+                done[pdf_file] = current[pdf_file]
+                print(f"✅ Guardado: {paper_id}\n")
+                continue
+
+            # GROBID found no acknowledgements (or ACK_SOURCE=pdf): parse the PDF text instead
+            future = pdf_pool.submit(timed_sections_from_pdf, pdf_path)
+            extractions[future] = (pdf_file, (title, authors, abstract, references, sections))
 
-            text = extract_text_from_pdf(pdf_path)
-            acknowledgements = extract_section(
-                text,
-                ["acknowledgements", "acknowledgment", "acknowledgments", "acknowledgement"],
-                ["references", "bibliography", "appendix", "citations"]
-            )
+        for future in as_completed(extractions):
+            pdf_file, (title, authors, abstract, references, sections) = extractions[future]
+            try:
+                pdf_sections, seconds = future.result()
+            except Exception as e:
+                print(f"[!] Falló PDFMiner para: {pdf_file}: {e}")
+                continue
+            metrics.observe("pdfminer_extract", seconds)
 
+            # Sections GROBID tagged take precedence; the PDF text fills in the rest
+            acknowledgements = pdf_sections["acknowledgements"]
+            sections = {name: sections[name] or pdf_sections[name] for name in EXTRA_SECTIONS}
             paper_id = pdf_file.replace(".pdf", "")
-            save_metadata(paper_id, title, authors, abstract, acknowledgements)
+            save_metadata(paper_id, title, authors, abstract, acknowledgements, references, sections)
+            done[pdf_file] = current[pdf_file]
             print(f"✅ Guardado: {paper_id}\n")
 
+    metrics.add_items("preprocess", len(pending))
+    manifest.save(done)
+
+    # Later stages read the compiled corpus instead of the per-paper files
+    if pending or not corpus.is_current(done):
+        count = corpus.write_corpus(source=done)
+        print(f"Corpus de {count} artículos guardado en {corpus.CORPUS_DIR}")
+
 if __name__ == "__main__":
     preprocess_papers()
\ No newline at end of file
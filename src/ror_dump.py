@@ -0,0 +1,236 @@
+"""Offline organisation matching against a ROR data dump.
+
+ROR publishes its full registry as a zipped JSON dump
+(https://ror.readme.io/docs/data-dump). Setting ROR_DUMP_PATH to that file
+makes ror_enrich.py resolve organisations locally instead of calling the API:
+exact match on normalised names, aliases, acronyms and labels first, then a
+token-based fuzzy match. The index, including its token weights, is built
+once and pickled next to the lookup cache, so later runs only unpickle it.
+
+    python src/ror_dump.py path/to/v1.x-ror-data.zip "Univ. of Oxford" "NSF"
+"""
+
+import array
+import json
+import math
+import os
+import pickle
+import re
+import sys
+import time
+import unicodedata
+import zipfile
+
+ROR_DUMP_PATH = os.environ.get("ROR_DUMP_PATH", "")
+ROR_INDEX_PATH = os.environ.get("ROR_INDEX_PATH", "data/cache/ror_index.pkl")
+# Minimum fuzzy score (0-1) to accept a match
+ROR_FUZZY_THRESHOLD = float(os.environ.get("ROR_FUZZY_THRESHOLD", "0.8"))
+
+INDEX_VERSION = 2
+ABBREVIATIONS = {
+    "univ": "university", "inst": "institute", "natl": "national", "nat": "national",
+    "dept": "department", "lab": "laboratory", "labs": "laboratories", "sci": "science",
+    "tech": "technology", "ctr": "center", "centre": "center", "hosp": "hospital",
+    "assoc": "association", "fdn": "foundation", "intl": "international",
+}
+STOPWORDS = {"of", "the", "and", "for", "at", "in", "de", "la", "del", "der", "des", "du", "di", "y", "et", "und"}
+# Candidates come from the query's rarest token, plus the next rarest when its postings are this short
+MAX_EXTRA_POSTINGS = 2000
+
+
+def normalize(name):
+    """Casefold, strip accents and punctuation, collapse whitespace."""
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = re.sub(r"[^\w\s]", " ", name.casefold())
+    return " ".join(name.split())
+
+
+def tokens(normalized):
+    return [ABBREVIATIONS.get(t, t) for t in normalized.split() if t not in STOPWORDS]
+
+
+def _read_dump(path):
+    """Load the list of ROR records from a .zip or .json dump."""
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            member = next(n for n in archive.namelist() if n.endswith(".json"))
+            with archive.open(member) as f:
+                return json.load(f)
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _record_names(record):
+    """Yield (name, kind) for a v1 or v2 schema record; kind is display/alias/acronym/label."""
+    if "names" in record:
+        for entry in record["names"]:
+            types = entry.get("types", [])
+            kind = "display" if "ror_display" in types else "acronym" if "acronym" in types else "alias"
+            yield entry["value"], kind
+        return
+    yield record["name"], "display"
+    for alias in record.get("aliases", []):
+        yield alias, "alias"
+    for acronym in record.get("acronyms", []):
+        yield acronym, "acronym"
+    for label in record.get("labels", []):
+        yield label["label"], "label"
+
+
+def _display_name(record):
+    if "names" in record:
+        for entry in record["names"]:
+            if "ror_display" in entry.get("types", []):
+                return entry["value"]
+        return record["names"][0]["value"]
+    return record["name"]
+
+
+class RorMatcher:
+    """In-memory index of ROR names with exact and token-based fuzzy lookup."""
+
+    def __init__(self, ids, display_names, exact, names, name_records, postings, source,
+                 idf=None, name_weights=None):
+        self.ids = ids
+        self.display_names = display_names
+        self.exact = exact
+        self.names = names
+        self.name_records = name_records
+        self.postings = postings
+        self.source = source
+        self.total_names = max(1, len(names))
+        # Computed when the index is built and pickled with it, so loading skips a pass over every name
+        self.idf = idf if idf is not None else {token: self._idf(token) for token in postings}
+        # Total token weight of each name, the denominator side of the match score
+        self.name_weights = name_weights if name_weights is not None else array.array("d", (
+            sum(self.idf[t] for t in set(tokens(name))) for name in names
+        ))
+
+    @classmethod
+    def build(cls, dump_path):
+        records = _read_dump(dump_path)
+        ids, display_names, exact = [], [], {}
+        names, name_records, postings = [], array.array("i"), {}
+
+        for record_index, record in enumerate(records):
+            ids.append(record["id"])
+            display_names.append(_display_name(record))
+            for name, kind in _record_names(record):
+                key = normalize(name)
+                if not key:
+                    continue
+                # Display names win over aliases and acronyms that collide with them
+                if key not in exact or kind == "display":
+                    exact[key] = record_index
+                # Acronyms are too short and ambiguous for fuzzy matching
+                if kind == "acronym":
+                    continue
+                name_index = len(names)
+                names.append(key)
+                name_records.append(record_index)
+                for token in set(tokens(key)):
+                    postings.setdefault(token, array.array("i")).append(name_index)
+
+        return cls(ids, display_names, exact, names, name_records, postings, source_stamp(dump_path))
+
+    @classmethod
+    def load_or_build(cls, dump_path=ROR_DUMP_PATH, index_path=ROR_INDEX_PATH):
+        """Load the pickled index if it was built from this dump, otherwise build and save it."""
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") == INDEX_VERSION and data["source"] == source_stamp(dump_path):
+                return cls(**data["index"])
+
+        print(f"Building ROR index from {dump_path}...")
+        start = time.perf_counter()
+        matcher = cls.build(dump_path)
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        with open(index_path + ".tmp", "wb") as f:
+            pickle.dump({"version": INDEX_VERSION, "source": matcher.source, "index": {
+                "ids": matcher.ids,
+                "display_names": matcher.display_names,
+                "exact": matcher.exact,
+                "names": matcher.names,
+                "name_records": matcher.name_records,
+                "postings": matcher.postings,
+                "source": matcher.source,
+                "idf": matcher.idf,
+                "name_weights": matcher.name_weights,
+            }}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(index_path + ".tmp", index_path)
+        print(f"ROR index with {len(matcher.ids)} organizations built in {time.perf_counter() - start:.1f}s")
+        return matcher
+
+    def _idf(self, token):
+        return math.log(self.total_names / (1 + len(self.postings[token])))
+
+    def _exact(self, name):
+        record = self.exact.get(normalize(name))
+        if record is None:
+            return None
+        return self.ids[record], self.display_names[record]
+
+    def match(self, name, threshold=ROR_FUZZY_THRESHOLD):
+        """Return (ror_id, ror_name) for the best match, or (None, None)."""
+        exact = self._exact(name)
+        if exact:
+            return exact
+
+        # "National Science Foundation (NSF)": try the name and the acronym on their own
+        parenthesised = re.fullmatch(r"(.*?)\s*\((.*)\)\s*", name)
+        if parenthesised:
+            exact = self._exact(parenthesised.group(1)) or self._exact(parenthesised.group(2))
+            if exact:
+                return exact
+            name = parenthesised.group(1)
+
+        query = set(tokens(normalize(name)))
+        known = [t for t in query if t in self.postings]
+        if not known:
+            return None, None
+
+        # Tokens absent from ROR weigh as much as the rarest possible token
+        missing_weight = math.log(self.total_names)
+        weights = {t: self.idf.get(t, missing_weight) for t in query}
+        query_weight = sum(weights.values())
+
+        # Score names sharing the rarest query tokens by IDF-weighted token overlap
+        rarest = sorted(known, key=lambda t: len(self.postings[t]))
+        candidates = set(self.postings[rarest[0]])
+        if len(rarest) > 1 and len(self.postings[rarest[1]]) <= MAX_EXTRA_POSTINGS:
+            candidates.update(self.postings[rarest[1]])
+
+        best_score, best_record = 0.0, None
+        for name_index in candidates:
+            shared = sum(weights[t] for t in query.intersection(tokens(self.names[name_index])))
+            union = query_weight + self.name_weights[name_index] - shared
+            score = shared / union if union else 0.0
+            if score > best_score:
+                best_score, best_record = score, self.name_records[name_index]
+
+        if best_record is None or best_score < threshold:
+            return None, None
+        return self.ids[best_record], self.display_names[best_record]
+
+
+def source_stamp(dump_path):
+    stat = os.stat(dump_path)
+    return [os.path.abspath(dump_path), stat.st_size, stat.st_mtime_ns]
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        return
+    matcher = RorMatcher.load_or_build(sys.argv[1])
+    start = time.perf_counter()
+    for name in sys.argv[2:]:
+        print(f"{name!r}: {matcher.match(name)}")
+    elapsed = time.perf_counter() - start
+    print(f"{len(sys.argv) - 2} lookups in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,93 @@
-import requests
 import json
+import os
 import time
 
-def search_ror(name):
-    """Search for an organization in ROR database."""
-    url = "https://api.ror.org/organizations"
+import lookup_client
+import metrics
+import ror_dump
+from manifest import Manifest, data_digest, load_json
+
+ENRICHED_ROR_PATH = "data/output/enriched_ror.json"
+ROR_API_URL = os.environ.get("ROR_API_URL", "https://api.ror.org/organizations")
+ROR_CONCURRENCY = int(os.environ.get("ROR_CONCURRENCY", "4"))
+# Starting request rate; the server's rate-limit headers take over once seen
+ROR_RATE = float(os.environ.get("ROR_RATE", "5"))
+
+def _respect_rate_limit(response, limiter, stats=None):
+    """Pause every worker when the server says the rate-limit window is used up.
+
+    A 429 then raises in search_ror() and resolve_all() retries it; the retry
+    waits in limiter.acquire() until the pause is over. Pauses are capped by
+    lookup_client.cap_wait(), so a bogus header cannot stall the run for hours.
+    """
+    if limiter is None:
+        return
+    retry_after = response.headers.get("Retry-After")
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    reset = response.headers.get("X-RateLimit-Reset")
+    if response.status_code == 429 and retry_after and retry_after.isdigit():
+        # Counted once, by resolve_all() when it waits to retry the 429
+        limiter.pause(lookup_client.cap_wait(float(retry_after)))
+    elif remaining is not None and remaining.isdigit() and int(remaining) == 0 and reset:
+        try:
+            reset = float(reset)
+        except ValueError:
+            return
+        # Reset is either seconds until the window ends or an epoch timestamp
+        limiter.pause(lookup_client.cap_wait(reset - time.time() if reset > 1e9 else reset, stats))
+
+def search_ror(name, session=None, limiter=None, stats=None):
+    """Search for an organization in ROR database.
+
+    Returns (ror_id, ror_name), or (None, None) when ROR has no match. HTTP and
+    network errors raise, so callers can tell them apart from a real miss.
+    """
+    if session is None:
+        with lookup_client.pooled_session(1) as session:
+            return search_ror(name, session, limiter, stats)
     params = {"query": name}
-    headers = {
-        'User-Agent': 'Research-KG-Project/1.0 (research-project)'
-    }
-    
-    try:
-        # Add timeout and headers
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        
-        # Check if request was successful
-        if response.status_code == 200:
-            data = response.json()
-            results = data.get("items", [])
-            if results:
-                return results[0]["id"], results[0]["name"]
-        else:
-            print(f"ROR API returned status code: {response.status_code} for '{name}'")
-        
-    except requests.exceptions.RequestException as e:
-        print(f"Error searching ROR for '{name}': {e}")
-    except json.JSONDecodeError as e:
-        print(f"Invalid JSON response for '{name}': {e}")
-    
+    response = session.get(ROR_API_URL, params=params, timeout=10)
+    _respect_rate_limit(response, limiter, stats)
+    response.raise_for_status()
+
+    results = response.json().get("items", [])
+    if results:
+        return results[0]["id"], results[0]["name"]
     return None, None
 
+def resolve_organizations(names, cache=None):
+    """Look up every unique organization once; returns {name: (ror_id, ror_name)} or None on failure.
+
+    With ROR_DUMP_PATH set, names are matched against the local dump instead of the API.
+    """
+    if ror_dump.ROR_DUMP_PATH:
+        with metrics.timer("ror_dump_load"):
+            matcher = ror_dump.RorMatcher.load_or_build()
+        start = time.perf_counter()
+        resolved = {name: matcher.match(name) for name in names}
+        elapsed = time.perf_counter() - start
+        metrics.observe("ror_dump_match_all", elapsed)
+        print(f"ROR (offline dump): {len(resolved)} unique names matched in {elapsed:.2f}s "
+              f"({len(resolved) / max(elapsed, 1e-9):.0f} lookups/s)")
+        return resolved
+
+    cache = cache or lookup_client.LookupCache()
+    session = lookup_client.pooled_session(ROR_CONCURRENCY)
+    limiter = lookup_client.TokenBucket(ROR_RATE)
+    stats = lookup_client.LookupStats("ROR")
+    resolved = lookup_client.resolve_all(
+        names,
+        lambda name: list(search_ror(name, session, limiter, stats)),
+        namespace="ror",
+        cache=cache,
+        stats=stats,
+        limiter=limiter,
+        concurrency=ROR_CONCURRENCY,
+    )
+    session.close()
+    stats.report()
+    return {name: tuple(result) if result is not None else None for name, result in resolved.items()}
+
 def enrich_ror():
     """Enrich organizations with ROR identifiers."""
     try:
@@ -39,26 +97,38 @@ def enrich_ror():
         print("entities.json not found. Skipping ROR enrichment.")
         return
     
-    enriched = {}
+    # Only papers whose organizations changed since the last run are looked up
+    manifest = Manifest("ror_enrich", outputs=[ENRICHED_ROR_PATH])
+    current = {paper_id: data_digest(data["organizations"]) for paper_id, data in entities.items()}
+    # Switching between the API and a dump (or to a newer dump) re-resolves every paper
+    current["__source__"] = data_digest(ror_dump.ROR_DUMP_PATH and ror_dump.source_stamp(ror_dump.ROR_DUMP_PATH))
+    changed = set(manifest.changed(current))
+    if "__source__" in changed:
+        changed = set(entities)
+    changed.discard("__source__")
+    enriched = {} if manifest.is_fresh else load_json(ENRICHED_ROR_PATH, {})
+    for paper_id in manifest.removed(current):
+        enriched.pop(paper_id, None)
+    
+    # Each organization is resolved once, however many papers mention it
+    names = {org for paper_id in changed for org in entities[paper_id]["organizations"]}
+    print(f"Resolving {len(names)} distinct organization names from {len(changed)} papers")
+    resolved = resolve_organizations(sorted(names))
+    metrics.add_items("ror_enrich", len(names))
+    # Papers with failed lookups are not recorded, so the next run retries them
+    failed = {
+        paper_id for paper_id in changed
+        if any(resolved[org] is None for org in entities[paper_id]["organizations"])
+    }
     
     # Process each paper's organizations
-    for i, (paper_id, data) in enumerate(entities.items()):
-        print(f"Processing paper {i+1}/{len(entities)}: {paper_id}")
+    for paper_id, data in entities.items():
+        if paper_id not in changed:
+            continue
         enriched[paper_id] = []
         
         for org in data["organizations"]:
-            print(f"  Searching for organization: {org}")
-            
-            # Add delay to avoid rate limiting
-            time.sleep(0.5)
-            
-            ror_id, ror_name = search_ror(org)
-            
-            if ror_id:
-                print(f"    Found: {ror_name} ({ror_id})")
-            else:
-                print(f"    Not found in ROR")
-            
+            ror_id, ror_name = resolved[org] or (None, None)
             enriched[paper_id].append({
                 "name": org, 
                 "ror_id": ror_id,
@@ -66,10 +136,13 @@ def enrich_ror():
             })
     
     # Save results
-    with open("data/output/enriched_ror.json", "w") as f:
+    with open(ENRICHED_ROR_PATH, "w") as f:
         json.dump(enriched, f, indent=2)
+    manifest.save({k: v for k, v in current.items() if k not in failed}, outputs=[ENRICHED_ROR_PATH])
     
-    print("\nROR enrichment completed and saved.")
+    found = sum(1 for result in resolved.values() if result and result[0])
+    print(f"\nROR enrichment completed and saved ({found}/{len(resolved)} organization names found, "
+          f"{len(failed)} papers to retry).")
 
 if __name__ == "__main__":
     enrich_ror()
\ No newline at end of file
@@ -1,58 +1,149 @@
 #!/usr/bin/env python3
 """Execute the complete pipeline for knowledge graph construction."""
 
-import subprocess
+import argparse
+import importlib
+import shutil
 import sys
 import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-def run_step(name, command, required=True):
-    """Execute a pipeline step."""
+import metrics
+
+# Stages run at the same time once their dependencies are done (1 runs them one by one)
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "4"))
+
+# Pipeline stages: (name, module, function, is_required, dependencies)
+STAGES = [
+    ("Preprocessing", "preprocess", "preprocess_papers", True, []),
+    ("Embeddings", "embedding_cache", "embed_processed_papers", True, ["Preprocessing"]),
+    ("Topic Modeling", "topic_model", "run_topic_model", True, ["Embeddings"]),
+    ("Similarity Analysis", "similarity", "compute_similarity", True, ["Embeddings"]),
+    ("Named Entity Recognition", "ner_ack", "extract_entities", True, ["Preprocessing"]),
+    ("Wikidata Enrichment", "wikidata_enrich", "enrich_entities", False, ["Named Entity Recognition"]),
+    ("ROR Enrichment", "ror_enrich", "enrich_ror", False, ["Named Entity Recognition"]),
+    ("Knowledge Graph Construction", "build_kg", "create_kg", True,
+     ["Topic Modeling", "Similarity Analysis", "Wikidata Enrichment", "ROR Enrichment"]),
+]
+
+def run_step(name, module, function, required=True, profile=None):
+    """Execute a pipeline step in this process, recording its metrics; returns (succeeded, seconds)."""
     print(f"\n{'='*50}")
     print(f"Running: {name}")
     print(f"{'='*50}")
-    
-    result = subprocess.run(command, shell=True)
-    
-    if result.returncode != 0:
+
+    start = time.perf_counter()
+    try:
+        with metrics.registry.stage(name, module, profile):
+            function()
+    except (Exception, SystemExit):
+        traceback.print_exc()
         if required:
             print(f"ERROR: Failed at {name}")
-            sys.exit(1)
         else:
             print(f"WARNING: {name} failed but continuing...")
-            return False
-    
-    print(f"✓ {name} completed")
-    return True
+        return False, time.perf_counter() - start
+
+    print(f"✓ {name} completed in {time.perf_counter() - start:.1f}s")
+    return True, time.perf_counter() - start
+
+def run_stages(stages, workers=PIPELINE_WORKERS, profile=None):
+    """Run stages as a dependency graph in worker threads of this process.
+
+    Models and data loaded by one stage stay in memory for the next, and
+    stages whose dependencies are done run in parallel (topic modelling,
+    similarity and NER only wait for their inputs). A failed required stage
+    stops new stages from starting. Returns {name: (succeeded, seconds)}.
+    """
+    # Imported up front in the main thread, after --full has set the environment they read
+    functions = {name: getattr(importlib.import_module(module), function)
+                 for name, module, function, _, _ in stages}
+    modules = {name: module for name, module, _, _, _ in stages}
+    required = {name: is_required for name, _, _, is_required, _ in stages}
+    pending = {name: dependencies for name, _, _, _, dependencies in stages}
+    results, running, failed = {}, {}, False
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while running or (pending and not failed):
+            for name, dependencies in list(pending.items()):
+                if failed or not all(dependency in results for dependency in dependencies):
+                    continue
+                del pending[name]
+                running[executor.submit(run_step, name, modules[name], functions[name],
+                                        required[name], profile)] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                failed = failed or (required[name] and not results[name][0])
+    return results
+
+def print_summary(results, report, previous=None):
+    """Per-stage wall time, CPU, peak RSS and throughput, with the change since the previous run."""
+    previous_stages = (previous or {}).get("stages", {})
+    print("\n" + "="*50)
+    print(f"  {'stage':<30}{'wall':>9}{'cpu':>9}{'peak RSS':>10}{'items/s':>10}  vs last run")
+    for name, *_ in STAGES:
+        if name not in results:
+            print(f"- {name:<30}{'skipped':>9}")
+            continue
+        succeeded, seconds = results[name]
+        record = report["stages"].get(name, {})
+        rss = f"{record['peak_rss_bytes'] / 2**20:.0f} MB" if record.get("peak_rss_bytes") else "-"
+        rate = f"{record['items_per_second']:.1f}" if record.get("items") else "-"
+        change = ""
+        if previous_stages.get(name):
+            change = f"{(seconds - previous_stages[name]) / previous_stages[name]:+.0%}"
+        print(f"{'✓' if succeeded else '✗'} {name:<30}{seconds:8.1f}s{record.get('cpu_seconds', 0):8.1f}s"
+              f"{rss:>10}{rate:>10}  {change}")
+    print(f"Run report: {metrics.PIPELINE_REPORT_PATH}, {metrics.PIPELINE_METRICS_PATH}")
 
 def main():
     """Main pipeline execution."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--full", action="store_true",
+                        help="ignore previous runs and rebuild every output from scratch")
+    parser.add_argument("--workers", type=int, default=PIPELINE_WORKERS,
+                        help="stages run in parallel when their dependencies allow (1 runs them in order)")
+    parser.add_argument("--profile", choices=metrics.PROFILERS, default=metrics.PIPELINE_PROFILE or None,
+                        help=f"write a profile of each stage to {metrics.PIPELINE_PROFILE_DIR}")
+    args = parser.parse_args()
+    if args.profile:
+        # One stage at a time, so each profile only holds its own stage
+        args.workers = 1
+
     # Ensure directories exist
     os.makedirs("data/papers", exist_ok=True)
     os.makedirs("data/processed", exist_ok=True)
     os.makedirs("data/output", exist_ok=True)
-    
-    # Pipeline steps (name, command, is_required)
-    steps = [
-        ("Preprocessing", "python src/preprocess.py", True),
-        ("Topic Modeling", "python src/topic_model.py", True),
-        ("Similarity Analysis", "python src/similarity.py", True),
-        ("Named Entity Recognition", "python src/ner_ack.py", True),
-        ("Wikidata Enrichment", "python src/wikidata_enrich.py", False),
-        ("ROR Enrichment", "python src/ror_enrich.py", False),
-        ("Knowledge Graph Construction", "python src/build_kg.py", True),
-    ]
-    
-    # Execute each step
-    success_count = 0
-    for name, command, required in steps:
-        if run_step(name, command, required):
-            success_count += 1
-    
-    print("\n" + "="*50)
-    print(f"Pipeline completed! {success_count}/{len(steps)} steps successful")
+
+    # Stages only reprocess changed inputs unless a clean rebuild is requested
+    if args.full:
+        import corpus
+
+        print("Full rebuild requested: discarding manifests and processed papers")
+        os.environ["KG_FULL_REBUILD"] = "1"
+        shutil.rmtree("data/output/manifest", ignore_errors=True)
+        shutil.rmtree(corpus.CORPUS_DIR, ignore_errors=True)
+        for file in os.listdir("data/processed"):
+            if file.endswith(".json"):
+                os.remove(os.path.join("data/processed", file))
+
+    start = time.perf_counter()
+    results = run_stages(STAGES, args.workers, args.profile)
+    success_count = sum(1 for succeeded, _ in results.values() if succeeded)
+    previous = metrics.registry.write(time.perf_counter() - start)
+    print_summary(results, metrics.registry.report(), previous)
+    if any(required and not results.get(name, (False,))[0] for name, _, _, required, _ in STAGES):
+        print(f"ERROR: Pipeline failed after {time.perf_counter() - start:.1f}s")
+        sys.exit(1)
+    print(f"Pipeline completed in {time.perf_counter() - start:.1f}s! "
+          f"{success_count}/{len(STAGES)} steps successful")
     print("To visualize results, run:")
     print("streamlit run streamlit_app/app.py")
     print("="*50)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
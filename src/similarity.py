@@ -1,35 +1,173 @@
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
 import json
 import os
-import itertools
+
+import ann_index
+import corpus
+import embedding_cache
+import inference_backend
+import metrics
+from manifest import Manifest, data_digest, load_json
+
+SIMILAR_PAIRS_PATH = "data/output/similar_pairs.json"
+
+# Pairs must be strictly above this cosine similarity to be kept
+SIMILARITY_THRESHOLD = float(os.environ.get("SIMILARITY_THRESHOLD", "0.7"))
+# Neighbours kept per paper (0 keeps every pair above the threshold)
+SIMILARITY_TOP_K = int(os.environ.get("SIMILARITY_TOP_K", "0"))
+# Rows/columns per tile; a tile holds BLOCK_SIZE**2 float32 scores
+SIMILARITY_BLOCK_SIZE = int(os.environ.get("SIMILARITY_BLOCK_SIZE", "1024"))
+# "exact" scores every pair, "ann" queries a persisted nearest-neighbour index
+SIMILARITY_METHOD = os.environ.get("SIMILARITY_METHOD", "exact")
+# Neighbours queried per paper when SIMILARITY_METHOD=ann and no top-k is set
+ANN_DEFAULT_K = 10
 
 def load_abstracts():
-    abstracts, ids = [], []
-    for file in os.listdir("data/processed"):
-        with open(f"data/processed/{file}") as f:
-            data = json.load(f)
-            abstracts.append(data['abstract'])
-            ids.append(data['id'])
+    ids, abstracts = corpus.load_corpus().columns("id", "abstract")
     return ids, abstracts
 
+def normalize_embeddings(embeddings):
+    """L2-normalise embeddings so cosine similarity is a plain dot product."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+def _threshold_pairs(embeddings, threshold, block_size):
+    """Yield every (i, j, sim) with i < j and sim > threshold, tile by tile."""
+    n = len(embeddings)
+    for row_start in range(0, n, block_size):
+        rows = embeddings[row_start:row_start + block_size]
+        # Only the upper triangle is needed, so start at the diagonal tile
+        for col_start in range(row_start, n, block_size):
+            sims = rows @ embeddings[col_start:col_start + block_size].T
+            if col_start == row_start:
+                sims = np.triu(sims, k=1)
+            for i, j in zip(*np.nonzero(sims > threshold)):
+                yield row_start + int(i), col_start + int(j), float(sims[i, j])
+
+def _threshold_pairs_for_rows(embeddings, rows, threshold, block_size):
+    """Yield every pair above threshold that involves at least one of rows."""
+    n = len(embeddings)
+    rows = np.asarray(sorted(rows), dtype=np.int64)
+    in_rows = np.zeros(n, dtype=bool)
+    in_rows[rows] = True
+    for block_start in range(0, len(rows), block_size):
+        row_ids = rows[block_start:block_start + block_size]
+        for col_start in range(0, n, block_size):
+            sims = embeddings[row_ids] @ embeddings[col_start:col_start + block_size].T
+            col_ids = np.arange(col_start, col_start + sims.shape[1])
+            mask = sims > threshold
+            # Skip self pairs, and count pairs between two listed rows only once
+            mask &= row_ids[:, None] != col_ids[None, :]
+            mask &= ~(in_rows[col_ids][None, :] & (col_ids[None, :] < row_ids[:, None]))
+            for i, j in zip(*np.nonzero(mask)):
+                a, b = int(row_ids[i]), int(col_ids[j])
+                yield min(a, b), max(a, b), float(sims[i, j])
+
+def _top_k_pairs(embeddings, threshold, top_k, block_size):
+    """Yield the (i, j, sim) pairs where j is one of i's top_k neighbours or vice versa."""
+    n = len(embeddings)
+    pairs = {}
+    for row_start in range(0, n, block_size):
+        rows = embeddings[row_start:row_start + block_size]
+        row_ids = np.arange(row_start, row_start + len(rows))
+        best_sims = np.full((len(rows), top_k), -np.inf, dtype=np.float32)
+        best_ids = np.full((len(rows), top_k), -1, dtype=np.int64)
+
+        for col_start in range(0, n, block_size):
+            sims = rows @ embeddings[col_start:col_start + block_size].T
+            col_ids = np.arange(col_start, col_start + sims.shape[1])
+            sims[row_ids[:, None] == col_ids[None, :]] = -np.inf
+            sims[sims <= threshold] = -np.inf
+
+            # Merge this tile into the running top-k of each row
+            merged_sims = np.concatenate([best_sims, sims], axis=1)
+            merged_ids = np.concatenate([best_ids, np.broadcast_to(col_ids, sims.shape)], axis=1)
+            keep = np.argpartition(-merged_sims, top_k - 1, axis=1)[:, :top_k]
+            best_sims = np.take_along_axis(merged_sims, keep, axis=1)
+            best_ids = np.take_along_axis(merged_ids, keep, axis=1)
+
+        for i, js, sims in zip(row_ids, best_ids, best_sims):
+            for j, sim in zip(js, sims):
+                if np.isfinite(sim):
+                    pairs[(min(i, j), max(i, j))] = float(sim)
+
+    for (i, j), sim in sorted(pairs.items()):
+        yield int(i), int(j), sim
+
+def find_similar_pairs(embeddings, threshold=SIMILARITY_THRESHOLD, top_k=SIMILARITY_TOP_K,
+                       block_size=SIMILARITY_BLOCK_SIZE, rows=None):
+    """Yield (i, j, similarity) for similar embedding pairs using blocked matrix products.
+
+    With top_k > 0 each row only keeps its top_k neighbours above the threshold,
+    otherwise every pair above the threshold is returned. Passing rows restricts
+    the search to pairs involving those indices (threshold mode only).
+    """
+    embeddings = normalize_embeddings(embeddings)
+    if top_k > 0:
+        if rows is not None:
+            raise ValueError("rows is only supported when top_k is 0")
+        return _top_k_pairs(embeddings, threshold, top_k, block_size)
+    if rows is not None:
+        return _threshold_pairs_for_rows(embeddings, rows, threshold, block_size)
+    return _threshold_pairs(embeddings, threshold, block_size)
+
 def compute_similarity():
     ids, abstracts = load_abstracts()
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    embeddings = model.encode(abstracts, convert_to_tensor=True)
-    pairs = list(itertools.combinations(range(len(ids)), 2))
+
+    # Changing any setting invalidates every previously computed pair
+    manifest = Manifest("similarity", outputs=[SIMILAR_PAIRS_PATH])
+    current = {paper_id: data_digest(abstract) for paper_id, abstract in zip(ids, abstracts)}
+    current["__config__"] = data_digest([
+        embedding_cache.EMBEDDING_MODEL, inference_backend.INFERENCE_BACKEND,
+        SIMILARITY_THRESHOLD, SIMILARITY_TOP_K, SIMILARITY_METHOD
+    ])
+    if manifest.up_to_date(current):
+        print("Similarity is up to date; skipping.")
+        return
+
+    changed = set(manifest.changed(current)) | set(manifest.removed(current))
+    incremental = (
+        SIMILARITY_METHOD == "exact" and SIMILARITY_TOP_K == 0
+        and not manifest.is_fresh and "__config__" not in changed
+    )
+    embeddings = embedding_cache.get_embeddings(abstracts)
+
     similar_pairs = []
-    for i, j in pairs:
-        sim = util.pytorch_cos_sim(embeddings[i], embeddings[j])
-        if sim > 0.7:
-            similar_pairs.append({
-                "paper1": ids[i],
-                "paper2": ids[j],
-                "similarity": float(sim)
-            })
+    if incremental:
+        # Keep pairs between unchanged papers and only score the changed ones
+        similar_pairs = [
+            pair for pair in load_json(SIMILAR_PAIRS_PATH, [])
+            if pair["paper1"] not in changed and pair["paper2"] not in changed
+        ]
+        rows = [i for i, paper_id in enumerate(ids) if paper_id in changed]
+        print(f"Scoring {len(rows)} new or changed papers against {len(ids)}")
+        with metrics.timer("similarity_search"):
+            pairs = find_similar_pairs(embeddings, rows=rows)
+    elif SIMILARITY_METHOD == "ann":
+        with metrics.timer("ann_index_build"):
+            index = ann_index.AnnIndex.build(ids, embeddings)
+            index.save()
+        print(f"ANN index ({index.backend}) saved to {ann_index.ANN_INDEX_DIR}")
+        with metrics.timer("similarity_search"):
+            pairs = index.similar_pairs(SIMILARITY_THRESHOLD, SIMILARITY_TOP_K or ANN_DEFAULT_K)
+    else:
+        with metrics.timer("similarity_search"):
+            pairs = find_similar_pairs(embeddings)
+
+    for i, j, sim in pairs:
+        similar_pairs.append({
+            "paper1": ids[i],
+            "paper2": ids[j],
+            "similarity": sim
+        })
     os.makedirs("data/output", exist_ok=True)
-    with open("data/output/similar_pairs.json", "w") as f:
+    with open(SIMILAR_PAIRS_PATH, "w") as f:
         json.dump(similar_pairs, f, indent=2)
-    print("Similarity computation completed and saved.")
+    manifest.save(current, outputs=[SIMILAR_PAIRS_PATH])
+    metrics.add_items("similarity", len(rows) if incremental else len(ids))
+    print(f"Similarity computation completed and saved ({len(similar_pairs)} pairs).")
 
 if __name__ == "__main__":
     compute_similarity()
\ No newline at end of file
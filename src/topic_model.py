@@ -1,26 +1,146 @@
 from bertopic import BERTopic
 import json
 import os
+from itertools import islice
+
+import numpy as np
+
+import corpus
+import embedding_cache
+import inference_backend
+import metrics
+from manifest import Manifest, data_digest, load_json
+
+TOPIC_ASSIGNMENTS_PATH = "data/output/topic_assignments.json"
+TOPIC_MODEL_PATH = "data/output/bertopic_model"
+
+# "batch" fits UMAP + HDBSCAN on the whole corpus at once; "online" fits
+# IncrementalPCA + MiniBatchKMeans batch by batch with partial_fit, so memory
+# is bounded by TOPIC_BATCH_SIZE instead of the corpus size
+TOPIC_MODE = os.environ.get("TOPIC_MODE", "batch")
+# Abstracts per partial_fit/transform call in online mode
+TOPIC_BATCH_SIZE = int(os.environ.get("TOPIC_BATCH_SIZE", "1000"))
+# Number of topics in online mode (MiniBatchKMeans clusters)
+TOPIC_CLUSTERS = int(os.environ.get("TOPIC_CLUSTERS", "50"))
+# Papers added since the last fit, up to this fraction of the corpus, are assigned
+# to the saved model's topics with transform(); more, or any changed or removed
+# paper, refits
+TOPIC_REFIT_FRACTION = float(os.environ.get("TOPIC_REFIT_FRACTION", "0.1"))
 
 def load_abstracts():
-    abstracts, ids = [], []
-    for file in os.listdir("data/processed"):
-        with open(f"data/processed/{file}") as f:
-            data = json.load(f)
-            abstracts.append(data['abstract'])
-            ids.append(data['id'])
+    ids, abstracts = corpus.load_corpus().columns("id", "abstract")
     return ids, abstracts
 
+def load_embedding_model():
+    # Reuse the model already loaded in this process; ONNX sessions cannot be pickled by save()
+    if inference_backend.INFERENCE_BACKEND == "torch":
+        return embedding_cache.load_model()
+    return embedding_cache.EMBEDDING_MODEL
+
+def iter_batches(papers, batch_size):
+    """Yield (ids, abstracts) batches of batch_size papers; the last one absorbs the remainder.
+
+    A corpus smaller than batch_size is a single, smaller batch.
+    """
+    rows = papers.iter_rows(("id", "abstract"))
+    n_batches = max(1, len(papers) // batch_size)
+    for batch in range(n_batches):
+        size = len(papers) - batch_size * (n_batches - 1) if batch == n_batches - 1 else batch_size
+        chunk = list(islice(rows, size))
+        yield [row["id"] for row in chunk], [row["abstract"] for row in chunk]
+
+def batch_embeddings(abstracts):
+    # float64 throughout: MiniBatchKMeans fixes its dtype on the first partial_fit and the
+    # cache may hold float32 or float16, so mixing them fails on a later batch
+    return np.asarray(embedding_cache.get_embeddings(abstracts), dtype=np.float64)
+
+def assign_topics(topic_model, ids, abstracts):
+    """Topics of the given abstracts under an already fitted model."""
+    topics, _ = topic_model.transform(abstracts, embeddings=batch_embeddings(abstracts))
+    return {paper_id: int(topic) for paper_id, topic in zip(ids, topics)}
+
+def fit_batch(ids, abstracts):
+    """Fit BERTopic on the whole corpus in memory; returns (model, assignments)."""
+    embeddings = embedding_cache.get_embeddings(abstracts)
+    topic_model = BERTopic(embedding_model=load_embedding_model(), min_topic_size=2)
+    with metrics.timer("bertopic_fit"):
+        topics, _ = topic_model.fit_transform(abstracts, embeddings=embeddings)
+    return topic_model, {paper_id: int(topic) for paper_id, topic in zip(ids, topics)}
+
+def fit_online(papers):
+    """Fit BERTopic with partial_fit one batch at a time; returns (model, assignments).
+
+    Only one batch of abstracts and embeddings is in memory at once. Topic
+    assignments come from a second pass with the final model, so papers seen
+    in early batches get the same topics as papers seen last.
+    """
+    from bertopic.vectorizers import OnlineCountVectorizer
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.decomposition import IncrementalPCA
+
+    # Every partial_fit needs at least n_components samples, the first one n_clusters
+    n_components = min(5, len(papers))
+    n_clusters = min(TOPIC_CLUSTERS, len(papers))
+    batch_size = max(TOPIC_BATCH_SIZE, n_clusters, n_components)
+    topic_model = BERTopic(
+        embedding_model=load_embedding_model(),
+        umap_model=IncrementalPCA(n_components=n_components),
+        hdbscan_model=MiniBatchKMeans(n_clusters=n_clusters, random_state=0),
+        vectorizer_model=OnlineCountVectorizer(stop_words="english", decay=0.01),
+    )
+    with metrics.timer("bertopic_fit"):
+        for ids, abstracts in iter_batches(papers, batch_size):
+            topic_model.partial_fit(abstracts, embeddings=batch_embeddings(abstracts))
+    assignments = {}
+    with metrics.timer("bertopic_transform"):
+        for ids, abstracts in iter_batches(papers, batch_size):
+            assignments.update(assign_topics(topic_model, ids, abstracts))
+    return topic_model, assignments
+
 def run_topic_model():
-    ids, abstracts = load_abstracts()
-    topic_model = BERTopic(min_topic_size=2)
-    topics, _ = topic_model.fit_transform(abstracts)
-    os.makedirs("data/output", exist_ok=True)
-    topic_model.save("data/output/bertopic_model")
-    topic_assignments = dict(zip(ids, topics))
-    with open("data/output/topic_assignments.json", "w") as f:
+    papers = corpus.load_corpus()
+    if not len(papers):
+        print("No processed papers; skipping topic modeling.")
+        return
+    current = {row["id"]: data_digest(row["abstract"]) for row in papers.iter_rows(("id", "abstract"))}
+
+    # Topics depend on the whole corpus, so changes trigger a refit unless only a few papers were added
+    manifest = Manifest("topic_model", outputs=[TOPIC_ASSIGNMENTS_PATH])
+    if manifest.up_to_date(current):
+        print("Topic modeling is up to date; skipping.")
+        return
+
+    changed = manifest.changed(current)
+    previous = load_json(TOPIC_ASSIGNMENTS_PATH, {})
+    added_only = (not manifest.is_fresh and not manifest.removed(current)
+                  and all(paper_id not in manifest.previous for paper_id in changed))
+    # Corpus size at the last fit: every paper since then was added by a transform-only run
+    fitted = manifest.state.get("fitted_papers", 0)
+    if (added_only and os.path.exists(TOPIC_MODEL_PATH)
+            and len(current) - fitted <= TOPIC_REFIT_FRACTION * len(current)):
+        print(f"Assigning {len(changed)} new papers to the topics of {TOPIC_MODEL_PATH}")
+        topic_model = BERTopic.load(TOPIC_MODEL_PATH, embedding_model=load_embedding_model())
+        new = set(changed)
+        rows = [row for row in papers.iter_rows(("id", "abstract")) if row["id"] in new]
+        with metrics.timer("bertopic_transform"):
+            previous.update(assign_topics(topic_model, [row["id"] for row in rows],
+                                          [row["abstract"] for row in rows]))
+        topic_assignments, processed = previous, len(rows)
+    else:
+        if TOPIC_MODE == "online":
+            topic_model, topic_assignments = fit_online(papers)
+        else:
+            topic_model, topic_assignments = fit_batch(*load_abstracts())
+        os.makedirs("data/output", exist_ok=True)
+        with metrics.timer("bertopic_save"):
+            topic_model.save(TOPIC_MODEL_PATH)
+        processed = fitted = len(current)
+
+    with open(TOPIC_ASSIGNMENTS_PATH, "w") as f:
         json.dump(topic_assignments, f, indent=2)
+    manifest.save(current, outputs=[TOPIC_ASSIGNMENTS_PATH], state={"fitted_papers": fitted})
+    metrics.add_items("topic_model", processed)
     print("Topic modeling completed and saved.")
 
 if __name__ == "__main__":
-    run_topic_model()
\ No newline at end of file
+    run_topic_model()
@@ -0,0 +1,59 @@
+"""Output directories replaced atomically, for stores read while the pipeline rewrites them.
+
+Each build writes a new version next to the published one and then swaps a
+small pointer file, so a reader always opens either the old or the new
+version, never a missing or half-written directory:
+
+    <directory>/CURRENT   name of the published version
+    <directory>/v<ns>/    one directory per version
+
+The previous version is kept for readers that read CURRENT just before it
+moved; older ones are removed on publish.
+"""
+
+import os
+import shutil
+import time
+
+POINTER = "CURRENT"
+
+
+def current(directory):
+    """Path of the published version; directory itself if it was written before versioning."""
+    try:
+        with open(os.path.join(directory, POINTER)) as f:
+            return os.path.join(directory, f.read().strip())
+    except FileNotFoundError:
+        return directory
+
+
+def new_version(directory):
+    """Empty directory to write the next version into; publish() it once complete."""
+    path = os.path.join(directory, f"v{time.time_ns()}.tmp")
+    os.makedirs(path)
+    return path
+
+
+def publish(path):
+    """Make a finished new_version() the current version and remove the ones before the previous."""
+    directory = os.path.dirname(path)
+    name = os.path.basename(path)[:-len(".tmp")]
+    previous = os.path.basename(current(directory))
+    os.replace(path, os.path.join(directory, name))
+    with open(os.path.join(directory, POINTER + ".tmp"), "w") as f:
+        f.write(name)
+    os.replace(os.path.join(directory, POINTER + ".tmp"), os.path.join(directory, POINTER))
+
+    for entry in os.listdir(directory):
+        entry_path = os.path.join(directory, entry)
+        if entry in (name, previous, POINTER):
+            continue
+        if os.path.isdir(entry_path):
+            # Unfinished versions of crashed builds too; files still mapped elsewhere may refuse
+            shutil.rmtree(entry_path, ignore_errors=True)
+        else:
+            # Files of the layout from before versioning
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
@@ -1,35 +1,91 @@
-import requests
 import json
+import os
 
-def search_wikidata(name):
-    url = "https://www.wikidata.org/w/api.php"
+import lookup_client
+import metrics
+from manifest import Manifest, data_digest, load_json
+
+ENRICHED_WIKIDATA_PATH = "data/output/enriched_wikidata.json"
+WIKIDATA_API_URL = os.environ.get("WIKIDATA_API_URL", "https://www.wikidata.org/w/api.php")
+WIKIDATA_CONCURRENCY = int(os.environ.get("WIKIDATA_CONCURRENCY", "4"))
+# Requests per second across all workers
+WIKIDATA_RATE = float(os.environ.get("WIKIDATA_RATE", "10"))
+
+def search_wikidata(name, session=None):
+    if session is None:
+        with lookup_client.pooled_session(1) as session:
+            return search_wikidata(name, session)
     params = {
         "action": "wbsearchentities",
         "search": name,
         "language": "en",
         "format": "json"
     }
-    response = requests.get(url, params=params)
+    response = session.get(WIKIDATA_API_URL, params=params, timeout=10)
+    response.raise_for_status()
     results = response.json().get("search", [])
     if results:
         return results[0]["id"], results[0]["label"]
     return None, None
 
+def resolve_names(names, cache=None):
+    """Look up every unique name once; returns {name: (qid, label)}, or None where the lookup failed."""
+    cache = cache or lookup_client.LookupCache()
+    session = lookup_client.pooled_session(WIKIDATA_CONCURRENCY)
+    stats = lookup_client.LookupStats("Wikidata")
+    resolved = lookup_client.resolve_all(
+        names,
+        lambda name: list(search_wikidata(name, session)),
+        namespace="wikidata",
+        cache=cache,
+        stats=stats,
+        limiter=lookup_client.TokenBucket(WIKIDATA_RATE),
+        concurrency=WIKIDATA_CONCURRENCY,
+    )
+    session.close()
+    stats.report()
+    return {name: tuple(result) if result is not None else None for name, result in resolved.items()}
+
 def enrich_entities():
     with open("data/output/entities.json") as f:
         entities = json.load(f)
-    enriched = {}
+
+    manifest = Manifest("wikidata_enrich", outputs=[ENRICHED_WIKIDATA_PATH])
+    current = {paper_id: data_digest(data) for paper_id, data in entities.items()}
+    changed = set(manifest.changed(current))
+    enriched = {} if manifest.is_fresh else load_json(ENRICHED_WIKIDATA_PATH, {})
+    for paper_id in manifest.removed(current):
+        enriched.pop(paper_id, None)
+
+    # The same funder or colleague appears in many papers, so resolve each name only once
+    names = {
+        name
+        for paper_id in changed
+        for name in entities[paper_id]["persons"] + entities[paper_id]["organizations"]
+    }
+    resolved = resolve_names(sorted(names))
+    metrics.add_items("wikidata_enrich", len(names))
+    # Papers with failed lookups are not recorded, so the next run retries them
+    failed = {
+        paper_id for paper_id in changed
+        if any(resolved[name] is None
+               for name in entities[paper_id]["persons"] + entities[paper_id]["organizations"])
+    }
+
     for paper_id, data in entities.items():
+        if paper_id not in changed:
+            continue
         enriched[paper_id] = {"persons": [], "organizations": []}
         for person in data["persons"]:
-            qid, label = search_wikidata(person)
+            qid, label = resolved[person] or (None, None)
             enriched[paper_id]["persons"].append({"name": person, "wikidata_id": qid})
         for org in data["organizations"]:
-            qid, label = search_wikidata(org)
+            qid, label = resolved[org] or (None, None)
             enriched[paper_id]["organizations"].append({"name": org, "wikidata_id": qid})
-    with open("data/output/enriched_wikidata.json", "w") as f:
+    with open(ENRICHED_WIKIDATA_PATH, "w") as f:
         json.dump(enriched, f, indent=2)
-    print("Wikidata enrichment completed and saved.")
+    manifest.save({k: v for k, v in current.items() if k not in failed}, outputs=[ENRICHED_WIKIDATA_PATH])
+    print(f"Wikidata enrichment completed and saved ({len(changed)} papers updated, {len(failed)} to retry).")
 
 if __name__ == "__main__":
     enrich_entities()
\ No newline at end of file
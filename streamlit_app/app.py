@@ -1,24 +1,204 @@
 import streamlit as st
 import pandas as pd
-import kg_utils
 
 # Nuevas librerías para la visualización del grafo
 import networkx as nx
 from pyvis.network import Network
 import streamlit.components.v1 as components
-import tempfile
 import os
+import sys
+from urllib.parse import quote, unquote
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import ann_index
+import kg_utils
 
 st.set_page_config(layout="wide", page_title="Research Knowledge Graph Explorer")
 st.title("Research Knowledge Graph Explorer")
 
-# Load Knowledge Graph
+# Load Knowledge Graph: shared by all sessions, reloaded when build_kg.py writes a new one
+g = kg_utils.shared_kg.graph()
+views = kg_utils.shared_kg.views()
+
 @st.cache_resource
-def load_knowledge_graph():
-    """Load the knowledge graph with caching."""
-    return kg_utils.load_kg()
+def load_ann_index():
+    """Load the nearest-neighbour index persisted by the similarity step, if any."""
+    if not os.path.exists(os.path.join(ann_index.ANN_INDEX_DIR, "meta.json")):
+        return None
+    return ann_index.AnnIndex.load()
+
+PAPER_URI_PREFIX = "http://example.org/paper_"
+
+# Nodes drawn on the visualization page; beyond it papers and acknowledgement nodes are grouped
+VIZ_NODE_BUDGET = int(os.environ.get("VIZ_NODE_BUDGET", "1500"))
+# Group nodes a topic can get: one each for hidden papers, people and organizations
+GROUPS_PER_TOPIC = 3
+
+def _sample_papers(df_topics, budget, links):
+    """Keep at most about budget papers, the same share of each topic, best connected first.
+
+    Returns (kept rows, {topic: number of papers left out}).
+    """
+    if len(df_topics) <= budget:
+        return df_topics, {}
+    share = budget / len(df_topics)
+    kept, hidden = [], {}
+    for topic, group in df_topics.groupby('topic', sort=False, dropna=False):
+        count = max(1, int(len(group) * share))
+        order = group['paper'].map(links).sort_values(ascending=False, kind='stable').index
+        kept.append(group.loc[order[:count]])
+        if len(group) > count:
+            hidden[topic] = len(group) - count
+    return pd.concat(kept), hidden
+
+def _collapse_acknowledgements(G, budget):
+    """Replace the least connected people/organizations with one group node per topic and kind.
+
+    budget must leave room for the group nodes. Returns how many nodes were collapsed.
+    """
+    ack_nodes = [n for n, data in G.nodes(data=True) if data.get('kind') in ('person', 'org')]
+    keep = max(0, budget - (G.number_of_nodes() - len(ack_nodes)))
+    if len(ack_nodes) <= keep:
+        return 0
+
+    # Entities acknowledged by many papers carry the most structure, so they stay
+    ack_nodes.sort(key=lambda n: G.degree[n], reverse=True)
+    collapsed = ack_nodes[keep:]
+    groups = {}
+    for node in collapsed:
+        kind = G.nodes[node]['kind']
+        for paper in G.neighbors(node):
+            group = (G.nodes[paper]['topic'], kind)
+            groups.setdefault(group, set()).add(node)
+    G.remove_nodes_from(collapsed)
+    for (topic, kind), members in groups.items():
+        label = f"+{len(members)} {'personas' if kind == 'person' else 'organizaciones'}"
+        group_node = f"{topic}:{kind}"
+        G.add_node(group_node, label=label, color='#66ff66' if kind == 'person' else '#cc99ff',
+                   shape='diamond', title=label + " agrupadas", value=1)
+        G.add_edge(topic, group_node)
+    return len(collapsed)
+
+def _topic_summary(df_topics, budget):
+    """One node per topic, sized by its number of papers, for the largest budget topics."""
+    G = nx.Graph()
+    for topic, count in df_topics['topic'].value_counts().head(budget).items():
+        G.add_node(topic, label=f"{topic} ({count})", color='#ffcc00', shape='box',
+                   title=f'Tema: {topic}\n{count} artículos', value=count)
+    return G
+
+@st.cache_data(show_spinner="Calculando el diseño del grafo...")
+def render_topic_network(selected_topic, graph_version):
+    """Build the topic graph, lay it out once on the server and return (html, nodes, grouped).
+
+    Cached per topic and graph version; the browser gets fixed coordinates and runs no physics.
+    The graph stays within VIZ_NODE_BUDGET nodes: papers beyond half the room left by the
+    topics are grouped per topic, then the least connected people and organizations. With
+    too many topics for that, only one node per topic is drawn. grouped counts the papers
+    and acknowledgement nodes hidden, and whether the topic summary was drawn instead.
+    """
+    df_topics = views.papers_by_topic()
+    if selected_topic != "Todos":
+        df_topics = df_topics[df_topics['topic'] == selected_topic]
+
+    n_topics = df_topics['topic'].nunique()
+    room = VIZ_NODE_BUDGET - n_topics * (1 + GROUPS_PER_TOPIC)
+    # Drawing papers needs room for at least one per topic
+    grouped = {"papers": 0, "acknowledgements": 0, "summary": room // 2 < n_topics}
+    if grouped["summary"]:
+        G = _topic_summary(df_topics, VIZ_NODE_BUDGET)
+        grouped["papers"] = len(df_topics)
+        return _layout_html(G), G.number_of_nodes(), grouped
+
+    G = nx.Graph()
+    people_by_paper = views.people(df_topics['paper'])
+    orgs_by_paper = views.organizations(df_topics['paper'])
+    links = {paper: len(people_by_paper[paper]) + len(orgs_by_paper[paper]) for paper in df_topics['paper']}
+    # Papers get half the room; people and organizations the rest
+    df_topics, hidden = _sample_papers(df_topics, max(1, room // 2), links)
+    grouped["papers"] = sum(hidden.values())
 
-g = load_knowledge_graph()
+    for i, (_, row) in enumerate(df_topics.iterrows()):
+        topic = row['topic']
+        title = row['title']
+        paper_uri = row['paper']
+        short_title = f"Paper {i+1}"
+
+        G.add_node(topic, label=topic, color='#ffcc00', shape='box', title=f'Tema: {topic}', value=3)
+
+        people = people_by_paper[paper_uri]
+        orgs = orgs_by_paper[paper_uri]
+
+        people_names = ", ".join([p['name'] for p in people]) if people else "Ninguna"
+        org_names = ", ".join([o['name'] for o in orgs]) if orgs else "Ninguna"
+
+        tooltip = (
+            f"Título: {title}\n"
+            f"Personas: {people_names}\n"
+            f"Organizaciones: {org_names}"
+        )
+
+        G.add_node(short_title, label=short_title, color='#00ccff', shape='ellipse', title=tooltip, value=2,
+                   topic=topic)
+        G.add_edge(topic, short_title)
+
+        for person in people:
+            G.add_node(person['name'], label=person['name'], color='#66ff66', shape='dot', title='Persona reconocida', value=1,
+                       kind='person')
+            G.add_edge(short_title, person['name'])
+
+        for org in orgs:
+            G.add_node(org['name'], label=org['name'], color='#cc99ff', shape='dot', title='Organización reconocida', value=1,
+                       kind='org')
+            G.add_edge(short_title, org['name'])
+
+    for topic, count in hidden.items():
+        label = f"+{count} artículos"
+        G.add_node(f"{topic}:papers", label=label, color='#00ccff', shape='diamond',
+                   title=label + " no mostrados", value=1)
+        G.add_edge(topic, f"{topic}:papers")
+
+    # Room for the group nodes the collapse adds (two per topic at most)
+    grouped["acknowledgements"] = _collapse_acknowledgements(G, VIZ_NODE_BUDGET - 2 * n_topics)
+
+    for node in G.nodes():
+        G.nodes[node]['value'] = max(G.degree[node], 1) * 2
+    return _layout_html(G), G.number_of_nodes(), grouped
+
+def _layout_html(G):
+    """Lay G out with a spring layout on the server and return the pyvis page."""
+    # Spring layout on the server; vis.js only draws the fixed positions
+    scale = 60 * G.number_of_nodes() ** 0.5
+    positions = nx.spring_layout(G, seed=42, iterations=50)
+    for node, (x, y) in positions.items():
+        G.nodes[node]['x'] = float(x * scale)
+        G.nodes[node]['y'] = float(y * scale)
+        G.nodes[node].pop('kind', None)
+        G.nodes[node].pop('topic', None)
+
+    net = Network(height="650px", width="100%", bgcolor="#ffffff", font_color="black", notebook=False)
+    net.from_nx(G)
+
+    net.set_options("""
+    const options = {
+      "layout": {
+        "improvedLayout": false
+      },
+      "nodes": {
+        "borderWidth": 1,
+        "font": {"size": 13}
+      },
+      "edges": {
+        "color": {"inherit": true},
+        "smooth": false
+      },
+      "physics": {
+        "enabled": false
+      }
+    }
+    """)
+
+    return net.generate_html()
 
 # Sidebar navigation
 st.sidebar.header("Navigation")
@@ -33,10 +213,13 @@ section = st.sidebar.selectbox(
     ]
 )
 
+with st.sidebar.expander("Query cache"):
+    st.dataframe(kg_utils.query_cache.report(), hide_index=True)
+
 # Section 1: Papers by Topic
 if section == "Papers by Topic":
     st.header("Papers by Topic")
-    df_topics = kg_utils.get_papers_by_topic(g)
+    df_topics = views.papers_by_topic()
     
     if not df_topics.empty:
         topics = df_topics['topic'].unique()
@@ -45,9 +228,10 @@ if section == "Papers by Topic":
         filtered = df_topics[df_topics['topic'] == selected_topic]
         st.write(f"### Papers in {selected_topic}")
         
+        details = views.details(filtered['paper'])
         for _, row in filtered.iterrows():
             st.write(f"**{row['title']}**")
-            paper_details = kg_utils.get_paper_details(g, row['paper'])
+            paper_details = details.get(row['paper'])
             if paper_details:
                 with st.expander("View Abstract"):
                     st.write(paper_details['abstract'])
@@ -58,14 +242,14 @@ if section == "Papers by Topic":
 elif section == "Paper Explorer":
     st.header("Paper Explorer")
     
-    all_papers = kg_utils.get_all_papers(g)
+    all_papers = views.all_papers()
     
     if all_papers:
         paper_dict = {p['title']: p['uri'] for p in all_papers}
         selected_title = st.selectbox("Select Paper", list(paper_dict.keys()))
         selected_uri = paper_dict[selected_title]
         
-        paper_details = kg_utils.get_paper_details(g, selected_uri)
+        paper_details = views.details([selected_uri]).get(selected_uri)
         if paper_details:
             st.write("### Paper Details")
             st.write(f"**Title:** {paper_details['title']}")
@@ -78,14 +262,14 @@ elif section == "Paper Explorer":
 elif section == "Similar Papers":
     st.header("Find Similar Papers")
     
-    all_papers = kg_utils.get_all_papers(g)
+    all_papers = views.all_papers()
     
     if all_papers:
         paper_dict = {p['title']: p['uri'] for p in all_papers}
         selected_title = st.selectbox("Select Paper", list(paper_dict.keys()))
         selected_uri = paper_dict[selected_title]
         
-        similar_papers = kg_utils.get_similar_papers(g, selected_uri)
+        similar_papers = views.similar([selected_uri])[selected_uri]
         
         if similar_papers:
             st.write(f"### Papers similar to: {selected_title}")
@@ -93,6 +277,23 @@ elif section == "Similar Papers":
                 st.write(f"- **{paper['title']}**")
         else:
             st.info("No similar papers found for this selection.")
+
+        index = load_ann_index()
+        if index is not None:
+            st.write("### Nearest neighbours (ANN index)")
+            k = st.slider("Number of neighbours", 1, 50, 10)
+            min_similarity = st.slider("Minimum similarity", 0.0, 1.0, 0.7)
+            titles = {p['uri']: p['title'] for p in all_papers}
+            paper_id = unquote(selected_uri[len(PAPER_URI_PREFIX):])
+            if paper_id in index:
+                neighbours = index.neighbours(paper_id, k=k, threshold=min_similarity)
+                for neighbour_id, similarity in neighbours:
+                    title = titles.get(PAPER_URI_PREFIX + quote(neighbour_id), neighbour_id)
+                    st.write(f"- **{title}** ({similarity:.3f})")
+                if not neighbours:
+                    st.info("No neighbours above the selected similarity.")
+            else:
+                st.info("This paper is not in the ANN index; rerun the similarity step.")
     else:
         st.warning("No papers found in the knowledge graph.")
 
@@ -127,86 +328,19 @@ elif section == "Knowledge Graph Visualization":
     st.header("Knowledge Graph Visualization")
     st.write("Visualización interactiva de temas conectados con artículos del grafo.")
 
-    df_topics = kg_utils.get_papers_by_topic(g)
+    df_topics = views.papers_by_topic()
 
     if not df_topics.empty:
         unique_topics = df_topics['topic'].unique()
         selected_topic = st.selectbox("Selecciona un tema para enfocar", ["Todos"] + list(unique_topics))
 
-        if selected_topic != "Todos":
-            df_topics = df_topics[df_topics['topic'] == selected_topic]
-
-        G = nx.Graph()
-
-        for i, (_, row) in enumerate(df_topics.iterrows()):
-            topic = row['topic']
-            title = row['title']
-            paper_uri = row['paper']
-            short_title = f"Paper {i+1}"
-
-            G.add_node(topic, label=topic, color='#ffcc00', shape='box', title=f'Tema: {topic}', value=3)
-
-            people = kg_utils.get_people_by_paper(g, paper_uri)
-            orgs = kg_utils.get_organizations_by_paper(g, paper_uri)
-
-            people_names = ", ".join([p['name'] for p in people]) if people else "Ninguna"
-            org_names = ", ".join([o['name'] for o in orgs]) if orgs else "Ninguna"
-
-            tooltip = (
-                f"Título: {title}\n"
-                f"Personas: {people_names}\n"
-                f"Organizaciones: {org_names}"
-            )
-
-            G.add_node(short_title, label=short_title, color='#00ccff', shape='ellipse', title=tooltip, value=2)
-            G.add_edge(topic, short_title)
-
-            for person in people:
-                G.add_node(person['name'], label=person['name'], color='#66ff66', shape='dot', title='Persona reconocida', value=1)
-                G.add_edge(short_title, person['name'])
-
-            for org in orgs:
-                G.add_node(org['name'], label=org['name'], color='#cc99ff', shape='dot', title='Organización reconocida', value=1)
-                G.add_edge(short_title, org['name'])
-
-        for node in G.nodes():
-            G.nodes[node]['value'] = max(G.degree[node], 1) * 2
-
-        net = Network(height="650px", width="100%", bgcolor="#ffffff", font_color="black", notebook=False)
-        net.from_nx(G)
-
-        net.set_options("""
-        const options = {
-          "layout": {
-            "improvedLayout": true
-          },
-          "nodes": {
-            "borderWidth": 1,
-            "font": {"size": 13}
-          },
-          "edges": {
-            "color": {"inherit": true},
-            "smooth": true
-          },
-          "physics": {
-            "forceAtlas2Based": {
-              "gravitationalConstant": -50,
-              "centralGravity": 0.005,
-              "springLength": 150,
-              "springConstant": 0.18
-            },
-            "minVelocity": 0.75,
-            "solver": "forceAtlas2Based",
-            "timestep": 0.35
-          }
-        }
-        """)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.html') as tmp_file:
-            net.save_graph(tmp_file.name)
-            html_path = tmp_file.name
-
-        components.html(open(html_path, 'r', encoding='utf-8').read(), height=650)
-        os.unlink(html_path)
+        html, node_count, grouped = render_topic_network(selected_topic, kg_utils.graph_version(g))
+        if grouped["summary"]:
+            st.info(f"Demasiados temas para VIZ_NODE_BUDGET={VIZ_NODE_BUDGET}: se muestra un nodo "
+                    f"por tema ({node_count} temas) con su número de artículos.")
+        elif grouped["papers"] or grouped["acknowledgements"]:
+            st.info(f"{node_count} nodos (VIZ_NODE_BUDGET={VIZ_NODE_BUDGET}); agrupados "
+                    f"{grouped['papers']} artículos y {grouped['acknowledgements']} personas y organizaciones.")
+        components.html(html, height=650)
     else:
-        st.warning("No hay datos de temas y artículos para visualizar.")
\ No newline at end of file
+        st.warning("No hay datos de temas y artículos para visualizar.")